@@ -0,0 +1,209 @@
+"""Streaming aggregation of summary statistics over an ensemble of runs."""
+
+import os
+import numpy as np
+import pandas as pd
+from . import outputdata
+from .hosts import STATE_INDEX
+
+
+class RunningStats:
+    """Running mean, variance and quantile sketch of each element of a fixed shape array.
+
+    Mean and variance are updated with Welford's algorithm.  Quantiles are estimated from a
+    histogram of each element, with nbins bins spanning zero to upper (broadcast to shape), so are
+    exact for integer data when upper < nbins and otherwise accurate to within a bin.  Statistics
+    collected separately can be combined with merge.
+    """
+
+    def __init__(self, shape, upper, nbins=100):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.bin_width = np.broadcast_to(
+            np.maximum(np.ceil((np.asarray(upper) + 1) / nbins), 1), shape).copy()
+        self.hist = np.zeros(tuple(shape) + (nbins,), dtype=np.int64)
+
+    def add(self, sample):
+        """Add a single sample array."""
+
+        sample = np.asarray(sample, dtype=float)
+        self.count += 1
+        delta = sample - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (sample - self.mean)
+
+        nbins = self.hist.shape[-1]
+        bins = np.clip(sample // self.bin_width, 0, nbins-1).astype(np.int64).ravel()
+        hist = self.hist.reshape(-1, nbins)
+        hist[np.arange(len(bins)), bins] += 1
+
+    def merge(self, other):
+        """Combine with statistics from a separate set of samples."""
+
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta * delta * (self.count * other.count / count)
+        self.hist += other.hist
+        self.count = count
+
+    def variance(self):
+        """Sample variance of each element, nan if fewer than two samples."""
+
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+        return self.m2 / (self.count - 1)
+
+    def quantile(self, quantile):
+        """Estimate of the given quantile (between 0 and 1) of each element."""
+
+        cumulative = np.cumsum(self.hist, axis=-1)
+        target = np.maximum(quantile * self.count, 1)
+        bins = np.argmax(cumulative >= target, axis=-1)[..., np.newaxis]
+        in_bin = np.take_along_axis(self.hist, bins, axis=-1)[..., 0]
+        before = np.take_along_axis(cumulative, bins, axis=-1)[..., 0] - in_bin
+        fraction = (target - before) / np.maximum(in_bin, 1)
+
+        # Interpolate over the integer values covered by the bin
+        return bins[..., 0] * self.bin_width + fraction * (self.bin_width - 1)
+
+    def get_state(self):
+        return {'count': np.array(self.count), 'mean': self.mean, 'm2': self.m2,
+                'bin_width': self.bin_width, 'hist': self.hist}
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls.__new__(cls)
+        stats.count = int(state['count'])
+        stats.mean = state['mean']
+        stats.m2 = state['m2']
+        stats.bin_width = state['bin_width']
+        stats.hist = state['hist']
+        return stats
+
+
+class EnsembleAggregate:
+    """Ensemble statistics of the number of hosts in each state in each region.
+
+    Statistics are collected for the final state of each run and, if SummaryOutputFreq is non-zero,
+    at each summary time.  Runs are added one at a time from outputdata.run_summary, so per-run data does not
+    need to be kept.  Quantiles to estimate are given by AggregateQuantiles, using AggregateBins
+    histogram bins for each value.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.quantiles = [float(x) for x in params['AggregateQuantiles'].split(",")]
+        self.final = None
+        self.dpc = None
+
+    @property
+    def count(self):
+        if self.final is None:
+            return 0
+        return self.final.count
+
+    def add_run(self, summary):
+        """Add run summary (from outputdata.run_summary) to the statistics."""
+
+        if self.final is None:
+            # Histograms span the number of hosts in each region, which is fixed
+            upper = np.sum(summary['region_counts'], axis=1)[:, np.newaxis]
+            self.final = RunningStats(summary['region_counts'].shape, upper,
+                                      self.params['AggregateBins'])
+            if 'summary_counts' in summary:
+                self.dpc = RunningStats(summary['summary_counts'].shape, upper,
+                                        self.params['AggregateBins'])
+
+        self.final.add(summary['region_counts'])
+        if self.dpc is not None:
+            self.dpc.add(summary['summary_counts'])
+
+    def merge(self, other):
+        """Combine with aggregate of a separate set of runs."""
+
+        if other.final is None:
+            return
+        if self.final is None:
+            self.final = other.final
+            self.dpc = other.dpc
+            return
+
+        self.final.merge(other.final)
+        if self.dpc is not None:
+            self.dpc.merge(other.dpc)
+
+    def save(self, filename):
+        """Save statistics to a .npz file, to be merged later."""
+
+        arrays = {}
+        if self.final is not None:
+            arrays.update({"final_" + key: val for key, val in self.final.get_state().items()})
+        if self.dpc is not None:
+            arrays.update({"dpc_" + key: val for key, val in self.dpc.get_state().items()})
+        with open(filename + ".tmp", "wb") as outfile:
+            np.savez(outfile, **arrays)
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, filename, params):
+        """Read aggregate saved using save."""
+
+        aggregate = cls(params)
+        with np.load(filename) as data:
+            for name in ["final", "dpc"]:
+                state = {key[len(name)+1:]: data[key] for key in data.files
+                         if key.startswith(name + "_")}
+                if state:
+                    setattr(aggregate, name, RunningStats.from_state(state))
+        return aggregate
+
+    def _stats_columns(self, stats):
+        # Statistics for each state as columns, indexed by region as the last axis
+        variance = stats.variance()
+        quantiles = [stats.quantile(quantile) for quantile in self.quantiles]
+        columns = {}
+        for state in list(self.params['Model']) + ["Culled"]:
+            state_idx = STATE_INDEX[state]
+            columns[state + "_mean"] = stats.mean[..., state_idx]
+            columns[state + "_var"] = variance[..., state_idx]
+            for quantile, values in zip(self.quantiles, quantiles):
+                columns[state + "_q" + str(quantile)] = values[..., state_idx]
+        return columns
+
+    def output(self, file_stub="output"):
+        """Output statistics, returning final state and DPC statistics data frames.
+
+        Final state statistics have a row for each region.  DPC statistics are given for each
+        region, with a row for each summary time.
+        """
+
+        return_data = {'niterations': self.count}
+        if self.final is None:
+            return return_data
+
+        final_data = pd.DataFrame({'region': np.arange(self.params['NRegions']),
+                                   **self._stats_columns(self.final)})
+        return_data['final_data'] = final_data
+        if self.params['OutputFiles'] is True:
+            output_path = os.path.split(file_stub)[0]
+            if output_path != "":
+                os.makedirs(output_path, exist_ok=True)
+            outputdata._to_csv(final_data, file_stub + "_final_aggregate.csv")
+
+        if self.dpc is not None:
+            dpc_columns = self._stats_columns(self.dpc)
+            times = np.arange(len(self.dpc.mean)) * self.params['SummaryOutputFreq']
+            summary_data = {}
+            for region in range(self.params['NRegions']):
+                summary_data['Region'+str(region)] = pd.DataFrame(
+                    {'time': times, **{key: val[:, region] for key, val in dpc_columns.items()}})
+                if self.params['OutputFiles'] is True:
+                    outputdata._to_csv(summary_data['Region'+str(region)],
+                                       file_stub + "_DPC_region" + str(region) + "_aggregate.csv")
+            return_data['summary_data'] = summary_data
+
+        return return_data
@@ -0,0 +1,142 @@
+"""Coordination of ensembles split into shards of iterations, through files in a shared directory.
+
+The batch directory holds a manifest listing the shards, a lock file for each shard that has been
+claimed by a worker, and a log file for each shard that has been completed.  All coordination uses
+atomic file creation, so any number of workers on any nodes sharing the directory can run at once
+without a scheduler.  If a worker fails, deleting its shard lock file allows the shard to be claimed
+again.
+"""
+
+import json
+import os
+import socket
+import time as time_mod
+
+MANIFEST_FILE = "manifest.json"
+LOG_HEADER = "Individual Simulator Log File"
+CONFIG_HEADER = "Configuration File Used"
+
+
+def create_manifest(batch_dir, niterations, shard_size, iteration_start=0):
+    """Create the batch manifest, or read the existing manifest if already created.
+
+    Raises ValueError if an existing manifest does not match the requested iterations.
+    """
+
+    os.makedirs(batch_dir, exist_ok=True)
+
+    shards = [[start, min(start+shard_size, iteration_start+niterations)]
+              for start in range(iteration_start, iteration_start+niterations, shard_size)]
+    manifest = {'iteration_start': iteration_start, 'niterations': niterations, 'shards': shards}
+
+    filename = os.path.join(batch_dir, MANIFEST_FILE)
+    temp_filename = filename + "." + worker_id() + ".tmp"
+    with open(temp_filename, "w") as outfile:
+        json.dump(manifest, outfile)
+
+    # Linking fails if the manifest exists, so only the first worker's manifest is used
+    try:
+        os.link(temp_filename, filename)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temp_filename)
+
+    existing = read_manifest(batch_dir)
+    if existing != manifest:
+        raise ValueError("Existing batch manifest does not match requested iterations!")
+
+    return existing
+
+
+def read_manifest(batch_dir):
+    with open(os.path.join(batch_dir, MANIFEST_FILE), "r") as infile:
+        return json.load(infile)
+
+
+def claim_shard(batch_dir, shard):
+    """Attempt to claim a shard, returning True if this worker now holds the shard lock."""
+
+    try:
+        fd = os.open(_lock_filename(batch_dir, shard), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    with os.fdopen(fd, "w") as outfile:
+        outfile.write(worker_id() + " " + time_mod.strftime("%Y-%m-%d %H:%M:%S") + "\n")
+
+    return True
+
+
+def shard_done(batch_dir, shard):
+    return os.path.exists(_log_filename(batch_dir, shard))
+
+
+def write_shard_log(batch_dir, shard, details, log_text):
+    """Mark a shard as completed, by writing its log file.
+
+    details is a summary of the shard run, and log_text the simulator log for the shard.
+    """
+
+    text = "Shard " + str(shard) + "\n" + "#"*35 + "\n\n" + details + "\n\n" + log_text
+
+    filename = _log_filename(batch_dir, shard)
+    with open(filename + ".tmp", "w") as outfile:
+        outfile.write(text)
+    os.replace(filename + ".tmp", filename)
+
+
+def merge_logs(batch_dir, filename):
+    """Combine the shard logs into a single simulator log file.
+
+    The shard details are collected into a section before the configuration, so the merged log can
+    be read in the same way as the log from a single run.  Raises ValueError if any shard is not
+    complete, or shards were run with different configurations.
+    """
+
+    manifest = read_manifest(batch_dir)
+
+    all_details = []
+    log_text = None
+    for shard in range(len(manifest['shards'])):
+        if not shard_done(batch_dir, shard):
+            raise ValueError("Shard {} is not complete!".format(shard))
+
+        with open(_log_filename(batch_dir, shard), "r") as infile:
+            shard_text = infile.read()
+
+        details, shard_log = shard_text.split(LOG_HEADER, 1)
+        all_details.append(details.strip())
+
+        if log_text is None:
+            log_text = shard_log
+        elif shard_log.split(CONFIG_HEADER)[1] != log_text.split(CONFIG_HEADER)[1]:
+            raise ValueError("Shard {} configuration does not match!".format(shard))
+
+    before_config, config_text = log_text.split(CONFIG_HEADER, 1)
+    merged = (LOG_HEADER + before_config + "Shards\n" + "#"*35 + "\n\n" +
+              "\n\n".join(all_details) + "\n\n" + CONFIG_HEADER + config_text)
+
+    # Several workers may merge at once, so each uses its own temporary file
+    temp_filename = filename + "." + worker_id() + ".tmp"
+    with open(temp_filename, "w") as outfile:
+        outfile.write(merged)
+    os.replace(temp_filename, filename)
+
+
+def worker_id():
+    return socket.gethostname() + "_" + str(os.getpid())
+
+
+def aggregate_filename(batch_dir, shard):
+    """File holding the ensemble statistics of a shard, when aggregating runs."""
+
+    return os.path.join(batch_dir, "shard_" + str(shard) + "_aggregate.npz")
+
+
+def _lock_filename(batch_dir, shard):
+    return os.path.join(batch_dir, "shard_" + str(shard) + ".lock")
+
+
+def _log_filename(batch_dir, shard):
+    return os.path.join(batch_dir, "shard_" + str(shard) + ".log")
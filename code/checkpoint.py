@@ -0,0 +1,175 @@
+"""Methods for checkpointing a simulation run part way through, and restoring from checkpoints."""
+
+import os
+import json
+import numpy as np
+from . import hosts
+from .eventlog import EventLog, EVENT_COLUMNS, STATE_NAMES
+
+CHECKPOINT_VERSION = 3
+
+
+def checkpoint_filename(params, iteration=0):
+    """Name of the automatic checkpoint file for an iteration."""
+
+    return params['CheckpointFileStub'] + "_" + str(iteration) + ".chk"
+
+
+def write_checkpoint(parent_sim, filename):
+    """Write the current state of a simulation run to a checkpoint file.
+
+    The file is a numpy .npz archive of the rates, host and cell states, event data and region
+    counts, with a JSON header giving the time, random number generator state and other scalar
+    values.  No simulator objects are stored, so these are rebuilt from the arrays on restore.
+
+    The file is written to a temporary file first and then moved into place, so an existing
+    checkpoint is never left partially written.
+    """
+
+    rate_handler = parent_sim.rate_handler
+    run_params = parent_sim.run_params
+
+    # Output from before the checkpoint must be complete, in case the run is resumed
+    if parent_sim.output_writer is not None:
+        parent_sim.output_writer.flush()
+
+    events = run_params['all_events'].get_state()
+
+    header = {
+        'version': CHECKPOINT_VERSION,
+        'time': float(parent_sim.time),
+        'random_state': parent_sim.random_numbers.get_state(),
+        'rate_factor': [float(factor) for factor in parent_sim.rate_factor],
+        'event_types': rate_handler.event_types,
+        'total_rates': {rate_type: float(rate_handler.all_rates[rate_type].get_total_rate())
+                        for rate_type in rate_handler.event_types},
+        'next_interventions': [None if int_time is None else float(int_time)
+                               for int_time in parent_sim.intervention_handler.next_interventions],
+        'event_chunk_size': events['chunk_size'],
+        'event_spool_stub': events['spool_stub'],
+        'events_flushed': int(events['nflushed']),
+    }
+
+    arrays = {'region_counts': run_params['region_counts']}
+    for rate_type in rate_handler.event_types:
+        arrays['rates_' + rate_type] = rate_handler.get_all_rates(rate_type)
+    for name, column in events['columns'].items():
+        arrays['events_' + name] = column
+
+    if 'next_raster_time' in run_params:
+        header['next_raster_time'] = float(run_params['next_raster_time'])
+    if 'summary_counts' in run_params:
+        header['summary_index'] = int(run_params['summary_index'])
+        arrays['summary_counts'] = run_params['summary_counts']
+    if run_params.get('host_sets') is not None:
+        arrays['host_set_members'] = run_params['host_sets'].flat_members()
+
+    if parent_sim.all_hosts is not None:
+        arrays['host_states'], host_transitions = _pack_hosts(parent_sim.all_hosts)
+        for name, column in host_transitions.items():
+            arrays['transitions_' + name] = column
+
+    if parent_sim.all_cells is not None:
+        arrays['cell_counts'] = parent_sim.params['cell_counts']
+
+    # Interventions can store any other state as a dictionary of arrays
+    for i, intervention in enumerate(parent_sim.intervention_handler.interventions):
+        if hasattr(intervention, "get_state"):
+            for key, val in intervention.get_state().items():
+                arrays['intervention' + str(i) + '_' + key] = val
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as outfile:
+        np.savez(outfile, header=np.array(json.dumps(header)), **arrays)
+    os.replace(temp_filename, filename)
+
+
+def read_checkpoint(parent_sim, filename):
+    """Restore the state of a simulation run from a checkpoint file.
+
+    The simulator must already be setup with the same parameters as the checkpointed run.  Rate
+    structures, host sets and the event log are rebuilt from the stored arrays.  Runs using the
+    rateCR or rategroup rate structures continue with the same rates, but may select events in a
+    different order to an uninterrupted run, as these depend on the order rates were inserted.
+    """
+
+    with np.load(filename, allow_pickle=False) as data:
+        header = json.loads(str(data['header']))
+        arrays = {key: data[key] for key in data.files if key != 'header'}
+
+    if header['version'] != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version: {}!".format(header['version']))
+
+    rate_handler = parent_sim.rate_handler
+    if header['event_types'] != rate_handler.event_types:
+        raise ValueError("Checkpoint rate structures do not match simulator setup!")
+
+    parent_sim.all_hosts = parent_sim.params['init_hosts']
+    parent_sim.all_cells = parent_sim.params['init_cells']
+
+    parent_sim.time = header['time']
+    parent_sim.random_numbers.set_state(header['random_state'])
+    parent_sim.rate_factor = header['rate_factor']
+
+    for rate_type in rate_handler.event_types:
+        rate_handler.set_all_rates(arrays['rates_' + rate_type], rate_type,
+                                   total_rate=header['total_rates'][rate_type])
+
+    if parent_sim.all_hosts is not None:
+        _unpack_hosts(parent_sim.all_hosts, arrays['host_states'], {
+            name: arrays['transitions_' + name] for name in ['host', 'time', 'oldState',
+                                                             'newState']})
+
+    if parent_sim.all_cells is not None:
+        np.copyto(parent_sim.params['cell_counts'], arrays['cell_counts'])
+
+    run_params = {'region_counts': arrays['region_counts']}
+    run_params['all_events'] = EventLog(writer=parent_sim.output_writer)
+    run_params['all_events'].set_state({
+        'chunk_size': header['event_chunk_size'], 'spool_stub': header['event_spool_stub'],
+        'nflushed': header['events_flushed'],
+        'columns': {name: arrays['events_' + name] for name, _ in EVENT_COLUMNS}})
+
+    if 'next_raster_time' in header:
+        run_params['next_raster_time'] = header['next_raster_time']
+    if 'summary_index' in header:
+        run_params['summary_index'] = header['summary_index']
+        run_params['summary_counts'] = arrays['summary_counts']
+    if parent_sim.event_handler.track_host_sets:
+        host_sets = hosts.HostStateSets(parent_sim.params['host_regions'],
+                                        parent_sim.params['NRegions'])
+        host_sets.reset(arrays['host_states'], order=arrays['host_set_members'])
+        run_params['host_sets'] = host_sets
+    parent_sim.run_params = run_params
+
+    intervention_handler = parent_sim.intervention_handler
+    intervention_handler.next_interventions = header['next_interventions']
+    for i, intervention in enumerate(intervention_handler.interventions):
+        if hasattr(intervention, "set_state"):
+            prefix = 'intervention' + str(i) + '_'
+            intervention.set_state({key[len(prefix):]: val for key, val in arrays.items()
+                                    if key.startswith(prefix)})
+    intervention_handler.attach_run_data()
+
+
+def _state_names(indices):
+    return STATE_NAMES[indices].tolist()
+
+
+def _pack_hosts(all_hosts):
+    """Current host states, and all host transitions as flat (host, time, old, new) arrays."""
+
+    return hosts.get_host_states(all_hosts), hosts.get_host_transitions(all_hosts)
+
+
+def _unpack_hosts(all_hosts, host_states, host_transitions):
+    for host, state in zip(all_hosts, _state_names(host_states)):
+        host.state = state
+        host.trans_times = []
+
+    transitions = zip(host_transitions['host'].tolist(), host_transitions['time'].tolist(),
+                      _state_names(host_transitions['oldState']),
+                      _state_names(host_transitions['newState']))
+
+    for i, time, old_state, new_state in transitions:
+        all_hosts[i].trans_times.append((time, old_state, new_state))
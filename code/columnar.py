@@ -0,0 +1,129 @@
+"""Reading and writing of output data as typed columns in binary formats.
+
+Two binary formats are supported:
+    npy:        A directory holding one .npy file per column, which can be memory-mapped on reading.
+    parquet:    A Parquet file, only available if pyarrow is installed.  Reads are memory-mapped.
+"""
+
+import os
+import shutil
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+OUTPUT_FORMATS = ["csv", "npy", "parquet"]
+FILE_EXTENSIONS = {"csv": ".csv", "npy": "", "parquet": ".parquet"}
+
+# File listing column names in order, within npy format directories
+COLUMNS_FILE = "columns.txt"
+
+
+def check_format(output_format):
+    """Raise an error if output_format is not a supported format."""
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unrecognised OutputFormat: {}!".format(output_format))
+
+    if output_format == "parquet" and pyarrow is None:
+        raise ImportError("OutputFormat parquet requires pyarrow!")
+
+
+class ColumnWriter:
+    """Writer for a table of typed columns, which can be written a chunk of rows at a time.
+
+    Data is written to a temporary file and moved into place on close, so an existing output file
+    is always complete.
+
+    Arguments:
+        filename:       Output file name (directory name for npy format).
+        output_format:  Binary format to write, npy or parquet.
+        dtypes:         List of (column name, dtype) pairs.
+        nrows:          Total number of rows to write.  Only required for npy format.
+    """
+
+    def __init__(self, filename, output_format, dtypes, nrows=None):
+        check_format(output_format)
+        self.filename = filename
+        self.output_format = output_format
+        self.dtypes = [(name, np.dtype(dtype)) for name, dtype in dtypes]
+        self._temp_filename = filename + ".tmp"
+        self._row = 0
+
+        if output_format == "npy":
+            if os.path.exists(self._temp_filename):
+                shutil.rmtree(self._temp_filename)
+            os.makedirs(self._temp_filename)
+            self._arrays = {
+                name: np.lib.format.open_memmap(
+                    os.path.join(self._temp_filename, name + ".npy"), mode="w+", dtype=dtype,
+                    shape=(nrows,))
+                for name, dtype in self.dtypes
+            }
+        elif output_format == "parquet":
+            schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtype))
+                                     for name, dtype in self.dtypes])
+            self._writer = pyarrow.parquet.ParquetWriter(self._temp_filename, schema)
+        else:
+            raise ValueError("ColumnWriter only writes binary formats!")
+
+    def write(self, columns):
+        """Write the next chunk of rows, from a dictionary of column arrays."""
+
+        nrows = len(columns[self.dtypes[0][0]])
+
+        if self.output_format == "npy":
+            for name, _ in self.dtypes:
+                self._arrays[name][self._row:self._row+nrows] = columns[name]
+        else:
+            self._writer.write_table(pyarrow.table(
+                {name: np.asarray(columns[name], dtype=dtype) for name, dtype in self.dtypes}))
+
+        self._row += nrows
+
+    def close(self):
+        if self.output_format == "npy":
+            for array in self._arrays.values():
+                array.flush()
+            self._arrays = None
+            with open(os.path.join(self._temp_filename, COLUMNS_FILE), "w") as outfile:
+                outfile.write("\n".join(name for name, _ in self.dtypes) + "\n")
+            if os.path.exists(self.filename):
+                shutil.rmtree(self.filename)
+            os.replace(self._temp_filename, self.filename)
+        else:
+            self._writer.close()
+            os.replace(self._temp_filename, self.filename)
+
+
+def write_columns(columns, filename, output_format, dtypes=None):
+    """Write dictionary of column arrays in one go.  By default column types are kept."""
+
+    if dtypes is None:
+        dtypes = [(name, np.asarray(values).dtype) for name, values in columns.items()]
+
+    writer = ColumnWriter(filename, output_format, dtypes, nrows=len(columns[dtypes[0][0]]))
+    writer.write(columns)
+    writer.close()
+
+
+def read_columns(filename, output_format, mmap=True):
+    """Read table of typed columns as dictionary of arrays, memory-mapped if mmap is True."""
+
+    check_format(output_format)
+
+    if output_format == "npy":
+        with open(os.path.join(filename, COLUMNS_FILE), "r") as infile:
+            names = infile.read().split()
+        return {name: np.load(os.path.join(filename, name + ".npy"),
+                              mmap_mode="r" if mmap else None)
+                for name in names}
+
+    if output_format == "parquet":
+        table = pyarrow.parquet.read_table(filename, memory_map=mmap)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+
+    raise ValueError("read_columns only reads binary formats!")
@@ -45,6 +45,10 @@ default_config = OrderedDict([
                          int)),
         ('NRegions', (False, 1, "Number of distinct regions.", int)),
         ('MaxHosts', (False, 100, "Maximum number of hosts per cell in raster model.", int)),
+        ('Seed', (False, None, "Seed for random number generation.  Each iteration uses an "
+                  "independent stream derived from this seed and the iteration number, so "
+                  "results are reproducible however iterations are split between runs.  "
+                  "Default: unseeded", int)),
     ])),
     ('Output', OrderedDict([
         ('OutputHostData', (False, True, "Whether to output transition times for each host.",
@@ -53,24 +57,74 @@ default_config = OrderedDict([
                              bool)),
         ('RasterOutputFreq', (True, 0.2, "How often to output raster of simulation state.  "
                               "Set to zero to suppress output.", float)),
+        ('SummaryOutputFreq', (False, 0.0, "How often to record the number of hosts in each state "
+                               "in each region (disease progress curves).  Counts are kept up to "
+                               "date during the run, so no event data is needed.  Set to zero to "
+                               "suppress output.", float)),
         ('OutputFiles', (False, True, "Whether to output data to files.  "
                          "If False only python objects are returned.", bool)),
         ('OutputFileStub', (False, "output", "File path stub for output files", str)),
+        ('OutputFormat', (False, "csv", "File format for host and event data: csv, npy or "
+                          "parquet.  The binary formats store typed columns, with states as "
+                          "indices into the list S, E, C, D, I, R, Culled, and host transitions as "
+                          "a separate table.  npy writes a directory with a memory-mappable .npy "
+                          "file for each column; parquet requires pyarrow.", str)),
         ('RasterFileStub', (False, "raster_output", "File path stub for output raster files", str)),
         ('RasterStatesOutput', (False, None, "States to output rasters of", str)),
+        ('RasterOutputCube', (False, False, "Whether to write raster output for each iteration "
+                              "to a single memory-mapped .npy array of shape (time, state, row, "
+                              "col), instead of a raster file per state and time.", bool)),
+        ('EventChunkSize', (False, 10000, "Number of events recorded before being stored as a "
+                            "chunk of typed columns.", int)),
+        ('StreamEvents', (False, False, "Whether to write chunks of event data to spool files "
+                          "under OutputFileStub during each run, so memory use is bounded by "
+                          "EventChunkSize.  Event data is then only written to the output files, "
+                          "and not returned from the run.", bool)),
+        ('BackgroundOutput', (False, False, "Whether to write raster files and streamed event "
+                              "data from a background thread, so the simulation does not wait for "
+                              "file writes.", bool)),
+        ('OutputQueueSize', (False, 16, "Maximum number of pending background writes.  When "
+                             "full the simulation waits for the writer to catch up.", int)),
+        ('AggregateRuns', (False, False, "Whether to combine each iteration into running "
+                           "ensemble statistics (mean, variance and quantiles) of the final and "
+                           "SummaryOutputFreq numbers of hosts in each state in each region, as it "
+                           "completes.  Host, event and DPC data for each iteration are then "
+                           "discarded, and only the ensemble statistics are returned and output.",
+                           bool)),
+        ('AggregateQuantiles', (False, "0.05,0.5,0.95", "Comma separated list of quantiles to "
+                                "estimate when AggregateRuns is True.", str)),
+        ('AggregateBins', (False, 100, "Number of histogram bins used to estimate quantiles of "
+                           "each value when AggregateRuns is True.  Quantiles are exact if each "
+                           "region has fewer hosts than this.", int)),
+        ('CheckpointInterval', (False, 0.0, "Wall-clock time in seconds between automatic "
+                                "checkpoints of each run.  If a checkpoint exists when an "
+                                "iteration is started, the run is resumed from it.  Set to zero "
+                                "to disable checkpointing.", float)),
+        ('CheckpointFileStub', (False, "checkpoint", "File path stub for checkpoint files", str)),
     ])),
     ('Optimisation', OrderedDict([
         ('SaveSetup', (False, True, "Whether or not to save the initial rates and states to re-use."
-                       " This can be slower for large numbers of hosts.", bool)),
+                       "  If False setup is re-run for every iteration.", bool)),
         ('CacheKernel', (False, False, "Whether or not to cache the full "
                          "kernel at the start of the simulation", bool)),
+        ('NProcesses', (False, 1, "Number of worker processes to run iterations in parallel.  "
+                        "Setup is run once and shared between the workers.", int)),
+        ('CountOnlyRaster', (False, False, "Whether raster simulations should only track the "
+                             "number of hosts in each state in each cell, rather than individual "
+                             "hosts.  Host data cannot be output in this mode, and only a "
+                             "single region is supported.", bool)),
+        ('RandomBlockSize', (False, 10000, "Number of random numbers to generate at a time.  "
+                             "Larger blocks reduce the overhead of random number generation.",
+                             int)),
         ('RateStructure-Infection', (False, "ratesum",
                                      "Which rate structure to use for infection events.  Options "
                                      "are: ratesum, rateinterval, ratetree, rateCR",
                                      str)),
         ('RateStructure-Advance', (False, "ratesum",
                                    "Which rate structure to use for advance events.  Options are: "
-                                   "ratesum, rateinterval, ratetree, rateCR",
+                                   "ratesum, rateinterval, ratetree, rateCR, rategroup.  rategroup "
+                                   "groups hosts by state, so is only valid for INDIVIDUAL "
+                                   "simulations.",
                                    str)),
     ])),
     ('Interventions', OrderedDict([
@@ -201,3 +255,7 @@ def check_params_valid(params):
                                     "{2}".format(key, def_val[3], type(params[key])))
             else:
                 raise KeyError("Missing parameter key {0}".format(key))
+
+    if (params['SimulationType'] == "RASTER" and params['CountOnlyRaster'] is True and
+            params['NRegions'] > 1):
+        raise ValueError("CountOnlyRaster simulations only support a single region!")
@@ -1,7 +1,9 @@
 """Module for handling events in Individual Epidemic Simulator."""
 
 import pdb
+import itertools
 import numpy as np
+from .hosts import ALL_STATES, STATE_INDEX, cell_state_id, get_host_states
 
 class EventHandler:
     """Class to carry out all events on hosts and cells."""
@@ -10,6 +12,15 @@ class EventHandler:
         self.parent_sim = parent_sim
         self.rate_handler = rate_handler
         self.cache_kernel = self.parent_sim.params["CacheKernel"]
+        self.record_events = (self.parent_sim.params["OutputEventData"] is True and
+                              self.parent_sim.params["AggregateRuns"] is not True)
+        # Region counts give the DPCs, and the final state for ensemble statistics
+        self.track_regions = (self.parent_sim.params["SummaryOutputFreq"] > 0 or
+                              self.parent_sim.params["AggregateRuns"] is True)
+        # Sets of hosts in each state in each region are kept for interventions to use, when
+        # individual hosts are simulated
+        self.track_host_sets = (self.parent_sim.params["InterventionScripts"] is not None and
+                                self.parent_sim.params["CountOnlyRaster"] is not True)
 
         if self.parent_sim.params['SimulationType'] == "INDIVIDUAL":
             self.do_event_advance = self.do_event_standard
@@ -21,8 +32,13 @@ class EventHandler:
                 self.kernel = self.kernel_uncached
 
         elif self.parent_sim.params['SimulationType'] == "RASTER":
-            self.do_event_advance = self.do_event_adv_raster
-            self.do_event_infection = self.do_event_inf_raster
+            if self.parent_sim.params['CountOnlyRaster'] is True:
+                self.do_event_advance = self.do_event_adv_counts
+                self.do_event_infection = self.do_event_inf_counts
+                self.do_event_cull = self.do_event_cull_counts
+            else:
+                self.do_event_advance = self.do_event_adv_raster
+                self.do_event_infection = self.do_event_inf_raster
 
             self.kernel = self.kernel_raster
 
@@ -89,10 +105,13 @@ class EventHandler:
 
         all_hosts[host_id].update_state(new_state, self.parent_sim.time)
 
-        self.parent_sim.run_params['all_events'].append(
-            (self.parent_sim.time, host_id, old_state, new_state))
-        # self.parent_sim.run_params['region_summary'][all_hosts[host_id].reg][old_state] -= 1
-        # self.parent_sim.run_params['region_summary'][all_hosts[host_id].reg][new_state] += 1
+        if self.record_events:
+            self.parent_sim.run_params['all_events'].append(
+                self.parent_sim.time, host_id, old_state, new_state)
+        if self.track_regions:
+            self.update_region_counts(host_id, None, old_state, new_state)
+        if self.track_host_sets:
+            self.parent_sim.run_params['host_sets'].move(host_id, old_state, new_state)
 
         return (host_id, None, old_state, new_state)
 
@@ -121,6 +140,10 @@ class EventHandler:
 
         # self.parent_sim.run_params['all_events'].append(
         #     (self.parent_sim.time, host_id, old_state, new_state))
+        if self.track_regions:
+            self.update_region_counts(host_id, None, old_state, new_state)
+        if self.track_host_sets:
+            self.parent_sim.run_params['host_sets'].move(host_id, old_state, new_state)
 
         return (host_id, cell.cell_id, old_state, new_state)
 
@@ -158,28 +181,113 @@ class EventHandler:
 
         # self.parent_sim.run_params['all_events'].append(
         #     (self.parent_sim.time, host_id, "S", new_state))
+        if self.track_regions:
+            self.update_region_counts(host_id, None, "S", new_state)
+        if self.track_host_sets:
+            self.parent_sim.run_params['host_sets'].move(host_id, "S", new_state)
 
         return (host_id, cell_id, "S", new_state)
 
+    def do_event_adv_counts(self, event_id, all_hosts, all_cells):
+        """Carry out advance event in raster model, when only tracking cell state counts.
+
+        The event_id identifies the cell and the state of the advancing host (see
+        hosts.cell_state_id).
+        """
+
+        cell_id, state_idx = divmod(event_id, len(ALL_STATES))
+        old_state = ALL_STATES[state_idx]
+        new_state = self.parent_sim.params['next_state'](old_state)
+
+        cell = all_cells[cell_id]
+        cell.update(old_state, new_state)
+
+        self.update_advance_counts(cell, old_state)
+        if new_state in "ECDI":
+            self.update_advance_counts(cell, new_state)
+        if new_state == "R":
+            # Distribute rate changes to coupled cells
+            self.distribute_removal_cell(cell_id, all_cells)
+
+        if new_state in "CI":
+            # Distribute rate changes to coupled cells
+            self.distribute_infection_cell(cell_id, all_cells)
+
+        if self.track_regions:
+            self.update_region_counts(None, cell_id, old_state, new_state)
+
+        return (None, cell_id, old_state, new_state)
+
+    def do_event_inf_counts(self, cell_id, all_hosts, all_cells):
+        """Carry out infection event in raster model, when only tracking cell state counts."""
+
+        cell = all_cells[cell_id]
+
+        nsus = cell.states["S"]
+        if nsus <= 0:
+            raise ValueError("No susceptibles to infect!\n" + str(cell.states))
+
+        new_state = self.parent_sim.params['next_state']("S")
+        cell.update("S", new_state)
+
+        old_inf_rate = self.rate_handler.get_rate(cell_id, "Infection")
+        new_inf_rate = old_inf_rate * ((nsus - 1) / nsus)
+        self.rate_handler.insert_rate(cell_id, new_inf_rate, "Infection")
+
+        if new_state in "ECDI":
+            self.update_advance_counts(cell, new_state)
+
+        if new_state in "CI":
+            # Distribute rate changes to coupled cells
+            self.distribute_infection_cell(cell_id, all_cells)
+
+        if self.track_regions:
+            self.update_region_counts(None, cell_id, "S", new_state)
+
+        return (None, cell_id, "S", new_state)
+
+    def update_advance_counts(self, cell, state):
+        """Set advance rate for hosts of given state in cell, when only tracking state counts."""
+
+        if state in "ECDI":
+            self.rate_handler.insert_rate(
+                cell_state_id(cell.cell_id, state),
+                cell.states[state] * self.parent_sim.params[state + 'AdvRate'], "Advance")
+
+    def update_region_counts(self, host_id, cell_id, old_state, new_state):
+        """Move one host between states in the count of hosts in each state in each region.
+
+        The region is found from host_id, or from cell_id if only tracking cell state counts.
+        """
+
+        if host_id is None:
+            region = self.parent_sim.params['cell_regions'][cell_id]
+        else:
+            region = self.parent_sim.params['host_regions'][host_id]
+
+        region_counts = self.parent_sim.run_params['region_counts']
+        region_counts[region, STATE_INDEX[old_state]] -= 1
+        region_counts[region, STATE_INDEX[new_state]] += 1
+
     def do_event_sporulation(self, cell_id, all_hosts, all_cells, debug=False):
         """Carry out sporulation event in raster model."""
 
-        selection_val = np.random.random_sample()
+        random_numbers = self.parent_sim.random_numbers
+
+        selection_val = random_numbers.uniform()
         selected_idx = self.parent_sim.params['vs_kernel'].select_event(selection_val)
 
         kernel_shape = self.parent_sim.params['kernel'].shape
         kernel_pos = np.unravel_index(selected_idx, kernel_shape)
         cell_rel_pos = [kernel_pos[i] - int(kernel_shape[i]/2) for i in range(2)]
 
-        random_num = np.random.random_sample()
-
         cell_pos = tuple(item1 + item2 for item1, item2
                          in zip(all_cells[cell_id].cell_position, cell_rel_pos))
 
         cell_id = self.parent_sim.params['cell_map'].get(cell_pos, None)
 
         if cell_id is not None:
-            random_num = np.random.random_sample()
+            random_num = random_numbers.uniform()
             infection_prob = all_cells[cell_id].susceptibility * (
                 all_cells[cell_id].states["S"] / self.parent_sim.params['MaxHosts'])
             if random_num < infection_prob:
@@ -220,12 +328,222 @@ class EventHandler:
 
         # self.parent_sim.run_params['all_events'].append(
         #     (self.parent_sim.time, host_id, old_state, new_state))
-        # self.parent_sim.run_params['region_summary'][all_hosts[host_id].reg][old_state] -= 1
-        # self.parent_sim.run_params['region_summary'][all_hosts[host_id].reg][new_state] += 1
-
+        if self.track_regions:
+            self.update_region_counts(host_id, None, old_state, new_state)
+        if self.track_host_sets:
+            self.parent_sim.run_params['host_sets'].move(host_id, old_state, new_state)
 
         return (host_id, cell_id, old_state, new_state)
 
+    def do_event_cull_counts(self, event_id, all_hosts, all_cells):
+        """Carry out cull intervention on one host, when only tracking cell state counts.
+
+        The event_id identifies the cell and the state of the host to cull (see
+        hosts.cell_state_id).
+        """
+
+        cell_id, state_idx = divmod(event_id, len(ALL_STATES))
+        old_state = ALL_STATES[state_idx]
+        new_state = "Culled"
+
+        cell = all_cells[cell_id]
+        if cell.states[old_state] <= 0:
+            raise ValueError("No hosts in state {} to cull!\n".format(old_state) +
+                             str(cell.states))
+
+        nsus = cell.states["S"]
+        cell.update(old_state, new_state)
+        self.update_advance_counts(cell, old_state)
+
+        if old_state == "S":
+            old_inf_rate = self.rate_handler.get_rate(cell_id, "Infection")
+            new_inf_rate = old_inf_rate * ((nsus - 1) / nsus)
+            self.rate_handler.insert_rate(cell_id, new_inf_rate, "Infection")
+
+        if old_state in "CI":
+            # Distribute rate changes
+            self.distribute_removal_cell(cell_id, all_cells)
+
+        if self.track_regions:
+            self.update_region_counts(None, cell_id, old_state, new_state)
+
+        return (None, cell_id, old_state, new_state)
+
+    def do_event_cull_batch(self, event_ids, all_hosts, all_cells):
+        """Carry out cull intervention on many hosts at once.
+
+        All host states are changed first, and the net rate changes from every culled host are then
+        applied together, instead of distributing rate changes after each cull.  Event IDs are as
+        for do_event_cull, or do_event_cull_counts when only tracking cell state counts.  Returns
+        list of events carried out.
+        """
+
+        if self.parent_sim.params['SimulationType'] == "INDIVIDUAL":
+            return self._cull_batch_individual(event_ids, all_hosts)
+        return self._cull_batch_raster(event_ids, all_hosts, all_cells)
+
+    def _cull_batch_individual(self, host_ids, all_hosts):
+        """Cull hosts in Individual model, then remove infection from culled C/I hosts."""
+
+        events = []
+        removed = []
+        for host_id in host_ids:
+            old_state = all_hosts[host_id].state
+            all_hosts[host_id].update_state("Culled", self.parent_sim.time)
+            if old_state in "CI":
+                removed.append(host_id)
+
+            if self.track_regions:
+                self.update_region_counts(host_id, None, old_state, "Culled")
+            if self.track_host_sets:
+                self.parent_sim.run_params['host_sets'].move(host_id, old_state, "Culled")
+            events.append((host_id, None, old_state, "Culled"))
+
+        culled = np.unique(np.asarray(host_ids, dtype=np.int64))
+        self.rate_handler.bulk_update(culled, np.zeros(len(culled)), "Advance")
+        self.rate_handler.bulk_update(culled, np.zeros(len(culled)), "Infection")
+
+        if removed:
+            sus_ids = self._susceptible_hosts(all_hosts)
+            if len(sus_ids) > 0:
+                if self.cache_kernel is True:
+                    rate_change = np.sum(
+                        self.parent_sim.params['kernel_vals'][np.ix_(sus_ids, removed)], axis=1)
+                else:
+                    rate_change = np.array([sum(self.kernel(sus_id, host_id) for host_id in removed)
+                                            for sus_id in sus_ids.tolist()])
+                old_rates = self.rate_handler.get_rates(sus_ids, "Infection")
+                self.rate_handler.bulk_update(sus_ids, old_rates - rate_change, "Infection")
+
+        return events
+
+    def _susceptible_hosts(self, all_hosts):
+        """Array of IDs of all hosts currently susceptible."""
+
+        if self.track_host_sets:
+            host_sets = self.parent_sim.run_params['host_sets']
+            sus_ids = [host_sets.hosts(region, "S") for region in range(host_sets.nregions)]
+            return np.fromiter(itertools.chain.from_iterable(sus_ids), dtype=np.int64)
+        return np.flatnonzero(get_host_states(all_hosts) == STATE_INDEX["S"])
+
+    def _cull_batch_raster(self, event_ids, all_hosts, all_cells):
+        """Cull hosts in Raster model, then update infection rates of affected cells together."""
+
+        nstates = len(ALL_STATES)
+        events = []
+        # Number of susceptibles in each cell before any culls, and culled C/I hosts in each cell
+        nsus_before = {}
+        nremoved = {}
+        culled = []
+
+        for event_id in event_ids:
+            if all_hosts is None:
+                host_id = None
+                cell_id, state_idx = divmod(event_id, nstates)
+                old_state = ALL_STATES[state_idx]
+                cell = all_cells[cell_id]
+                if cell.states[old_state] <= 0:
+                    raise ValueError("No hosts in state {} to cull!\n".format(old_state) +
+                                     str(cell.states))
+            else:
+                host_id = event_id
+                old_state = all_hosts[host_id].state
+                cell_id = all_hosts[host_id].cell_id
+                cell = all_cells[cell_id]
+                all_hosts[host_id].update_state("Culled", self.parent_sim.time)
+                culled.append(host_id)
+
+            if cell_id not in nsus_before:
+                nsus_before[cell_id] = cell.states["S"]
+            cell.update(old_state, "Culled")
+            if host_id is None:
+                self.update_advance_counts(cell, old_state)
+            if old_state in "CI":
+                nremoved[cell_id] = nremoved.get(cell_id, 0) + 1
+
+            if self.track_regions:
+                self.update_region_counts(host_id, cell_id, old_state, "Culled")
+            if self.track_host_sets:
+                self.parent_sim.run_params['host_sets'].move(host_id, old_state, "Culled")
+            events.append((host_id, cell_id, old_state, "Culled"))
+
+        if culled:
+            culled = np.unique(np.asarray(culled, dtype=np.int64))
+            self.rate_handler.bulk_update(culled, np.zeros(len(culled)), "Advance")
+
+        self.distribute_cull_cells(nsus_before, nremoved, all_cells)
+
+        return events
+
+    def distribute_cull_cells(self, nsus_before, nremoved, all_cells):
+        """Update infection rates after culling hosts from cells in Raster model.
+
+        Arguments:
+            nsus_before:    Dictionary of cells culled from, giving number of susceptible hosts
+                            before culling
+            nremoved:       Dictionary of number of infectious (C or I) hosts culled from each cell
+
+        Infection rate of a cell is its number of susceptibles multiplied by the infectious pressure
+        on it, so rates are scaled by the change in susceptibles, and the pressure from all culled
+        infectious hosts is removed in one pass over the coupled positions.
+        """
+
+        params = self.parent_sim.params
+        ncols = params['header']['ncols']
+        nrows = params['header']['nrows']
+
+        target_ids = np.fromiter(nsus_before.keys(), dtype=np.int64, count=len(nsus_before))
+        pressure = np.zeros(len(target_ids))
+
+        if nremoved:
+            source_ids = np.fromiter(nremoved.keys(), dtype=np.int64, count=len(nremoved))
+            weights = np.fromiter(nremoved.values(), dtype=float, count=len(nremoved)) * [
+                all_cells[cell_id].infectiousness for cell_id in source_ids.tolist()]
+
+            offsets = np.array(params['coupled_positions'], dtype=np.int64)
+            centre = [int(x/2) for x in params['coupled_kernel'].shape]
+            kernel_vals = params['coupled_kernel'][offsets[:, 0] + centre[0],
+                                                   offsets[:, 1] + centre[1]]
+
+            rows, cols = np.divmod(params['cell_grid_index'][source_ids], ncols)
+            target_rows = rows[:, np.newaxis] + offsets[np.newaxis, :, 0]
+            target_cols = cols[:, np.newaxis] + offsets[np.newaxis, :, 1]
+            valid = ((target_rows >= 0) & (target_rows < nrows) &
+                     (target_cols >= 0) & (target_cols < ncols))
+            coupled_ids = np.full(valid.shape, -1, dtype=np.int64)
+            coupled_ids[valid] = params['grid_cell_ids'][
+                target_rows[valid] * ncols + target_cols[valid]]
+            valid &= coupled_ids >= 0
+
+            # Combine pressure on each coupled cell, with cells culled from
+            target_ids, inverse = np.unique(
+                np.concatenate([target_ids, coupled_ids[valid]]), return_inverse=True)
+            pressure = np.bincount(
+                inverse, weights=np.concatenate([
+                    pressure, (weights[:, np.newaxis] * kernel_vals[np.newaxis, :])[valid]]),
+                minlength=len(target_ids))
+
+            if params['VirtualSporulationStart'] is not None:
+                self.rate_handler.bulk_update(
+                    source_ids, [(all_cells[cell_id].states["C"] + all_cells[cell_id].states["I"]) *
+                                 all_cells[cell_id].infectiousness
+                                 for cell_id in source_ids.tolist()], "Sporulation")
+
+        if len(target_ids) == 0:
+            return
+
+        target_cells = [all_cells[cell_id] for cell_id in target_ids.tolist()]
+        nsus = np.array([cell.states["S"] for cell in target_cells], dtype=float)
+        nsus_old = np.array([nsus_before.get(cell.cell_id, cell.states["S"])
+                             for cell in target_cells], dtype=float)
+        susceptibility = np.array([cell.susceptibility for cell in target_cells], dtype=float)
+
+        old_rates = self.rate_handler.get_rates(target_ids, "Infection")
+        scale = np.divide(nsus, nsus_old, out=np.zeros_like(nsus), where=nsus_old > 0)
+        new_rates = old_rates * scale - (
+            pressure * susceptibility * nsus / params['MaxHosts'])
+        self.rate_handler.bulk_update(target_ids, new_rates, "Infection")
+
     def distribute_infection_individual(self, host_id, all_hosts):
         """Host has just become infectious - distribute rate changes in Individual model."""
 
@@ -239,7 +557,12 @@ class EventHandler:
     def distribute_infection_raster(self, host_id, all_hosts, all_cells):
         """Host has just become infectious - distribute rate changes in Raster model."""
 
-        cell = all_cells[all_hosts[host_id].cell_id]
+        self.distribute_infection_cell(all_hosts[host_id].cell_id, all_cells)
+
+    def distribute_infection_cell(self, cell_id, all_cells):
+        """Host in cell has just become infectious - distribute rate changes in Raster model."""
+
+        cell = all_cells[cell_id]
 
         # Update sporulation rate
         if self.parent_sim.params['VirtualSporulationStart'] is not None:
@@ -275,7 +598,12 @@ class EventHandler:
     def distribute_removal_raster(self, host_id, all_hosts, all_cells):
         """Host has just lost infectivity - distribute rate changes in Raster model."""
 
-        cell = all_cells[all_hosts[host_id].cell_id]
+        self.distribute_removal_cell(all_hosts[host_id].cell_id, all_cells)
+
+    def distribute_removal_cell(self, cell_id, all_cells):
+        """Host in cell has just lost infectivity - distribute rate changes in Raster model."""
+
+        cell = all_cells[cell_id]
 
         # Update sporulation rate
         if self.parent_sim.params['VirtualSporulationStart'] is not None:
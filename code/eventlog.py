@@ -0,0 +1,181 @@
+"""Storage of state change events recorded during a simulation run."""
+
+import os
+import numpy as np
+from .hosts import ALL_STATES, STATE_INDEX
+
+# Column names and types for stored events.  States are stored as indices into ALL_STATES, with -1
+# for no state.
+EVENT_COLUMNS = [("time", np.float64), ("hostID", np.int64), ("oldState", np.int8),
+                 ("newState", np.int8)]
+
+# Lookup from state index to state name, with index -1 giving None
+STATE_NAMES = np.array(ALL_STATES + [None], dtype=object)
+
+
+class EventLog:
+    """Record of events, stored in typed columnar chunks.
+
+    Events are appended to the current chunk, and once chunk_size events have been recorded the
+    chunk is converted to typed numpy columns.  Completed chunks are kept in memory or, if
+    spool_stub is given, appended to one binary file per column
+    (spool_stub + "." + column + ".spool") and discarded, so that memory use is bounded by the
+    chunk size.  Spool files are written by writer if given (see outputwriter.BackgroundWriter),
+    otherwise directly.
+
+    Iterating over the log gives (time, hostID, oldState, newState) tuples.
+    """
+
+    def __init__(self, chunk_size=10000, spool_stub=None, writer=None):
+        self.chunk_size = chunk_size
+        self.spool_stub = spool_stub
+        self.writer = writer
+        self.nflushed = 0
+        self._chunks = []
+        self._new_chunk()
+
+    def _new_chunk(self):
+        self._times = []
+        self._host_ids = []
+        self._old_states = []
+        self._new_states = []
+
+    def append(self, time, host_id, old_state, new_state):
+        self._times.append(time)
+        self._host_ids.append(host_id)
+        self._old_states.append(STATE_INDEX.get(old_state, -1))
+        self._new_states.append(STATE_INDEX.get(new_state, -1))
+
+        if len(self._times) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Store the current chunk as typed columns, writing to the spool files if used."""
+
+        if not self._times:
+            return
+
+        chunk = {
+            name: np.array(values, dtype=dtype) for (name, dtype), values in zip(
+                EVENT_COLUMNS, [self._times, self._host_ids, self._old_states, self._new_states])
+        }
+        self._new_chunk()
+
+        if self.spool_stub is None:
+            self._chunks.append(chunk)
+            return
+
+        # Spool files are overwritten by the first chunk of a run
+        mode = "ab" if self.nflushed > 0 else "wb"
+        if self.writer is None:
+            _write_spool(self.spool_stub, chunk, mode)
+        else:
+            self.writer.submit(_write_spool, self.spool_stub, chunk, mode)
+        self.nflushed += len(chunk["time"])
+
+    def _wait_for_spool(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def spool_filename(self, column):
+        return _spool_filename(self.spool_stub, column)
+
+    def __len__(self):
+        return (self.nflushed + sum(len(chunk["time"]) for chunk in self._chunks) +
+                len(self._times))
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from zip(chunk["time"].tolist(), chunk["hostID"].tolist(),
+                           STATE_NAMES[chunk["oldState"]].tolist(),
+                           STATE_NAMES[chunk["newState"]].tolist())
+
+    def iter_chunks(self):
+        """Iterate over the events in chunks of typed columns, reading back any spooled events."""
+
+        self._wait_for_spool()
+        for start in range(0, self.nflushed, self.chunk_size):
+            count = min(self.chunk_size, self.nflushed - start)
+            chunk = {}
+            for name, dtype in EVENT_COLUMNS:
+                offset = start * np.dtype(dtype).itemsize
+                chunk[name] = np.fromfile(self.spool_filename(name), dtype=dtype, count=count,
+                                          offset=offset)
+            yield chunk
+
+        yield from self._chunks
+
+        if self._times:
+            yield {
+                name: np.array(values, dtype=dtype) for (name, dtype), values in zip(
+                    EVENT_COLUMNS,
+                    [self._times, self._host_ids, self._old_states, self._new_states])
+            }
+
+    def columns(self):
+        """All events as a dictionary of typed column arrays."""
+
+        chunks = list(self.iter_chunks())
+        return {
+            name: np.concatenate([chunk[name] for chunk in chunks] + [np.zeros(0, dtype=dtype)])
+            for name, dtype in EVENT_COLUMNS
+        }
+
+    def move_spool(self, spool_stub):
+        """Continue spooling to new files, copying across any events already spooled."""
+
+        self._wait_for_spool()
+        if self.spool_stub is not None and self.nflushed > 0:
+            for name, dtype in EVENT_COLUMNS:
+                data = np.fromfile(self.spool_filename(name), dtype=dtype, count=self.nflushed)
+                with open(_spool_filename(spool_stub, name), "wb") as outfile:
+                    outfile.write(data.tobytes())
+
+        self.spool_stub = spool_stub
+
+    def remove_spool(self):
+        self._wait_for_spool()
+        if self.spool_stub is not None:
+            for name, _ in EVENT_COLUMNS:
+                if os.path.exists(self.spool_filename(name)):
+                    os.remove(self.spool_filename(name))
+
+    def get_state(self):
+        """State of the log, for checkpointing.  Spooled events are left in the spool files."""
+
+        self.flush()
+        self._wait_for_spool()
+        columns = {}
+        for name, dtype in EVENT_COLUMNS:
+            columns[name] = np.concatenate(
+                [chunk[name] for chunk in self._chunks] + [np.zeros(0, dtype=dtype)])
+
+        return {'chunk_size': self.chunk_size, 'spool_stub': self.spool_stub,
+                'nflushed': self.nflushed, 'columns': columns}
+
+    def set_state(self, state):
+        """Restore from get_state, discarding anything spooled after the state was saved."""
+
+        self._wait_for_spool()
+        self.chunk_size = state['chunk_size']
+        self.spool_stub = state['spool_stub']
+        self.nflushed = state['nflushed']
+        self._new_chunk()
+        self._chunks = []
+        if len(state['columns']["time"]) > 0:
+            self._chunks.append(state['columns'])
+
+        if self.spool_stub is not None and self.nflushed > 0:
+            for name, dtype in EVENT_COLUMNS:
+                os.truncate(self.spool_filename(name),
+                            self.nflushed * np.dtype(dtype).itemsize)
+
+
+def _spool_filename(spool_stub, column):
+    return spool_stub + "." + column + ".spool"
+
+
+def _write_spool(spool_stub, chunk, mode):
+    for name, _ in EVENT_COLUMNS:
+        with open(_spool_filename(spool_stub, name), mode) as outfile:
+            outfile.write(chunk[name].tobytes())
@@ -1,8 +1,12 @@
 """Methods for handling host detail initialisation, including all reading of host files."""
 
+import itertools
 import numpy as np
 import raster_tools
 
+# All states a host can occupy, in the column order used for cell state count arrays
+ALL_STATES = ["S", "E", "C", "D", "I", "R", "Culled"]
+STATE_INDEX = {state: i for i, state in enumerate(ALL_STATES)}
 
 class Host(object):
     """All stored data for an individual host.
@@ -50,14 +54,56 @@ class Host(object):
         self.state = new_state
 
 
+class CellStates(object):
+    """Dictionary-like access by state name to a cell's row of state counts.
+
+    The counts are held in a numpy array ordered as ALL_STATES, which is usually a view onto one
+    row of a (ncells, nstates) array shared by all cells (see pack_cell_states).
+    """
+
+    __slots__ = ("counts",)
+
+    def __init__(self, counts=None):
+        if counts is None:
+            counts = np.zeros(len(ALL_STATES), dtype=int)
+        self.counts = counts
+
+    def __getitem__(self, state):
+        return self.counts[STATE_INDEX[state]]
+
+    def __setitem__(self, state, value):
+        self.counts[STATE_INDEX[state]] = value
+
+    def __iter__(self):
+        return iter(ALL_STATES)
+
+    def __len__(self):
+        return len(ALL_STATES)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def keys(self):
+        return list(ALL_STATES)
+
+    def values(self):
+        return [self.counts[i] for i in range(len(ALL_STATES))]
+
+    def items(self):
+        return [(state, self.counts[i]) for i, state in enumerate(ALL_STATES)]
+
+
 class Cell(object):
-    """Raster cell object holding multiple hosts."""
+    """Raster cell object holding multiple hosts.
 
-    def __init__(self, cell_position, hosts=None, cell_id=None):
+    If counts is given the cell states are stored in that array (ordered as ALL_STATES), otherwise
+    the counts are accumulated from the hosts.
+    """
+
+    def __init__(self, cell_position, hosts=None, cell_id=None, counts=None):
         self.cell_id = cell_id
         self.cell_position = cell_position
-        all_states = ["S", "E", "C", "D", "I", "R", "Culled"]
-        self.states = {state: 0 for state in all_states}
+        self.states = CellStates(counts)
         self.susceptibility = 1
         self.infectiousness = 1
 
@@ -80,8 +126,170 @@ class Cell(object):
         self.states[old_state] = self.states[old_state] - 1
         self.states[new_state] = self.states[new_state] + 1
 
-def read_host_files(host_pos_files, init_cond_files, region_files, states, sim_type="INDIVIDUAL"):
-    """Read all files associated with host initial state: position, initial state, region files."""
+
+class HostStateSets(object):
+    """Sets of the hosts in each state in each region, with constant time updates and sampling.
+
+    Each set is an unordered list of host IDs, and the position of every host in its list is
+    stored, so a host is removed by moving the last member of the list into its place.
+
+    Attributes:
+        host_regions:   Region of each host
+        members:        members[region][state index] is the list of hosts in that region and state
+        positions:      Position of each host in its list
+    """
+
+    def __init__(self, host_regions, nregions, host_states=None):
+        self.host_regions = np.asarray(host_regions, dtype=np.int64)
+        self.nregions = nregions
+        if host_states is None:
+            host_states = np.zeros(len(self.host_regions), dtype=np.int8)
+        self.reset(host_states)
+
+    def reset(self, host_states, order=None):
+        """Rebuild sets from the state of each host, as indices into ALL_STATES.
+
+        If order is given, it lists all hosts as from flat_members, and sets the order of hosts in
+        each set.  Otherwise each set is in order of host ID.
+        """
+
+        nstates = len(ALL_STATES)
+        keys = self.host_regions * nstates + np.asarray(host_states, dtype=np.int64)
+        if order is None:
+            order = np.argsort(keys, kind="stable")
+        else:
+            order = np.asarray(order, dtype=np.int64)
+        bounds = np.searchsorted(keys[order], np.arange(self.nregions * nstates + 1))
+
+        positions = np.empty(len(keys), dtype=np.int64)
+        positions[order] = np.arange(len(keys)) - np.repeat(bounds[:-1], np.diff(bounds))
+        self.positions = positions.tolist()
+
+        order = order.tolist()
+        self.members = [[order[bounds[region*nstates + i]:bounds[region*nstates + i + 1]]
+                         for i in range(nstates)] for region in range(self.nregions)]
+
+    def move(self, host_id, old_state, new_state):
+        """Move host between state sets in its region."""
+
+        region_members = self.members[self.host_regions[host_id]]
+        old_members = region_members[STATE_INDEX[old_state]]
+        last = old_members.pop()
+        if last != host_id:
+            position = self.positions[host_id]
+            old_members[position] = last
+            self.positions[last] = position
+
+        new_members = region_members[STATE_INDEX[new_state]]
+        self.positions[host_id] = len(new_members)
+        new_members.append(host_id)
+
+    def count(self, region, state):
+        """Number of hosts in state in region."""
+
+        return len(self.members[region][STATE_INDEX[state]])
+
+    def hosts(self, region, state):
+        """List of hosts in state in region, in no particular order.  Must not be modified."""
+
+        return self.members[region][STATE_INDEX[state]]
+
+    def flat_members(self):
+        """Array of all hosts, in order of region, then state, then position in their set."""
+
+        return np.fromiter(itertools.chain.from_iterable(itertools.chain.from_iterable(
+            self.members)), dtype=np.int64, count=len(self.positions))
+
+    def select(self, region, state, random_number):
+        """Select a host in state in region, using a random number uniform on [0, 1)."""
+
+        members = self.members[region][STATE_INDEX[state]]
+        if not members:
+            raise ValueError("No hosts in state {} in region {}!".format(state, region))
+        return members[int(random_number * len(members))]
+
+
+def pack_cell_states(all_cells, cell_counts=None):
+    """Gather the state counts of all cells into a single (ncells, nstates) array.
+
+    Each cell's states are re-pointed at its row of the returned array, so that the array stays
+    up to date as events change the cells.  Columns are ordered as ALL_STATES.  If cell_counts is
+    given, the cells are pointed at its rows without copying their current counts.
+    """
+
+    if cell_counts is not None:
+        for cell in all_cells:
+            cell.states.counts = cell_counts[cell.cell_id]
+        return cell_counts
+
+    cell_counts = np.zeros((len(all_cells), len(ALL_STATES)), dtype=int)
+
+    for cell in all_cells:
+        cell_counts[cell.cell_id] = cell.states.counts
+        cell.states.counts = cell_counts[cell.cell_id]
+
+    return cell_counts
+
+
+def get_host_states(all_hosts):
+    """Compact array of the current state of each host, as indices into ALL_STATES."""
+
+    return np.array([STATE_INDEX[host.state] for host in all_hosts], dtype=np.int8)
+
+
+def get_host_transitions(all_hosts):
+    """All host state transitions as flat arrays, in order of host then time.
+
+    Returns dictionary of arrays: host (index into all_hosts), time, oldState and newState (indices
+    into ALL_STATES, with -1 for no state).
+    """
+
+    all_trans_times = [host.trans_times for host in all_hosts]
+    ntrans = np.fromiter(map(len, all_trans_times), dtype=np.int64, count=len(all_trans_times))
+
+    transitions = list(itertools.chain.from_iterable(all_trans_times))
+    if transitions:
+        times, old_states, new_states = zip(*transitions)
+    else:
+        times, old_states, new_states = [], [], []
+
+    state_index = dict(STATE_INDEX)
+    state_index[None] = -1
+
+    return {
+        'host': np.repeat(np.arange(len(all_hosts), dtype=np.int64), ntrans),
+        'time': np.array(times, dtype=float),
+        'oldState': np.array(list(map(state_index.__getitem__, old_states)), dtype=np.int8),
+        'newState': np.array(list(map(state_index.__getitem__, new_states)), dtype=np.int8),
+    }
+
+
+def reset_host_states(all_hosts, host_states):
+    """Reset hosts to the given states (from get_host_states) at time zero.
+
+    Transition histories are cleared, so that hosts can be re-used for a new simulation.
+    """
+
+    for host, state_idx in zip(all_hosts, host_states.tolist()):
+        state = ALL_STATES[state_idx]
+        host.state = state
+        host.init_state = state
+        host.trans_times = [(0.0, None, state)]
+
+
+def cell_state_id(cell_id, state):
+    """Event ID for hosts of a given state within a cell, used when simulating counts only."""
+
+    return cell_id * len(ALL_STATES) + STATE_INDEX[state]
+
+
+def read_host_files(host_pos_files, init_cond_files, region_files, states, sim_type="INDIVIDUAL",
+                    counts_only=False):
+    """Read all files associated with host initial state: position, initial state, region files.
+
+    If counts_only is True, raster simulations only store the number of hosts in each state in each
+    cell.  No Host objects are created and the returned host list is None.
+    """
 
     if sim_type == "INDIVIDUAL":
 
@@ -123,11 +331,14 @@ def read_host_files(host_pos_files, init_cond_files, region_files, states, sim_t
             culled_raster = raster_tools.RasterData.from_file(init_cond_files[0] + "_Culled.txt")
         except FileNotFoundError:
             culled_raster = None
-            
 
         # Save raster header from host file
         header = host_raster.header_vals
 
+        if counts_only:
+            return (None, read_cell_counts(host_raster, states, state_rasters, culled_raster),
+                    header)
+
         all_cells = []
         all_hosts = []
         cell_id = 0
@@ -171,6 +382,29 @@ def read_host_files(host_pos_files, init_cond_files, region_files, states, sim_t
 
         return (all_hosts, all_cells, header)
 
+
+def read_cell_counts(host_raster, states, state_rasters, culled_raster=None):
+    """Create cells holding only state counts from host and initial condition rasters."""
+
+    nrows, ncols = host_raster.array.shape
+    occupied = (host_raster.array > 0).flatten()
+
+    cell_counts = np.zeros((nrows*ncols, len(ALL_STATES)), dtype=int)
+    for i, state in enumerate(states):
+        cell_counts[:, STATE_INDEX[state]] = state_rasters[i].array.flatten().astype(int)
+    if culled_raster is not None:
+        cell_counts[:, STATE_INDEX["Culled"]] = culled_raster.array.flatten().astype(int)
+    cell_counts[~occupied] = 0
+
+    nhosts = host_raster.array.flatten()[occupied]
+    if np.any(np.sum(cell_counts[occupied], axis=1) != nhosts):
+        raise ValueError("Incorrect number of hosts!")
+
+    all_cells = [Cell((cell_id // ncols, cell_id % ncols), cell_id=cell_id,
+                      counts=cell_counts[cell_id]) for cell_id in range(nrows*ncols)]
+
+    return all_cells
+
 def read_sus_inf_files(all_cells, header, sus_file, inf_file, sim_type="INDIVIDUAL"):
     """Read all files associated with host susceptibility and infectiousness."""
 
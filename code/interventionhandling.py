@@ -1,14 +1,40 @@
 """Module for handling control interventions in Individual Epidemic Simulator."""
 
 import pdb
+import functools
 import importlib
+import itertools
+import operator
 import pandas as pd
 import numpy as np
 import time as mtime
+from .hosts import ALL_STATES, STATE_INDEX
 
 
 class InterventionHandler:
-    """Intervention handling class to keep interventions up to date and carry out events."""
+    """Intervention handling class to keep interventions up to date and carry out events.
+
+    When UpdateOnAllEvents is True, interventions are updated after each event.  An intervention can
+    limit the events it is updated after by defining a subscriptions dictionary, with any of the
+    keys:
+        event_types:    Event types, e.g. "Infection", "Advance", "CULL".
+        transitions:    (old_state, new_state) pairs, with None matching any state.
+        regions:        Regions of the host (or cell) changing state.
+    An event must match every key given.  Interventions without subscriptions are updated after
+    every event.
+
+    Continuous interventions return rate changes from update either as a list of (rate_id, rate)
+    tuples, as a tuple of (rate_ids, rates) arrays, or as a single array giving every rate.  The
+    array forms are inserted into the rate structure in bulk.
+
+    Interventions can also declare host_sets and random_numbers attributes, which are set at the
+    start of each run to the simulator's sets of hosts in each state in each region (see
+    hosts.HostStateSets) and random number generator.
+
+    Checkpoints store the rates and next update times of interventions, but no other intervention
+    state.  Interventions with other state to keep can define get_state, returning a dictionary of
+    numpy arrays, and set_state, which is passed the same dictionary when a run is restored.
+    """
 
     def __init__(self, parent_sim):
         self.parent_sim = parent_sim
@@ -59,11 +85,54 @@ class InterventionHandler:
             for i, intervention in enumerate(self.interventions):
                 if intervention.type == "CONTINUOUS":
                     # Set up rate structures
-                    rate_factor = getattr(intervention, "rate_factor", None)
+                    rate_factor = getattr(intervention, "rate_factor", 1)
                     self.parent_sim.rate_handler.add_rate_struct("Intervention_"+str(i),
                                                                  intervention.rate_size,
                                                                  rate_factor=rate_factor)
 
+        # Rate structure name and rate lookup for each intervention
+        self.rate_names = ["Intervention_"+str(i) for i in range(len(self.interventions))]
+        self.intervention_numbers = {name: i for i, name in enumerate(self.rate_names)}
+        self.get_rate_fns = [
+            functools.partial(self.parent_sim.rate_handler.get_rate, rate_type=name)
+            for name in self.rate_names]
+
+        self._setup_subscriptions()
+
+    def _setup_subscriptions(self):
+        """Build tables of the interventions to update after each type of event and transition.
+
+        Tables are indexed by event type then old and new state indices, giving the interventions
+        matching on event type and transition.  Sporulation events give the infection they cause,
+        so use the Infection table.  Events of other or unknown type use the table for None, which
+        ignores event_types.  Events from continuous intervention actions are dispatched on their
+        own type by action.
+        """
+
+        subscriptions = [getattr(intervention, "subscriptions", None) or {}
+                         for intervention in self.interventions]
+        self.subscription_regions = [
+            None if sub.get('regions') is None else frozenset(sub['regions'])
+            for sub in subscriptions]
+
+        def matches_transition(sub, old_state, new_state):
+            if sub.get('transitions') is None:
+                return True
+            return any((old in (None, old_state)) and (new in (None, new_state))
+                       for old, new in sub['transitions'])
+
+        event_types = ["Infection", "Advance", "CULL", None]
+        nstates = len(ALL_STATES)
+        self.subscribers = {}
+        for event_type in event_types:
+            self.subscribers[event_type] = [[tuple(
+                i for i, sub in enumerate(subscriptions)
+                if (event_type is None or sub.get('event_types') is None or
+                    event_type in sub['event_types']) and
+                matches_transition(sub, ALL_STATES[old], ALL_STATES[new]))
+                for new in range(nstates)] for old in range(nstates)]
+        self.subscribers["Sporulation"] = self.subscribers["Infection"]
+
     @property
     def next_intervention_time(self):
         """Time of next intervention update for each intervention."""
@@ -74,72 +143,139 @@ class InterventionHandler:
             raise TypeError("Must first initialise_rates before accessing "
                             "next_intervention_time!")
 
+    def attach_run_data(self):
+        """Give interventions declaring them the current host sets and random number generator."""
+
+        for intervention in self.interventions:
+            if hasattr(intervention, "host_sets"):
+                intervention.host_sets = self.parent_sim.run_params.get('host_sets')
+            if hasattr(intervention, "random_numbers"):
+                intervention.random_numbers = self.parent_sim.random_numbers
+
     def initialise_rates(self, all_hosts, all_cells):
         """Set rates for continuous interventions, and setup next intervention times."""
         self.next_interventions = []
+        self.attach_run_data()
 
         for i, intervention in enumerate(self.interventions):
             if intervention.type == "CONTINUOUS":
                 rate_updates = intervention.update(all_hosts, 0, all_cells, initial=True)
-                for j, rate in rate_updates:
-                    self.parent_sim.rate_handler.insert_rate(j, rate, "Intervention_"+str(i))
+                self.apply_rate_updates(i, rate_updates)
 
             # Next intervention times
             self.next_interventions.append(intervention.update_freq)
 
     def update(self, all_hosts, time, all_cells):
-        """Carry out any intervention updates or actions for the specified time.
+        """Carry out all intervention updates or actions due at or before the specified time."""
 
-        This function will be called every update frequency.
+        for i, int_time in enumerate(self.next_interventions):
+            while int_time is not None and int_time <= time:
+                int_time = self.update_intervention(i, all_hosts, time, all_cells)
+
+    def update_intervention(self, intervention_num, all_hosts, time, all_cells):
+        """Carry out the scheduled update or actions of one intervention.
+
+        Returns the time of the next update for the intervention, which is called every update
+        frequency.
         """
 
-        for i, int_time in enumerate(self.next_interventions):
-            if time == int_time:
-                if self.interventions[i].type == "CONTINUOUS":
-                    get_rate_fn = lambda x: self.parent_sim.rate_handler.get_rate(
-                        x, "Intervention_"+str(i))
-                    rate_updates = self.interventions[i].update(all_hosts, time, all_cells,
-                                                                get_rate_fn=get_rate_fn)
-                    for rate_id, rate in rate_updates:
-                        self.parent_sim.rate_handler.insert_rate(
-                            rate_id, rate, "Intervention_"+str(i))
-                else:
-                    events = self.interventions[i].update(all_hosts, time, all_cells)
-                    for host_id, event_type in events:
-                        self.parent_sim.event_handler.do_event(
-                            event_type, host_id, all_hosts, all_cells)
-                self.next_interventions[i] += self.interventions[i].update_freq
-
-    def update_on_event(self, event, all_hosts, time, all_cells):
-        """Carry out updates after an event is carried out."""
-        for i, intervention in enumerate(self.interventions):
+        intervention = self.interventions[intervention_num]
+        if intervention.type == "CONTINUOUS":
+            rate_updates = intervention.update(
+                all_hosts, time, all_cells, get_rate_fn=self.get_rate_fns[intervention_num])
+            self.apply_rate_updates(intervention_num, rate_updates)
+        else:
+            events = intervention.update(all_hosts, time, all_cells)
+            self.do_events(events, all_hosts, all_cells)
+        # Update times are kept as multiples of the frequency, so rounding errors do not accumulate
+        nupdates = int(round(self.next_interventions[intervention_num] / intervention.update_freq))
+        self.next_interventions[intervention_num] = (nupdates + 1) * intervention.update_freq
+
+        return self.next_interventions[intervention_num]
+
+    def do_events(self, events, all_hosts, all_cells):
+        """Carry out list of (host_id, event_type) events from an intervention update.
+
+        Consecutive culls are carried out together, so rate changes are only distributed once.
+        """
+
+        event_handler = self.parent_sim.event_handler
+        for event_type, group in itertools.groupby(events, key=operator.itemgetter(1)):
+            if event_type == "CULL":
+                event_handler.do_event_cull_batch(
+                    [host_id for host_id, _ in group], all_hosts, all_cells)
+            else:
+                for host_id, _ in group:
+                    event_handler.do_event(event_type, host_id, all_hosts, all_cells)
+
+    def apply_rate_updates(self, intervention_num, rate_updates):
+        """Insert rate changes returned by a continuous intervention update into its rates."""
+
+        rate_handler = self.parent_sim.rate_handler
+        rate_name = self.rate_names[intervention_num]
+
+        if isinstance(rate_updates, np.ndarray):
+            rate_handler.bulk_insert(rate_updates, rate_name)
+        elif (isinstance(rate_updates, tuple) and len(rate_updates) == 2 and
+              isinstance(rate_updates[0], np.ndarray)):
+            rate_ids, rates = rate_updates
+            if len(rate_ids) != len(rates):
+                raise ValueError("Rate IDs and rates must be the same length!")
+            if len(rate_ids) > 0:
+                rate_handler.bulk_update(rate_ids, rates, rate_name)
+        else:
+            for rate_id, rate in rate_updates:
+                rate_handler.insert_rate(rate_id, rate, rate_name)
+
+    def update_on_event(self, event, all_hosts, time, all_cells, event_type=None):
+        """Carry out updates after an event is carried out, for interventions subscribed to it."""
+
+        host_id, cell_id, old_state, new_state = event
+        table = self.subscribers.get(event_type, self.subscribers[None])
+        subscribers = table[STATE_INDEX[old_state]][STATE_INDEX[new_state]]
+        if not subscribers:
+            return
+
+        region = None
+        for i in subscribers:
+            if self.subscription_regions[i] is not None:
+                if region is None:
+                    region = self.event_region(host_id, cell_id)
+                if region not in self.subscription_regions[i]:
+                    continue
+
+            intervention = self.interventions[i]
             if intervention.type == "CONTINUOUS":
-                rate_fn = lambda x: self.parent_sim.rate_handler.get_rate(
-                    x, "Intervention_"+str(i))
                 rate_updates = intervention.update(all_hosts, time, all_cells, after_event=event,
-                                                   get_rate_fn=rate_fn)
-                for rate_id, rate in rate_updates:
-                    self.parent_sim.rate_handler.insert_rate(rate_id, rate, "Intervention_"+str(i))
+                                                   get_rate_fn=self.get_rate_fns[i])
+                self.apply_rate_updates(i, rate_updates)
             else:
                 events = intervention.update(all_hosts, time, all_cells, after_event=event)
-                for host_id, event_type in events:
-                    self.parent_sim.event_handler.do_event(
-                        event_type, host_id, all_hosts, all_cells)
+                self.do_events(events, all_hosts, all_cells)
+
+    def event_region(self, host_id, cell_id):
+        """Region of the host, or cell if host_id is None, changing state in an event."""
+
+        if host_id is None:
+            return self.parent_sim.params['cell_regions'][cell_id]
+        return self.parent_sim.params['host_regions'][host_id]
 
     def action(self, intervention_id, event_id, all_hosts, all_cells):
         """Carry out an action for a continuous intervention."""
 
-        int_num = int(intervention_id.split("_")[1])
+        int_num = self.intervention_numbers[intervention_id]
         time = self.parent_sim.time
-
         events = self.interventions[int_num].action(all_hosts, time, event_id, all_cells)
-        for host_id, event_type in events[:-1]:
+
+        # Subscribers are updated here with the type of each event carried out, rather than
+        # the type of the action
+        update_on_events = self.parent_sim.params['UpdateOnAllEvents'] is True
+        event_done = None
+        for host_id, event_type in events:
             event_done = self.parent_sim.event_handler.do_event(
                 event_type, host_id, all_hosts, all_cells)
-            self.update_on_event(event_done, all_hosts, time, all_cells)
-
-        event_done = self.parent_sim.event_handler.do_event(
-            events[-1][1], events[-1][0], all_hosts, all_cells)
+            if update_on_events and event_done is not None:
+                self.update_on_event(event_done, all_hosts, time, all_cells, event_type=event_type)
 
         return event_done
 
@@ -11,7 +11,14 @@ config_params = {'budget': 0, 'nregions': 3, 'priorities': [2, 1, 0], 'removal_r
 
 
 class Intervention:
-    def __init__(self, update_freq, all_hosts):
+    # Infected hosts in each region, and random numbers for selecting them, set by the simulator
+    host_sets = None
+    random_numbers = None
+
+    # Rates only change when the number of infected hosts changes
+    subscriptions = {'transitions': [(None, "I"), ("I", None)]}
+
+    def __init__(self, update_freq, all_hosts, all_cells=None, options=None):
         # Set update frequency
         self.update_freq = update_freq
 
@@ -21,28 +28,18 @@ class Intervention:
         # Set size of required rate structure
         self.rate_size = config_params['nregions']
 
-        # Create region -> to hostID map
-        self.region_map = {key: [] for key in range(config_params['nregions'])}
-        for host in all_hosts:
-            region = host.reg
-            self.region_map[region].append(host.hostID)
-
         # Create log of expenditure
         self.log = []
 
-    def action(self, all_hosts, time, eventID):
+    def action(self, all_hosts, time, event_id, all_cells=None):
         """Carry out event."""
         # select random infected host in correct region, and carry out cull event
-        nhosts_region = len(self.region_map[eventID])
-        indx = np.random.randint(0, nhosts_region)
-        host = all_hosts[self.region_map[eventID][indx]]
-        while host.state != "I":
-            indx = np.random.randint(0, nhosts_region)
-            host = all_hosts[self.region_map[eventID][indx]]
+        host_id = self.host_sets.select(event_id, "I", self.random_numbers.uniform())
 
-        return (host.hostID, "Cull")
+        return [(host_id, "CULL")]
 
-    def update(self, all_hosts, time):
+    def update(self, all_hosts, time, all_cells=None, after_event=None, get_rate_fn=None,
+               initial=False):
         """Adjust rates."""
         # Adjust rates to account for changing budget and/or changing number of infected hosts
 
@@ -51,20 +48,30 @@ class Intervention:
         expenses = [0]*config_params['nregions']
 
         for region in config_params['priorities']:
-            N_inf = len([i for i in self.region_map[region] if all_hosts[i].state == "I"])
+            N_inf = self.host_sets.count(region, "I")
             expenses[region] = np.max([0, np.min([
                 N_inf, config_params['budget'] - already_spent])])
             already_spent += expenses[region]
             rates[region] = expenses[region]*config_params['removal_rate']
 
-        if time == 0:
+        if initial:
             # Start of new epidemic, reset log
             self.log = [[time] + expenses]
         elif expenses != self.log[-1][1:]:
             # If expenses have changed, save to log
             self.log.append([time] + expenses)
 
-        return rates
+        return np.array(rates, dtype=float)
+
+    def get_state(self):
+        """Expenditure log, to store in run checkpoints."""
+
+        return {'log': np.array(self.log, dtype=float)}
+
+    def set_state(self, state):
+        """Restore expenditure log from a run checkpoint."""
+
+        self.log = state['log'].tolist()
 
     def output(self):
         """Output control log to data frame."""
@@ -6,6 +6,13 @@
 class Intervention:
     """Class to hold intervention methods."""
 
+    # Optional attributes. If defined, these are set at the start of each simulation to the sets of
+    # hosts in each state in each region (IndividualSimulator.code.hosts.HostStateSets, kept up to
+    # date as events happen, or None if only cell state counts are simulated), and the simulator
+    # random number generator. Use these to count or select hosts without looping over all_hosts.
+    host_sets = None
+    random_numbers = None
+
     # Initialisation sets up defining features of intervention
     def __init__(self, update_freq, all_hosts, all_cells=None, options=None):
         # Initialisation takes the update frequency from the config file. This is how often the
@@ -37,7 +44,9 @@ class Intervention:
 
     # This function is called every update_freq in time, and also after every event if
     # UpdateOnAllEvents is True. For "CONTINUOUS" interventions this must return a list of rate
-    # changes to insert into rate structure: [(rate_id, new_rate)]. For any other intervention
+    # changes to insert into rate structure: [(rate_id, new_rate)]. For large rate structures the
+    # changes can instead be returned as a tuple of numpy arrays (rate_ids, new_rates), or as a
+    # single numpy array of all rates, which are inserted in bulk. For any other intervention
     # return events to carry out: [(host_id, event_type)]. The argument after_event will be event
     # passed from event handler if UpdateOnAllEvents is True and this function is being called after
     # an event (rather than at a specified update_freq time). Options for event_type are "CULL".
@@ -57,6 +66,15 @@ class Intervention:
     def finalise(self):
         pass
 
+    # Optional functions to keep intervention state when a run is checkpointed and restored. The
+    # rates and update times of the intervention are always kept. get_state must return a dictionary
+    # of numpy arrays, which is passed to set_state when the run is restored.
+    # def get_state(self):
+    #     return {}
+    #
+    # def set_state(self, state):
+    #     pass
+
     # Function to get log string to include in log file for set of simulations. Called after all
     # simulations have been carried out and finalise has been called for each.
     def output(self):
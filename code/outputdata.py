@@ -1,22 +1,38 @@
 """Methods for outputting run data from the simulation."""
 
+import contextlib
+import gc
 import io
 import numpy as np
+import operator
 import os
 import pandas as pd
+from . import columnar
 from . import config
+from . import hosts
+from .eventlog import EVENT_COLUMNS, STATE_NAMES
+from .hosts import STATE_INDEX
 import raster_tools
 
 def output_all_run_data(parent_sim, all_hosts, all_cells, run_params, iteration=0):
     return_data = {}
     filestub = parent_sim.params['OutputFileStub']
 
+    # Complete any output still being written in the background, raising any errors
+    if parent_sim.output_writer is not None:
+        parent_sim.output_writer.flush()
+
+    if parent_sim.params['AggregateRuns'] is True:
+        # Only the run summary is kept, to be added to the ensemble statistics
+        close_raster_cube(parent_sim)
+        return run_summary(parent_sim.params, run_params)
+
     if parent_sim.params['OutputFiles'] is True:
         output_path = os.path.split(filestub)[0]
         if output_path != "":
             os.makedirs(output_path, exist_ok=True)
 
-    if parent_sim.params['OutputHostData'] is True:
+    if parent_sim.params['OutputHostData'] is True and all_hosts is not None:
         host_data = output_data_hosts(all_hosts, all_cells, parent_sim.params, iteration=iteration,
                                       file_stub=filestub)
         return_data['host_data'] = host_data
@@ -24,13 +40,15 @@ def output_all_run_data(parent_sim, all_hosts, all_cells, run_params, iteration=
     if parent_sim.params['OutputEventData'] is True:
         event_data = output_data_events(parent_sim.params, run_params, iteration=iteration,
                                         file_stub=filestub)
-        return_data['event_data'] = event_data
+        if event_data is not None:
+            return_data['event_data'] = event_data
+
+    if parent_sim.params['SummaryOutputFreq'] > 0:
+        summary_data = output_data_summary(parent_sim.params, run_params, iteration=iteration,
+                                           file_stub=filestub)
+        return_data['summary_data'] = summary_data
 
-    # if parent_sim.params['SummaryOutputFreq'] != 0:
-    #     raise NotImplementedError
-    #     summary_data = output_data_summary(parent_sim.params, run_params, iteration=iteration,
-    #                                        file_stub=filestub)
-    #     return_data['summary_data'] = summary_data
+    close_raster_cube(parent_sim)
 
     if parent_sim.params['InterventionScripts'] is not None:
         control_data = parent_sim.intervention_handler.output(iteration=iteration,
@@ -42,9 +60,13 @@ def output_all_run_data(parent_sim, all_hosts, all_cells, run_params, iteration=
 
 
 def output_raster_data(parent_sim, time=None, iteration=None, states=None):
-    """Output current state raster"""
+    """Output current state raster
+
+    Cell counts for each state are scattered into a grid of the full raster.  If RasterOutputCube
+    is True the grids are written into a single memory-mapped array for the iteration, of shape
+    (time, state, row, col), otherwise a raster file is written for each state.
+    """
 
-    all_cells = parent_sim.all_cells
     header = parent_sim.params['header']
 
     if states is None:
@@ -62,30 +84,84 @@ def output_raster_data(parent_sim, time=None, iteration=None, states=None):
     else:
         timestub = ""
 
+    if parent_sim.params['RasterOutputCube'] is True:
+        cube = _raster_cube(parent_sim, output_stub + iterstub + ".npy", states, time)
+        time_idx = int(round(time / parent_sim.params['RasterOutputFreq']))
+        grids = cube[time_idx].reshape((len(states), -1))
+        for i, state in enumerate(states):
+            grids[i, parent_sim.params['cell_grid_index']] = parent_sim.params['cell_counts'][
+                :, STATE_INDEX[state]]
+        return
+
+    writer = parent_sim.output_writer
+    cell_state = np.full(header['nrows'] * header['ncols'], header['NODATA_value'])
+
     for state in states:
-        cell_state = np.full((header['nrows'], header['ncols']), header['NODATA_value'])
-        for row in range(header['nrows']):
-            for col in range(header['ncols']):
-                cell_id = parent_sim.params['cell_map'].get((row, col), None)
-                if cell_id is not None:
-                    cell_state[row, col] = all_cells[cell_id].states[state]
-        cell_state = cell_state.reshape((header['nrows'], header['ncols']))
+        cell_state[parent_sim.params['cell_grid_index']] = parent_sim.params['cell_counts'][
+            :, STATE_INDEX[state]]
+
+        array = cell_state.reshape((header['nrows'], header['ncols']))
+        if writer is not None:
+            # Background writer needs a snapshot that is not changed afterwards
+            array = array.copy()
 
         raster = raster_tools.RasterData(
             shape=(header['nrows'], header['ncols']),
             llcorner=(header['xllcorner'], header['yllcorner']),
             cellsize=header['cellsize'],
             NODATA_value=header['NODATA_value'],
-            array=cell_state
+            array=array
         )
 
-        raster.to_file(output_stub + iterstub + "_" + state + timestub + ".txt")
+        filename = output_stub + iterstub + "_" + state + timestub + ".txt"
+        if writer is None:
+            raster.to_file(filename)
+        else:
+            writer.submit(raster.to_file, filename)
+
+
+def _raster_cube(parent_sim, filename, states, time):
+    """Memory-mapped raster cube for the current run, created at the first snapshot of a run.
+
+    Times with no snapshot are left as NODATA_value.
+    """
+
+    cube = parent_sim.raster_cube
+    if cube is not None and cube.filename == os.path.abspath(filename) and time != 0:
+        return cube
+
+    if time == 0 or not os.path.exists(filename):
+        header = parent_sim.params['header']
+        ntimes = int(round(
+            parent_sim.params['FinalTime'] / parent_sim.params['RasterOutputFreq'])) + 1
+        shape = (ntimes, len(states), header['nrows'], header['ncols'])
+        dtype = np.result_type(header['NODATA_value'], parent_sim.params['cell_counts'])
+        cube = np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=shape)
+        cube[...] = header['NODATA_value']
+    else:
+        # Continuing a run restored from a checkpoint
+        cube = np.load(filename, mmap_mode="r+")
+
+    parent_sim.raster_cube = cube
+    return cube
+
+
+def close_raster_cube(parent_sim):
+    """Flush and close the raster cube of the current run, if open."""
+
+    if parent_sim.raster_cube is not None:
+        parent_sim.raster_cube.flush()
+        parent_sim.raster_cube = None
+
 
 def output_data_hosts(all_hosts, all_cells, params, file_stub="output", iteration=0):
-    """Output state transition times for each host."""
+    """Output state transition times for each host.
+
+    The timeEnter lists are built from flat arrays of all host transitions, sorted by new state and
+    host then split into the runs for each host.
+    """
 
     states = list(params['Model']) + ["Culled"]
-    nhosts = len(all_hosts)
 
     filename = file_stub + "_hosts_" + str(iteration) + ".csv"
 
@@ -95,90 +171,222 @@ def output_data_hosts(all_hosts, all_cells, params, file_stub="output", iteratio
         col_names = ["hostID", "posX", "posY", "cell", "cell_pos", "region", "initial_state"] + [
             "timeEnter" + state for state in states]
 
-    data_dict = {key: [] for key in col_names}
+    with _gc_paused():
+        host_columns = _host_columns(all_hosts, all_cells, params)
+        transitions = hosts.get_host_transitions(all_hosts)
+        data_frame = _host_data_frame(host_columns, transitions, params, col_names, states)
 
-    for i in range(nhosts):
-        host_id = all_hosts[i].host_id
-        x = all_hosts[i].xpos
-        y = all_hosts[i].ypos
-        region = all_hosts[i].reg
-        start_state = all_hosts[i].init_state
+    if params['OutputFiles'] is True:
+        if params['OutputFormat'] == "csv":
+            _to_csv(data_frame, filename)
+        else:
+            _write_host_columns(host_columns, transitions, params, file_stub, iteration)
 
-        data_dict['hostID'].append(host_id)
-        data_dict['posX'].append(x)
-        data_dict['posY'].append(y)
-        data_dict['region'].append(region)
-        data_dict['initial_state'].append(start_state)
+    return data_frame
 
-        if params['SimulationType'] == "RASTER":
-            data_dict['cell'].append(all_hosts[i].cell_id)
-            data_dict['cell_pos'].append(all_cells[all_hosts[i].cell_id].cell_position)
 
-        for state in states:
-            jump_times = []
-            for jump in all_hosts[i].trans_times:
-                if jump[2] == state:
-                    jump_times.append(jump[0])
-            data_dict["timeEnter"+state].append(jump_times)
+def _host_data_frame(host_columns, transitions, params, col_names, states):
+    nhosts = len(host_columns['hostID'])
 
-    data_frame = pd.DataFrame(data_dict, columns=col_names)
+    data_dict = {key: host_columns[key] for key in ["hostID", "posX", "posY", "region"]}
+    data_dict['initial_state'] = STATE_NAMES[host_columns['initial_state']]
 
-    if params['OutputFiles'] is True:
-        data_frame.to_csv(filename, index=False)
+    if params['SimulationType'] == "RASTER":
+        data_dict['cell'] = host_columns['cell']
+        data_dict['cell_pos'] = list(zip(host_columns['cell_row'].tolist(),
+                                         host_columns['cell_col'].tolist()))
 
-    return data_frame
+    # Stable sort keeps transitions in time order within each state and host
+    order = np.lexsort((transitions['host'], transitions['newState']))
+    groups = transitions['newState'][order].astype(np.int64) * nhosts + transitions['host'][order]
+    times = transitions['time'][order].tolist()
 
+    for state in states:
+        bounds = np.searchsorted(groups, STATE_INDEX[state] * nhosts + np.arange(nhosts + 1))
+        # Only hosts that have entered this state need their run of times extracted
+        entered = np.flatnonzero(bounds[1:] > bounds[:-1])
+        time_lists = [[] for _ in range(nhosts)]
+        for host, start, end in zip(entered.tolist(), bounds[entered].tolist(),
+                                    bounds[entered+1].tolist()):
+            time_lists[host] = times[start:end]
+        data_dict["timeEnter"+state] = time_lists
 
-def output_data_events(params, run_params, file_stub="output", iteration=0):
-    """Output details on each state change event, in chronological order."""
+    return pd.DataFrame(data_dict, columns=col_names)
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Pause garbage collection while creating many small objects.
+
+    Otherwise creating a list for every host and state triggers repeated collections, each
+    traversing all hosts.
+    """
+
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _host_columns(all_hosts, all_cells, params):
+    """Typed arrays of the fixed details of each host."""
+
+    nhosts = len(all_hosts)
+
+    def host_array(attribute, dtype):
+        return np.fromiter(map(operator.attrgetter(attribute), all_hosts), dtype=dtype,
+                           count=nhosts)
 
-    filename = file_stub + "_events_" + str(iteration) + ".csv"
+    host_columns = {
+        'hostID': host_array("host_id", np.int64),
+        'posX': host_array("xpos", float),
+        'posY': host_array("ypos", float),
+        'region': host_array("reg", np.int64),
+        'initial_state': np.fromiter(
+            map(STATE_INDEX.__getitem__, map(operator.attrgetter("init_state"), all_hosts)),
+            dtype=np.int8, count=nhosts),
+    }
 
-    col_names = ["time", "hostID", "oldState", "newState"]
-    data = [[] for _ in col_names]
+    if params['SimulationType'] == "RASTER":
+        cell_ids = host_array("cell_id", np.int64)
+        cell_positions = np.array([cell.cell_position for cell in all_cells],
+                                  dtype=np.int64).reshape((-1, 2))
+        host_columns['cell'] = cell_ids
+        host_columns['cell_row'] = cell_positions[cell_ids, 0]
+        host_columns['cell_col'] = cell_positions[cell_ids, 1]
 
-    for event in run_params['all_events']:
-        for i, x in enumerate(event):
-            data[i].append(x)
+    return host_columns
 
-    data_dict = {col_names[i]: data[i] for i in range(len(col_names))}
-    data_frame = pd.DataFrame(data_dict, columns=col_names)
+
+def _write_host_columns(host_columns, transitions, params, file_stub, iteration):
+    """Write host data and flat host transitions in binary column format."""
+
+    output_format = params['OutputFormat']
+    extension = columnar.FILE_EXTENSIONS[output_format]
+
+    columnar.write_columns(host_columns, file_stub + "_hosts_" + str(iteration) + extension,
+                           output_format)
+
+    transition_columns = {
+        'hostID': host_columns['hostID'][transitions['host']],
+        'time': transitions['time'],
+        'oldState': transitions['oldState'],
+        'newState': transitions['newState'],
+    }
+    columnar.write_columns(transition_columns,
+                           file_stub + "_transitions_" + str(iteration) + extension,
+                           output_format)
+
+
+def output_data_events(params, run_params, file_stub="output", iteration=0):
+    """Output details on each state change event, in chronological order.
+
+    If events have been streamed to spool files the output file is written a chunk at a time, the
+    spool files removed, and None returned.
+    """
+
+    output_format = params['OutputFormat']
+    filename = (file_stub + "_events_" + str(iteration) +
+                columnar.FILE_EXTENSIONS[output_format])
+
+    col_names = [name for name, _ in EVENT_COLUMNS]
+    events = run_params['all_events']
+
+    if events.spool_stub is not None:
+        if output_format == "csv":
+            with open(filename + ".tmp", "w") as outfile:
+                outfile.write(",".join(col_names) + "\n")
+                for chunk in events.iter_chunks():
+                    _event_data_frame(chunk).to_csv(outfile, index=False, header=False)
+            os.replace(filename + ".tmp", filename)
+        else:
+            writer = columnar.ColumnWriter(filename, output_format, EVENT_COLUMNS,
+                                           nrows=len(events))
+            for chunk in events.iter_chunks():
+                writer.write(chunk)
+            writer.close()
+        events.remove_spool()
+        return None
+
+    columns = events.columns()
+    data_frame = _event_data_frame(columns)
 
     if params['OutputFiles'] is True:
-        data_frame.to_csv(filename, index=False)
+        if output_format == "csv":
+            _to_csv(data_frame, filename)
+        else:
+            columnar.write_columns(columns, filename, output_format, dtypes=EVENT_COLUMNS)
 
     return data_frame
 
 
+def _event_data_frame(columns):
+    data_dict = dict(columns)
+    data_dict["oldState"] = STATE_NAMES[columns["oldState"]]
+    data_dict["newState"] = STATE_NAMES[columns["newState"]]
+    return pd.DataFrame(data_dict, columns=[name for name, _ in EVENT_COLUMNS])
+
+
+def event_spool_stub(params, iteration):
+    """File path stub for event spool files, when streaming events."""
+
+    return params['OutputFileStub'] + "_events_" + str(iteration)
+
+
+def summary_ntimes(params):
+    """Number of summary times up to FinalTime, at multiples of SummaryOutputFreq."""
+
+    # Small tolerance so that FinalTime is included when a multiple of the frequency
+    return int(np.floor(params['FinalTime'] / params['SummaryOutputFreq'] + 1e-9)) + 1
+
+
 def output_data_summary(params, run_params, file_stub="output", iteration=0):
-    """Output region based DPC summary data."""
+    """Output region based DPC summary data, from the region counts recorded during the run."""
+
+    summary_counts = run_params['summary_counts'][:run_params['summary_index']]
+    times = np.arange(len(summary_counts)) * params['SummaryOutputFreq']
 
-    # TODO re-implement now summary dump removed - construct from host data?
+    states = list(params['Model']) + ["Culled"]
+    col_names = ["time"] + states
 
     data_dict = {}
     for region in range(params['NRegions']):
         filename = file_stub + "_DPC_region" + str(region) + "_" + str(iteration) + ".csv"
 
-        states = list(params['Model']) + ["Culled"]
-        col_names = ["time"] + states
-        region_data_dict = {key: [] for key in col_names}
-
-        for entry in run_params['summary_dump']:
-            time = entry[0]
-            region_data_dict['time'].append(time)
-            for state in states:
-                state_num = entry[1][region][state]
-                region_data_dict[state].append(state_num)
+        region_data_dict = {'time': times}
+        for state in states:
+            region_data_dict[state] = summary_counts[:, region, STATE_INDEX[state]]
 
         data_dict['Region'+str(region)] = pd.DataFrame(region_data_dict, columns=col_names)
 
         if params['OutputFiles'] is True:
-            data_dict['Region'+str(region)].to_csv(filename, index=False)
+            _to_csv(data_dict['Region'+str(region)], filename)
 
     return data_dict
 
 
-def output_log_file(params):
+def run_summary(params, run_params):
+    """Summary of a completed run for ensemble statistics: final and DPC region state counts."""
+
+    summary = {'region_counts': np.copy(run_params['region_counts'])}
+    if params['SummaryOutputFreq'] > 0:
+        summary['summary_counts'] = np.copy(
+            run_params['summary_counts'][:run_params['summary_index']])
+    return summary
+
+
+def output_log_file(params, filename=None):
+    if filename is None:
+        filename = params['OutputFileStub'] + ".log"
+
+    with open(filename, "w") as outfile:
+        outfile.write(log_file_text(params))
+
+
+def log_file_text(params):
     log_text = "Individual Simulator Log File\n" + "#"*35 + "\n\n"
     log_text += "Simulator called from: " + params['call_module'] + "\n\n"
     log_text += "Version: " + params['call_version'] + "\n\n"
@@ -191,7 +399,33 @@ def output_log_file(params):
 
     log_text += config_txt.getvalue()
 
-    filename = params['OutputFileStub'] + ".log"
+    return log_text
 
-    with open(filename, "w") as outfile:
-        outfile.write(log_text)
+
+def iteration_output_files(params, iteration):
+    """Names of the data files written at the end of an iteration, if OutputFiles is True."""
+
+    file_stub = params['OutputFileStub']
+    extension = columnar.FILE_EXTENSIONS[params['OutputFormat']]
+    filenames = []
+
+    if params['OutputHostData'] is True and not (
+            params['SimulationType'] == "RASTER" and params['CountOnlyRaster'] is True):
+        filenames.append(file_stub + "_hosts_" + str(iteration) + extension)
+        if params['OutputFormat'] != "csv":
+            filenames.append(file_stub + "_transitions_" + str(iteration) + extension)
+
+    if params['OutputEventData'] is True:
+        filenames.append(file_stub + "_events_" + str(iteration) + extension)
+
+    if params['SummaryOutputFreq'] > 0:
+        filenames += [file_stub + "_DPC_region" + str(region) + "_" + str(iteration) + ".csv"
+                      for region in range(params['NRegions'])]
+
+    return filenames
+
+
+def _to_csv(data_frame, filename):
+    # Write to temporary file first, so an existing output file is always complete
+    data_frame.to_csv(filename + ".tmp", index=False)
+    os.replace(filename + ".tmp", filename)
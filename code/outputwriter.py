@@ -0,0 +1,86 @@
+"""Writing of output files from a background thread."""
+
+import os
+import queue
+import threading
+
+
+class BackgroundWriter:
+    """Runs output tasks in order on a background thread, so the simulation is not held up by I/O.
+
+    Tasks are passed through a bounded queue: if max_queue tasks are pending, submit waits for the
+    writer to catch up.  Any arrays passed to a task must not be modified afterwards.  The first
+    error raised by a task is re-raised by the next call to flush (or submit).
+
+    The thread is started on first use, and restarted if used from a forked process.  Pickling or
+    copying gives a new writer with no pending tasks.
+    """
+
+    def __init__(self, max_queue=16):
+        self.max_queue = max_queue
+        self._reset()
+
+    def _reset(self):
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._error = None
+
+    def __getstate__(self):
+        return {'max_queue': self.max_queue}
+
+    def __setstate__(self, state):
+        self.max_queue = state['max_queue']
+        self._reset()
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                func, args = task
+                if self._error is None:
+                    func(*args)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args):
+        """Queue call func(*args), waiting if the queue is full."""
+
+        self._raise_error()
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        self._queue.put((func, args))
+
+    def flush(self):
+        """Wait for all queued tasks to complete, raising the first error from any task."""
+
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Flush and stop the writer thread."""
+
+        try:
+            self.flush()
+        finally:
+            if self._thread is not None and self._pid == os.getpid():
+                self._queue.put(None)
+                self._thread.join()
+            self._reset()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
@@ -0,0 +1,109 @@
+"""Buffered random number generation for the simulator event loop."""
+
+import numpy as np
+
+
+def iteration_seed(seed, iteration):
+    """Seed for the random number stream of a particular iteration.
+
+    This is equivalent to the iteration'th child spawned from SeedSequence(seed), so each iteration
+    has an independent stream that does not depend on which other iterations are run, or where.
+    Returns None if seed is None.
+    """
+
+    if seed is None:
+        return None
+
+    return np.random.SeedSequence(seed, spawn_key=(iteration,))
+
+
+class RandomNumbers:
+    """Supply of random numbers from a numpy Generator, drawn in blocks.
+
+    Drawing single values from numpy has a large per-call overhead, so uniform and exponential
+    variates are generated in blocks of block_size and handed out one at a time, refilling as
+    required.
+
+    Arguments:
+        seed:       Seed for the Generator.  Can be anything accepted by numpy.random.default_rng,
+                    including a SeedSequence.  If None, fresh entropy is taken from the OS.
+        block_size: Number of values to generate at once.
+    """
+
+    def __init__(self, seed=None, block_size=10000):
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """Reset the Generator with a new seed, discarding any buffered values."""
+
+        self.generator = np.random.default_rng(seed)
+        self._uniforms = []
+        self._uniform_idx = 0
+        self._uniform_block_state = None
+        self._exponentials = []
+        self._exponential_idx = 0
+        self._exponential_block_state = None
+
+    def get_state(self):
+        """State of the generator and buffers, to continue the same stream later.
+
+        Rather than storing the buffered values, the generator state before each block was drawn
+        is stored, with the position in the block, so that the blocks can be regenerated.
+        """
+
+        return {
+            'bit_generator': self.generator.bit_generator.state,
+            'uniform_block_state': self._uniform_block_state,
+            'uniform_idx': self._uniform_idx,
+            'exponential_block_state': self._exponential_block_state,
+            'exponential_idx': self._exponential_idx,
+        }
+
+    def set_state(self, state):
+        """Restore state from get_state."""
+
+        self._uniforms = []
+        self._uniform_block_state = state['uniform_block_state']
+        if self._uniform_block_state is not None:
+            self.generator.bit_generator.state = self._uniform_block_state
+            self._uniforms = self.generator.random(self.block_size).tolist()
+        self._uniform_idx = state['uniform_idx']
+
+        self._exponentials = []
+        self._exponential_block_state = state['exponential_block_state']
+        if self._exponential_block_state is not None:
+            self.generator.bit_generator.state = self._exponential_block_state
+            self._exponentials = self.generator.standard_exponential(self.block_size).tolist()
+        self._exponential_idx = state['exponential_idx']
+
+        self.generator.bit_generator.state = state['bit_generator']
+
+    def uniform(self):
+        """Uniform random number on [0, 1)."""
+
+        if self._uniform_idx >= len(self._uniforms):
+            self._uniform_block_state = self.generator.bit_generator.state
+            self._uniforms = self.generator.random(self.block_size).tolist()
+            self._uniform_idx = 0
+
+        value = self._uniforms[self._uniform_idx]
+        self._uniform_idx += 1
+        return value
+
+    def exponential(self):
+        """Exponential random number with unit rate."""
+
+        if self._exponential_idx >= len(self._exponentials):
+            self._exponential_block_state = self.generator.bit_generator.state
+            self._exponentials = self.generator.standard_exponential(self.block_size).tolist()
+            self._exponential_idx = 0
+
+        value = self._exponentials[self._exponential_idx]
+        self._exponential_idx += 1
+        return value
+
+    def randint(self, high):
+        """Random integer uniformly chosen from 0 to high-1."""
+
+        return min(int(self.uniform() * high), high - 1)
@@ -3,6 +3,7 @@ from .ratestructures.ratesum import RateSum
 from .ratestructures.rateinterval import RateInterval
 from .ratestructures.ratetree import RateTree
 from .ratestructures.rateCR import RateCR
+from .ratestructures.rategroup import RateGroup
 
 
 class RateHandler:
@@ -18,6 +19,8 @@ class RateHandler:
             if self.params['VirtualSporulationStart'] is not None:
                 sporulation_size = self.params['ncells']
 
+        advance_size = self.params['advance_size']
+
         if self.params['RateStructure-Infection'] == "ratesum":
             self.inf_rates = RateSum(infection_size)
         elif self.params['RateStructure-Infection'] == "rateinterval":
@@ -26,19 +29,24 @@ class RateHandler:
             self.inf_rates = RateTree(infection_size)
         elif self.params['RateStructure-Infection'] == "rateCR":
             self.inf_rates = RateCR(infection_size, 0.125,
-                                    infection_size*infection_size)
+                                    infection_size*infection_size,
+                                    random_numbers=self.parent_sim.random_numbers)
         else:
             raise ValueError("Invalid rate structure - infection events!")
 
         if self.params['RateStructure-Advance'] == "ratesum":
-            self.adv_rates = RateSum(self.params['nhosts'])
+            self.adv_rates = RateSum(advance_size)
         elif self.params['RateStructure-Advance'] == "rateinterval":
-            self.adv_rates = RateInterval(self.params['nhosts'])
+            self.adv_rates = RateInterval(advance_size)
         elif self.params['RateStructure-Advance'] == "ratetree":
-            self.adv_rates = RateTree(self.params['nhosts'])
+            self.adv_rates = RateTree(advance_size)
         elif self.params['RateStructure-Advance'] == "rateCR":
-            self.adv_rates = RateCR(self.params['nhosts'], 0.125,
-                                    self.params['nhosts']*self.params['nhosts'])
+            self.adv_rates = RateCR(advance_size, 0.125, advance_size*advance_size,
+                                    random_numbers=self.parent_sim.random_numbers)
+        elif self.params['RateStructure-Advance'] == "rategroup":
+            if self.params['SimulationType'] != "INDIVIDUAL":
+                raise ValueError("rategroup rate structure only valid for INDIVIDUAL simulations!")
+            self.adv_rates = RateGroup(advance_size)
         else:
             raise ValueError("Invalid rate structure - advance events!")
 
@@ -54,6 +62,11 @@ class RateHandler:
                 "Sporulation": self.spore_events
             }
 
+        # Number of events in each rate structure
+        self.sizes = {"Infection": infection_size, "Advance": advance_size}
+        if self.params['VirtualSporulationStart'] is not None:
+            self.sizes["Sporulation"] = sporulation_size
+
         self.n_types = range(len(self.event_types))
 
     def add_rate_struct(self, event_type, size, structure="ratesum", rate_factor=1):
@@ -65,6 +78,7 @@ class RateHandler:
         rate_structure = RateSum(size)
         rate_structure.zero_rates()
         self.all_rates[event_type] = rate_structure
+        self.sizes[event_type] = size
 
         self.parent_sim.rate_factor.append(rate_factor)
 
@@ -82,7 +96,7 @@ class RateHandler:
         if total_rate < 10e-10:
             return (total_rate, None, None)
 
-        select_rate = np.random.random_sample()*total_rate
+        select_rate = self.parent_sim.random_numbers.uniform()*total_rate
 
         cumulative_rate = 0.0
 
@@ -109,3 +123,28 @@ class RateHandler:
 
     def bulk_insert(self, rates, rate_type):
         return self.all_rates[rate_type].bulk_insert(rates)
+
+    def get_rates(self, positions, rate_type):
+        return self.all_rates[rate_type].get_rates(positions)
+
+    def bulk_update(self, positions, rates, rate_type):
+        return self.all_rates[rate_type].bulk_update(positions, rates)
+
+    def get_all_rates(self, rate_type):
+        """Copy of every rate in a rate structure, e.g. for checkpointing."""
+
+        return np.array(self.all_rates[rate_type].get_rates(np.arange(self.sizes[rate_type])),
+                        dtype=float)
+
+    def set_all_rates(self, rates, rate_type, total_rate=None):
+        """Rebuild a rate structure from an array of every rate, e.g. when restoring a checkpoint.
+
+        Structures keeping a running total rate are given total_rate if specified, as rounding error
+        in a running total depends on the order rates were changed.
+        """
+
+        rate_struct = self.all_rates[rate_type]
+        rate_struct.zero_rates()
+        rate_struct.bulk_insert(rates)
+        if total_rate is not None and isinstance(rate_struct, (RateSum, RateGroup)):
+            rate_struct.totrate = total_rate
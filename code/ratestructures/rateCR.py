@@ -2,6 +2,7 @@ import numpy as np
 from namedlist import namedlist
 from .rateCRgroup import RateCRGroup
 from .ratetree import RateTree
+from ..randomnumbers import RandomNumbers
 
 
 IndexStorage = namedlist("IndexStorage", "iGroup", default=None)
@@ -9,9 +10,13 @@ IndexStorage = namedlist("IndexStorage", "iGroup", default=None)
 
 class RateCR:
 
-    def __init__(self, size, min_rate, max_rate):
+    def __init__(self, size, min_rate, max_rate, random_numbers=None):
         self.n_events_stored = size
 
+        if random_numbers is None:
+            random_numbers = RandomNumbers()
+        self.random_numbers = random_numbers
+
         log_min_rate = np.log2(min_rate)
         self.i_offset_min_rate = int(np.floor(log_min_rate))
         self.min_rate = np.power(2.0, self.i_offset_min_rate)
@@ -68,6 +73,10 @@ class RateCR:
     def get_rate(self, pos):
         return self.groups[self.location_to_storage_map[pos].iGroup].get_rate(pos)
 
+    def get_rates(self, positions):
+        return np.array([self.get_rate(pos) for pos in np.asarray(positions).tolist()],
+                        dtype=float)
+
     def select_event(self, rate):
         cumulative_rate = 0.0
 
@@ -95,6 +104,20 @@ class RateCR:
         for i in range(self.n_events_stored):
             self.location_to_storage_map[i].iGroup = self.i_group_zero
 
+    def bulk_insert(self, rates):
+        if len(rates) != self.n_events_stored:
+            raise RuntimeError("Wrong length of rates for bulk insert!")
+
+        self.zero_rates()
+        rates = np.asarray(rates, dtype=float)
+        nonzero = np.flatnonzero(rates > 0)
+        self.bulk_update(nonzero, rates[nonzero])
+
+    def bulk_update(self, positions, rates):
+        # Group membership is per event, so rates are inserted individually
+        for pos, rate in zip(np.asarray(positions).tolist(), np.asarray(rates).tolist()):
+            self.insert_rate(pos, rate)
+
     def _get_group_id_from_rate(self, rate):
 
         if rate > 0:
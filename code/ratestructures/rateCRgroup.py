@@ -35,8 +35,8 @@ class RateCRGroup:
         selected_event = -1
 
         while selected_event < 0:
-            random_rate = self.max_rate*np.random.random_sample()
-            random_index = np.random.randint(0, self.n_events_active)
+            random_rate = self.max_rate*self.parentCR.random_numbers.uniform()
+            random_index = self.parentCR.random_numbers.randint(self.n_events_active)
 
             if random_rate < self.events[random_index].Rate:
                 selected_event = self.events[random_index].iEvent
@@ -0,0 +1,125 @@
+import numpy as np
+
+
+class RateGroup:
+    """Rate structure grouping events with identical rates, e.g. advance rates for each state.
+
+    Each distinct rate value keeps a swap-remove set of the events with that rate, and empty sets are
+    removed, so selection is O(number of distinct rates currently in use) and insertion is O(1).
+    The total rate is kept as a running sum.  Only suitable when few distinct rates are used.
+    """
+
+    def __init__(self, size):
+        self.nevents = size
+        self.zero_rates()
+
+    def insert_rate(self, pos, rate):
+        if rate < 0:
+            rate = 0
+
+        old_rate = self.rates[pos]
+        if rate == old_rate:
+            return
+
+        if old_rate > 0:
+            self._remove_from_group(pos, self.group_map[old_rate])
+        if rate > 0:
+            self._add_to_group(pos, rate)
+
+        self.rates[pos] = rate
+        if self.group_rates:
+            self.totrate += rate - old_rate
+        else:
+            # Avoid accumulating rounding error once all rates are zero
+            self.totrate = 0.0
+
+    def get_rate(self, pos):
+        return self.rates[pos]
+
+    def get_rates(self, positions):
+        return self.rates[positions]
+
+    def select_event(self, rate):
+        cum_rate = 0.0
+
+        for group_rate, members in zip(self.group_rates, self.group_members):
+            total_group_rate = group_rate * len(members)
+            if rate < cum_rate + total_group_rate:
+                # Remaining rate is uniform on group, so also gives uniform choice of member
+                idx = int((rate - cum_rate) / group_rate)
+                return members[min(idx, len(members) - 1)]
+            cum_rate += total_group_rate
+
+        for members in reversed(self.group_members):
+            if members:
+                return members[-1]
+
+        return 0
+
+    def get_total_rate(self):
+        return self.totrate
+
+    def full_resum(self):
+        self.totrate = float(sum(group_rate * len(members)
+                                 for group_rate, members in zip(self.group_rates,
+                                                                self.group_members)))
+
+    def zero_rates(self):
+        self.rates = np.zeros(self.nevents)
+        self.member_index = np.zeros(self.nevents, dtype=int)
+
+        self.group_map = {}
+        self.group_rates = []
+        self.group_members = []
+        self.totrate = 0.0
+
+    def bulk_insert(self, rates):
+        if len(rates) != self.nevents:
+            raise RuntimeError("Wrong length of rates for bulk insert!")
+
+        self.zero_rates()
+        self.rates = np.array(rates, dtype=float)
+        self.rates[self.rates < 0] = 0
+
+        for rate in np.unique(self.rates[self.rates > 0]):
+            members = np.flatnonzero(self.rates == rate)
+            self.group_map[rate] = len(self.group_rates)
+            self.group_rates.append(rate)
+            self.group_members.append(members.tolist())
+            self.member_index[members] = np.arange(len(members))
+
+        self.full_resum()
+
+    def bulk_update(self, positions, rates):
+        for pos, rate in zip(np.asarray(positions).tolist(), np.asarray(rates).tolist()):
+            self.insert_rate(pos, rate)
+
+    def _add_to_group(self, pos, rate):
+        group = self.group_map.get(rate, None)
+        if group is None:
+            group = len(self.group_rates)
+            self.group_map[rate] = group
+            self.group_rates.append(rate)
+            self.group_members.append([])
+
+        members = self.group_members[group]
+        self.member_index[pos] = len(members)
+        members.append(pos)
+
+    def _remove_from_group(self, pos, group):
+        members = self.group_members[group]
+        idx = self.member_index[pos]
+        last_pos = members.pop()
+        if last_pos != pos:
+            members[idx] = last_pos
+            self.member_index[last_pos] = idx
+
+        if not members:
+            # Swap last group into place of the now empty group
+            del self.group_map[self.group_rates[group]]
+            last_rate = self.group_rates.pop()
+            last_members = self.group_members.pop()
+            if group < len(self.group_rates):
+                self.group_rates[group] = last_rate
+                self.group_members[group] = last_members
+                self.group_map[last_rate] = group
@@ -4,6 +4,7 @@ import numpy as np
 class RateInterval:
 
     def __init__(self, size):
+        self.nevents = size
         self.interval_length = int(np.sqrt(size))
         if self.interval_length < 1:
             self.interval_length = 1
@@ -30,6 +31,9 @@ class RateInterval:
     def get_rate(self, pos):
         return self.sub_individ_rates[pos]
 
+    def get_rates(self, positions):
+        return self.sub_individ_rates[positions]
+
     def select_event(self, rate):
         intervalID = self._interval_search_super(rate)
 
@@ -60,6 +64,29 @@ class RateInterval:
 
         self.totrate = 0.0
 
+    def bulk_insert(self, rates):
+        if len(rates) != self.nevents:
+            raise RuntimeError("Wrong length of rates for bulk insert!")
+
+        self.zero_rates()
+        self.bulk_update(np.arange(len(rates)), rates)
+
+    def bulk_update(self, positions, rates):
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == 0:
+            return
+
+        self.sub_individ_rates[positions] = rates
+
+        # Sub interval cumulative sums are recalculated when searched, so only interval totals
+        # need updating here
+        intervals = np.unique(positions // self.interval_length)
+        self.super_individ_rates[intervals] = self.sub_individ_rates.reshape(
+            self.n_intervals, self.interval_length)[intervals].sum(axis=1)
+        self.flag_changes = min(self.flag_changes, int(intervals[0]))
+
+        self.totrate = np.sum(self.super_individ_rates)
+
     def _sum_super_rates(self):
         val = self.super_individ_rates[0]
         self.super_sum_rates[0] = val
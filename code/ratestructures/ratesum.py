@@ -18,6 +18,9 @@ class RateSum:
     def get_rate(self, pos):
         return self.rates[pos]
 
+    def get_rates(self, positions):
+        return self.rates[positions]
+
     def select_event(self, rate):
         eventID = 0
         cum_rate = self.rates[0]
@@ -44,3 +47,8 @@ class RateSum:
 
         self.rates = np.array(rates)
         self.full_resum()
+
+    def bulk_update(self, positions, rates):
+        # Positions must be unique
+        self.rates[positions] = np.maximum(rates, 0)
+        self.full_resum()
@@ -35,6 +35,9 @@ class RateTree:
     def get_rate(self, pos):
         return self.rates[pos]
 
+    def get_rates(self, positions):
+        return self.rates[self.tree_levels[1] + np.asarray(positions, dtype=np.int64)]
+
     def select_event(self, rate):
         level = self.n_tree_levels - 1
 
@@ -56,19 +59,19 @@ class RateTree:
         return self.totrate
 
     def full_resum(self):
-        level_length = self.padded_length/2
+        level_length = self.padded_length // 2
 
         for i in range(2, self.n_tree_levels + 1):
-            for j in range(int(level_length)):
-                self.rates[self.tree_levels[i] + j] = self.rates[self.tree_levels[i-1] + 2*j] + \
-                    self.rates[self.tree_levels[i-1] + 2*j + 1]
-            level_length /= 2
+            start = self.tree_levels[i-1]
+            self.rates[self.tree_levels[i]:(self.tree_levels[i] + level_length)] = \
+                self.rates[start:(start + 2*level_length):2] + \
+                self.rates[(start + 1):(start + 2*level_length):2]
+            level_length //= 2
 
         self.totrate = self.rates[self.tree_levels[self.n_tree_levels]]
 
     def zero_rates(self):
-        for i in range(2*self.padded_length - 1):
-            self.rates[i] = 0
+        self.rates[:] = 0
 
         self.totrate = 0
 
@@ -89,3 +92,16 @@ class RateTree:
         self.zero_rates()
         self.rates[self.tree_levels[1]:(self.tree_levels[1]+self.nevents)] = rates
         self.full_resum()
+
+    def bulk_update(self, positions, rates):
+        # Set leaves, then resum only the parents of changed leaves at each level
+        locs = np.asarray(positions, dtype=np.int64)
+        self.rates[self.tree_levels[1] + locs] = rates
+
+        for i in range(2, self.n_tree_levels + 1):
+            locs = np.unique(locs >> 1)
+            start = self.tree_levels[i-1]
+            self.rates[self.tree_levels[i] + locs] = \
+                self.rates[start + 2*locs] + self.rates[start + 2*locs + 1]
+
+        self.totrate = self.rates[self.tree_levels[self.n_tree_levels]]
@@ -0,0 +1,49 @@
+"""Queue of actions carried out at fixed simulation times, such as intervention updates and output."""
+
+import heapq
+import itertools
+import numpy as np
+
+# Order of actions and events at the same time.  Interventions act before an event at the same time,
+# and output records the state after both.
+INTERVENTION = 0
+EVENT = 1
+OUTPUT = 2
+
+
+class Scheduler:
+    """Heap of timed actions, ordered by time then priority.
+
+    Each action is called with the time it is scheduled for, and returns the time it is next due,
+    or None if it is not to be repeated.  Actions flagged as changing rates invalidate the next
+    event, which must then be redrawn.
+
+    Attributes:
+        head:   (time, priority) of the next action, or (inf, OUTPUT) if there are none.  Compare
+                with (event time, EVENT) to find whether an action is due before an event.
+    """
+
+    def __init__(self):
+        self.queue = []
+        self.head = (np.inf, OUTPUT)
+        self._count = itertools.count()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def schedule(self, time, priority, action, changes_rates=False):
+        """Add action to carry out at time.  Nothing is scheduled if time is None or infinite."""
+
+        if time is None or time == np.inf:
+            return
+        heapq.heappush(self.queue, (time, priority, next(self._count), action, changes_rates))
+        self.head = self.queue[0][:2]
+
+    def run_next(self):
+        """Carry out the next action and reschedule it, returning whether it changed rates."""
+
+        time, priority, _, action, changes_rates = heapq.heappop(self.queue)
+        self.head = self.queue[0][:2] if self.queue else (np.inf, OUTPUT)
+
+        self.schedule(action(time), priority, action, changes_rates)
+        return changes_rates
@@ -0,0 +1,98 @@
+"""Sharing of simulator setup between processes."""
+
+import pickle
+from multiprocessing import shared_memory
+import numpy as np
+from . import hosts
+
+# Large read-only arrays created by Simulator.setup, that are shared rather than copied
+SHARED_PARAMS = ["kernel_vals", "distances", "kernel", "coupled_kernel", "init_inf_rates",
+                 "init_adv_rates", "init_spore_rates", "init_host_states", "init_cell_counts",
+                 "cell_counts", "cell_grid_index", "grid_cell_ids"]
+
+
+class SharedSetup:
+    """Simulator setup published for use by other processes.
+
+    The large arrays created during Simulator.setup (kernel matrix, initial rates and cell state
+    grid) are copied into shared memory blocks, and the remainder of the simulator is pickled once.
+    Worker processes call attach to get a Simulator viewing the shared arrays, without re-running
+    setup or copying the arrays.  The shared arrays are read-only; each attached simulator gets its
+    own copy of the cell state counts, as these change during a run.
+
+    The process creating the SharedSetup must call close once all workers are finished.
+    """
+
+    def __init__(self, simulator):
+        self.shared_arrays = {}
+        self._shared_memory = []
+        self._attached = None
+
+        params = simulator.params
+        stripped = {}
+        shared_ids = {}
+
+        for key in SHARED_PARAMS:
+            value = params.get(key, None)
+            if not isinstance(value, np.ndarray):
+                continue
+            if id(value) not in shared_ids:
+                shm = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+                np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+                self._shared_memory.append(shm)
+                shared_ids[id(value)] = (shm.name, value.shape, value.dtype.str)
+            self.shared_arrays[key] = shared_ids[id(value)]
+            stripped[key] = value
+            params[key] = None
+
+        # Cell state counts are replaced by rows of the shared cell_counts array on attach
+        cell_states = []
+        if params.get('init_cells', None) is not None and "cell_counts" in self.shared_arrays:
+            for cell in params['init_cells']:
+                cell_states.append(cell.states.counts)
+                cell.states.counts = None
+
+        try:
+            self.pickled_sim = pickle.dumps(simulator, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            params.update(stripped)
+            for cell, counts in zip(params['init_cells'] or [], cell_states):
+                cell.states.counts = counts
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shared_memory'] = []
+        state['_attached'] = None
+        return state
+
+    def attach(self):
+        """Create a new Simulator from the shared setup, ready for initialise."""
+
+        if self._attached is None:
+            # Attach to shared memory blocks once per process
+            self._attached = {}
+            for name, shape, dtype in self.shared_arrays.values():
+                if name not in self._attached:
+                    shm = shared_memory.SharedMemory(name=name)
+                    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+                    array.flags.writeable = False
+                    self._attached[name] = (shm, array)
+
+        simulator = pickle.loads(self.pickled_sim)
+
+        for key, (name, shape, dtype) in self.shared_arrays.items():
+            simulator.params[key] = self._attached[name][1]
+
+        if "cell_counts" in self.shared_arrays:
+            simulator.params['cell_counts'] = hosts.pack_cell_states(
+                simulator.params['init_cells'], np.array(simulator.params['cell_counts']))
+
+        return simulator
+
+    def close(self):
+        """Release the shared memory blocks.  Only call from the creating process."""
+
+        for shm in self._shared_memory:
+            shm.close()
+            shm.unlink()
+        self._shared_memory = []
@@ -1,15 +1,27 @@
 import pdb
+from IndividualSimulator.code import batch
+from IndividualSimulator.code.aggregate import EnsembleAggregate
+from IndividualSimulator.code import checkpoint
+from IndividualSimulator.code import columnar
 from IndividualSimulator.code import config
 from IndividualSimulator.code import hosts
 from IndividualSimulator.code import outputdata
 from IndividualSimulator.code.eventhandling import EventHandler
+from IndividualSimulator.code.eventlog import EventLog
 from IndividualSimulator.code.interventionhandling import InterventionHandler
+from IndividualSimulator.code.outputwriter import BackgroundWriter
+from IndividualSimulator.code.randomnumbers import RandomNumbers, iteration_seed
+from IndividualSimulator.code.scheduler import Scheduler, INTERVENTION, EVENT, OUTPUT
+from IndividualSimulator.code.sharedsetup import SharedSetup
 from IndividualSimulator.code.ratehandling import RateHandler
 from IndividualSimulator.code.ratestructures.ratetree import RateTree
 from IndividualSimulator.code.ratestructures.ratesum import RateSum
 import argparse
 import copy
+import functools
 import inspect
+import multiprocessing
+import os
 import numpy as np
 import time as time_mod
 import raster_tools
@@ -20,21 +32,37 @@ __version__ = "0.0.10"
 
 def kernel_exp(kernel_param):
 
-    def kernel(dist):
-        if dist > 0:
-            return np.exp(-kernel_param*dist)
-        else:
-            return 0
+    return functools.partial(_kernel_exp, kernel_param)
+
 
-    return kernel
+def _kernel_exp(kernel_param, dist):
+    if dist > 0:
+        return np.exp(-kernel_param*dist)
+    else:
+        return 0
 
 
 def kernel_nonspatial():
 
-    def kernel(dist):
-        return 1.0
+    return _kernel_nonspatial
+
+
+def _kernel_nonspatial(dist):
+    return 1.0
+
 
-    return kernel
+def next_state(states, current_state):
+    """State following current_state in the model, or None if there is no next state."""
+
+    try:
+        idx = states.index(current_state)
+    except ValueError:
+        return None
+
+    if idx + 1 < len(states):
+        return states[idx + 1]
+
+    return None
 
 
 def calc_dist_kernel(hosts, kernel):
@@ -57,7 +85,7 @@ def calc_dist_kernel(hosts, kernel):
 
 class Simulator:
 
-    def __init__(self, params=None, config_file=None):
+    def __init__(self, params=None, config_file=None, seed=None):
         if params is not None:
             self.params = copy.deepcopy(params)
         elif config_file is not None:
@@ -66,29 +94,47 @@ class Simulator:
         else:
             raise ValueError("Must specify either parameter dictionary or configuration file!")
 
+        # Random number generator owned by this simulator, for reproducible runs
+        if seed is None:
+            seed = self.params['Seed']
+        self.random_numbers = RandomNumbers(seed, block_size=self.params['RandomBlockSize'])
+
+        # Memory-mapped raster output array of current run, if RasterOutputCube is True
+        self.raster_cube = None
+
+        if self.params['BackgroundOutput'] is True:
+            self.output_writer = BackgroundWriter(self.params['OutputQueueSize'])
+        else:
+            self.output_writer = None
+
+    def seed(self, seed):
+        """Reseed the random number generator used for epidemic runs."""
+
+        self.random_numbers.seed(seed)
+
+    def seed_iteration(self, iteration):
+        """Switch to the independent random number stream for an iteration, if Seed is set."""
+
+        if self.params['Seed'] is not None:
+            self.seed(iteration_seed(self.params['Seed'], iteration))
+
     def setup(self, silent=False):
         """Run all static setup before epidemic simulations."""
 
         start_time = time_mod.time()
 
+        columnar.check_format(self.params['OutputFormat'])
+
         # Setup function to get next state from current state
         states = list(self.params['Model'])
 
-        def next_state_func(current_state):
-            states_iter = iter(states)
-            state = next(states_iter, None)
-            while current_state != state:
-                state = next(states_iter, None)
-                if state is None:
-                    break
-            return next(states_iter, None)
-
-        self.params['next_state'] = next_state_func
+        self.params['next_state'] = functools.partial(next_state, states)
 
         # Read in hosts
         init_hosts, init_cells, header = hosts.read_host_files(
             self.params['HostPosFile'].split(","), self.params['InitCondFile'].split(","),
-            self.params['RegionFile'], states, sim_type=self.params['SimulationType'])
+            self.params['RegionFile'], states, sim_type=self.params['SimulationType'],
+            counts_only=self.params['CountOnlyRaster'])
         self.params['init_hosts'] = init_hosts
         self.params['init_cells'] = init_cells
         self.params['header'] = header
@@ -99,9 +145,26 @@ class Simulator:
                                  self.params['InfectiousnessFile'],
                                  sim_type=self.params['SimulationType'])
 
-        self.params['nhosts'] = len(self.params['init_hosts'])
         if self.params['init_cells'] is not None:
             self.params['ncells'] = len(self.params['init_cells'])
+            self.params['cell_counts'] = hosts.pack_cell_states(self.params['init_cells'])
+            # Position of each cell in flattened raster, for raster output
+            self.params['cell_grid_index'] = np.array(
+                [row*header['ncols'] + col for row, col in
+                 (cell.cell_position for cell in self.params['init_cells'])], dtype=np.int64)
+            # Cell at each position in flattened raster, or -1 if none, for vectorised lookups
+            self.params['grid_cell_ids'] = np.full(header['nrows'] * header['ncols'], -1,
+                                                   dtype=np.int64)
+            self.params['grid_cell_ids'][self.params['cell_grid_index']] = np.arange(
+                self.params['ncells'])
+
+        if self.params['init_hosts'] is None:
+            # Only tracking counts: advance events are for each state in each cell
+            self.params['nhosts'] = int(np.sum(self.params['cell_counts']))
+            self.params['advance_size'] = self.params['ncells'] * len(hosts.ALL_STATES)
+        else:
+            self.params['nhosts'] = len(self.params['init_hosts'])
+            self.params['advance_size'] = self.params['nhosts']
 
         # Kernel setup
         if self.params['KernelType'] == "EXPONENTIAL":
@@ -165,14 +228,13 @@ class Simulator:
             self.params['init_inf_rates'] = np.zeros(self.params['ncells'])
             if self.params['VirtualSporulationStart'] is not None:
                 self.params['init_spore_rates'] = np.zeros(self.params['ncells'])
-        self.params['init_adv_rates'] = np.zeros(self.params['nhosts'])
+        self.params['init_adv_rates'] = np.zeros(self.params['advance_size'])
 
         if self.params['SimulationType'] == "INDIVIDUAL":
 
             for i in range(self.params['nhosts']):
                 current_state = self.params['init_hosts'][i].state
                 region = self.params['init_hosts'][i].reg
-                # self.params['init_region_summary'][region][current_state] += 1
                 self.params['region_map'][region].append(i)
                 if current_state in "ECDI":
                     self.params['init_adv_rates'][i] = self.params[current_state + 'AdvRate']
@@ -188,6 +250,15 @@ class Simulator:
             for cell in self.params['init_cells']:
                 self.params['cell_map'][cell.cell_position] = cell.cell_id
 
+            if self.params['CountOnlyRaster'] is True:
+                nstates = len(hosts.ALL_STATES)
+                for state in states:
+                    if state in "ECDI":
+                        state_idx = hosts.STATE_INDEX[state]
+                        self.params['init_adv_rates'][state_idx::nstates] = (
+                            self.params['cell_counts'][:, state_idx] *
+                            self.params[state + 'AdvRate'])
+
             for cell in self.params['init_cells']:
                 for host in cell.hosts:
                     current_state = host.state
@@ -224,6 +295,30 @@ class Simulator:
         # Intervention setup
         self.intervention_handler = InterventionHandler(self)
 
+        # Snapshot of initial host states and cell counts, restored at the start of each run
+        if self.params['init_hosts'] is not None:
+            self.params['init_host_states'] = hosts.get_host_states(self.params['init_hosts'])
+        if self.params['init_cells'] is not None:
+            self.params['init_cell_counts'] = np.copy(self.params['cell_counts'])
+
+        # Region of each host (or cell, when only tracking counts), and initial number of hosts in
+        # each state in each region
+        self.params['init_region_counts'] = np.zeros(
+            (self.params['NRegions'], len(hosts.ALL_STATES)), dtype=np.int64)
+        if self.params['init_hosts'] is not None:
+            self.params['host_regions'] = np.fromiter(
+                (host.reg for host in self.params['init_hosts']), dtype=np.int64,
+                count=self.params['nhosts'])
+            np.add.at(self.params['init_region_counts'],
+                      (self.params['host_regions'], self.params['init_host_states']), 1)
+        else:
+            # Cells have no region data, so all are in region 0
+            if self.params['NRegions'] > 1:
+                raise ValueError("CountOnlyRaster simulations only support a single region!")
+            self.params['cell_regions'] = np.zeros(self.params['ncells'], dtype=np.int64)
+            np.add.at(self.params['init_region_counts'], self.params['cell_regions'],
+                      self.params['cell_counts'].astype(np.int64))
+
         end_time = time_mod.time()
 
         if not silent:
@@ -234,20 +329,44 @@ class Simulator:
             print("Initial setup complete.  "
                   "Time taken: {0:.3f} seconds.".format(end_time - start_time))
 
-    def initialise(self, silent=False):
+    def initialise(self, silent=False, iteration=0):
         # Setup run parameters to keep track of iteration
         self.run_params = {}
-        self.run_params['all_events'] = []
-        # self.run_params['region_summary'] = copy.deepcopy(self.params['init_region_summary'])
-        # self.run_params['summary_dump'] = []
-
-        # self.all_hosts = copy.deepcopy(self.params['init_hosts'])
-        # self.all_cells = copy.deepcopy(self.params['init_cells'])
+        if (self.params['StreamEvents'] is True and self.params['OutputEventData'] is True and
+                self.params['AggregateRuns'] is not True):
+            if self.params['OutputFiles'] is not True:
+                raise ValueError("StreamEvents requires OutputFiles to be True!")
+            spool_stub = outputdata.event_spool_stub(self.params, iteration)
+            output_path = os.path.split(spool_stub)[0]
+            if output_path != "":
+                os.makedirs(output_path, exist_ok=True)
+        else:
+            spool_stub = None
+        self.run_params['all_events'] = EventLog(self.params['EventChunkSize'], spool_stub,
+                                                 writer=self.output_writer)
+        self.run_params['region_counts'] = np.copy(self.params['init_region_counts'])
+        if self.params['SummaryOutputFreq'] > 0:
+            # Preallocated store of region counts at each summary time
+            self.run_params['summary_counts'] = np.zeros(
+                (outputdata.summary_ntimes(self.params),) + self.params['init_region_counts'].shape,
+                dtype=np.int64)
+            self.run_params['summary_index'] = 0
+
+        # Restore hosts and cells to their initial state from setup
         self.all_hosts = self.params['init_hosts']
         self.all_cells = self.params['init_cells']
 
+        if self.all_hosts is not None:
+            hosts.reset_host_states(self.all_hosts, self.params['init_host_states'])
+        if self.event_handler.track_host_sets:
+            self.run_params['host_sets'] = hosts.HostStateSets(
+                self.params['host_regions'], self.params['NRegions'],
+                self.params['init_host_states'])
+        if self.all_cells is not None:
+            np.copyto(self.params['cell_counts'], self.params['init_cell_counts'])
+
         if not silent:
-            print("Copied hosts and cells", flush=True)
+            print("Restored initial hosts and cells", flush=True)
 
         # Zero all rates
         self.rate_handler.zero_rates()
@@ -274,62 +393,134 @@ class Simulator:
         self.intervention_handler.initialise_rates(self.all_hosts, self.all_cells)
 
 
+    def checkpoint(self, path):
+        """Save the current state of the run to a checkpoint file at path."""
+
+        checkpoint.write_checkpoint(self, path)
+
+    def restore(self, path):
+        """Restore run state from a checkpoint file.  Simulator must already be setup.
+
+        Calling run_epidemic after restoring continues the checkpointed run.
+        """
+
+        checkpoint.read_checkpoint(self, path)
+
+    def record_summary(self, until):
+        """Record current region state counts for all summary times up to until.
+
+        Returns the next summary time to record, or infinity once all summary times up to FinalTime
+        have been recorded.
+        """
+
+        freq = self.params['SummaryOutputFreq']
+        ntimes = outputdata.summary_ntimes(self.params)
+        summary_counts = self.run_params['summary_counts']
+        if ntimes > len(summary_counts):
+            # FinalTime has been increased since the run started
+            summary_counts = np.concatenate([summary_counts, np.zeros(
+                (ntimes - len(summary_counts),) + summary_counts.shape[1:], dtype=np.int64)])
+            self.run_params['summary_counts'] = summary_counts
+
+        index = self.run_params['summary_index']
+        while index < ntimes and index * freq <= until:
+            summary_counts[index] = self.run_params['region_counts']
+            index += 1
+        self.run_params['summary_index'] = index
+
+        if index < ntimes:
+            return index * freq
+        return np.inf
+
+    def _scheduled_raster(self, time, iteration=0):
+        """Output raster of the state at time, returning the next raster output time."""
+
+        self.time = time
+        outputdata.output_raster_data(self, time=time, iteration=iteration,
+                                      states=self.params['RasterStatesOutput'])
+        # Stored so the run can be continued from a checkpoint, or after increasing FinalTime.
+        # Accumulated as before, as raster filenames include the time.
+        self.run_params['next_raster_time'] = time + self.params['RasterOutputFreq']
+        return self.run_params['next_raster_time']
+
+    def _scheduled_intervention(self, time, intervention_num=0):
+        """Carry out intervention update at time, returning the next update time."""
+
+        self.time = time
+        return self.intervention_handler.update_intervention(
+            intervention_num, self.all_hosts, time, self.all_cells)
+
     def run_epidemic(self, iteration=0, silent=False):
         start_time = time_mod.time()
 
-        # Set time until first intervention
-        next_intervention_time = self.intervention_handler.next_intervention_time
-        if self.params['RasterOutputFreq'] != 0:
-            outputdata.output_raster_data(
-                self, time=self.time, iteration=iteration, states=self.params['RasterStatesOutput'])
-            nextRasterDumpTime = self.time + self.params['RasterOutputFreq']
-        else:
-            nextRasterDumpTime = np.inf
+        # Schedule intervention updates, raster output and summary samples
+        scheduler = Scheduler()
+        for i, int_time in enumerate(self.intervention_handler.next_interventions):
+            scheduler.schedule(int_time, INTERVENTION,
+                               functools.partial(self._scheduled_intervention, intervention_num=i),
+                               changes_rates=True)
+
+        if 'next_raster_time' not in self.run_params:
+            if self.params['RasterOutputFreq'] != 0:
+                outputdata.output_raster_data(self, time=self.time, iteration=iteration,
+                                              states=self.params['RasterStatesOutput'])
+                self.run_params['next_raster_time'] = self.time + self.params['RasterOutputFreq']
+            else:
+                self.run_params['next_raster_time'] = np.inf
+        # Otherwise continuing run restored from checkpoint, or after increasing FinalTime
+        scheduler.schedule(self.run_params['next_raster_time'], OUTPUT,
+                           functools.partial(self._scheduled_raster, iteration=iteration))
+
+        if self.params['SummaryOutputFreq'] > 0:
+            scheduler.schedule(self.record_summary(self.time), OUTPUT, self.record_summary)
+
+        checkpoint_interval = self.params['CheckpointInterval']
+        if checkpoint_interval > 0:
+            checkpoint_file = checkpoint.checkpoint_filename(self.params, iteration)
+            next_checkpoint = time_mod.time() + checkpoint_interval
+
+        final_time = self.params['FinalTime']
 
         # Run gillespie loop
         while True:
+            # Checkpoints are timed by wall-clock, so cannot be scheduled in simulation time
+            if checkpoint_interval > 0 and time_mod.time() >= next_checkpoint:
+                self.checkpoint(checkpoint_file)
+                next_checkpoint = time_mod.time() + checkpoint_interval
+
             # Find next event from event handler
             totRate, event_type, hostID = self.rate_handler.get_next_event()
             if event_type is None:
                 nextTime = np.inf
             else:
-                nextTime = self.time + (-1.0/totRate)*np.log(np.random.random_sample())
-
-            while np.minimum(nextTime, next_intervention_time) > nextRasterDumpTime:
-                if nextRasterDumpTime > self.params['FinalTime']:
-                    break
-                self.time = nextRasterDumpTime
-                outputdata.output_raster_data(self, time=self.time, iteration=iteration,
-                                              states=self.params['RasterStatesOutput'])
-                nextRasterDumpTime += self.params['RasterOutputFreq']
-
-            if nextTime >= next_intervention_time and nextTime != np.inf:
-                if next_intervention_time > self.params['FinalTime']:
-                    while nextRasterDumpTime <= self.params['FinalTime']:
-                        self.time = nextRasterDumpTime
-                        outputdata.output_raster_data(self, time=self.time, iteration=iteration,
-                                                    states=self.params['RasterStatesOutput'])
-                        nextRasterDumpTime += self.params['RasterOutputFreq']
-                    break
-                self.time = next_intervention_time
-                # carry out intervention update
-                self.intervention_handler.update(self.all_hosts, self.time, self.all_cells)
-                next_intervention_time = self.intervention_handler.next_intervention_time
-            else:
-                if nextTime > self.params['FinalTime']:
-                    while nextRasterDumpTime <= self.params['FinalTime']:
-                        self.time = nextRasterDumpTime
-                        outputdata.output_raster_data(self, time=self.time, iteration=iteration,
-                                                    states=self.params['RasterStatesOutput'])
-                        nextRasterDumpTime += self.params['RasterOutputFreq']
-                    break
-                # Carry out event
-                self.time = nextTime
-                event = self.event_handler.do_event(event_type, hostID, self.all_hosts,
-                                                    self.all_cells)
-                if (self.params['UpdateOnAllEvents'] is True) and (event is not None):
-                    self.intervention_handler.update_on_event(event, self.all_hosts, self.time,
-                                                              self.all_cells)
+                nextTime = self.time + self.random_numbers.exponential()/totRate
+
+            # Carry out scheduled actions due before the event.  If rates are changed the event is
+            # no longer valid, so a new event is drawn.
+            if scheduler.head < (nextTime, EVENT):
+                rates_changed = False
+                while scheduler.head < (nextTime, EVENT) and scheduler.head[0] <= final_time:
+                    if scheduler.run_next():
+                        rates_changed = True
+                        break
+                if rates_changed:
+                    continue
+
+            if nextTime > final_time:
+                break
+
+            # Carry out event
+            self.time = nextTime
+            event = self.event_handler.do_event(event_type, hostID, self.all_hosts,
+                                                self.all_cells)
+            # Events from intervention actions are dispatched by the intervention handler
+            if (self.params['UpdateOnAllEvents'] is True and event is not None and
+                    not event_type.startswith("Intervention")):
+                self.intervention_handler.update_on_event(
+                    event, self.all_hosts, self.time, self.all_cells, event_type=event_type)
+
+        if self.params['SummaryOutputFreq'] > 0:
+            self.record_summary(np.inf)
 
         self.time = self.params['FinalTime']
         end_time = time_mod.time()
@@ -350,28 +541,292 @@ class Simulator:
         return run_data
 
 
-def run_epidemics(params, silent=False, iteration_start=None):
-    if iteration_start is None:
-        iteration_start = 0
-    all_data = []
+def run_epidemics(params, silent=False, iteration_start=None, iterations=None):
+    """Run iterations, by default NIterations iterations starting from iteration_start.
+
+    Alternatively a list of iteration numbers to run can be given.  If AggregateRuns is True each
+    iteration is added to ensemble statistics as it completes, and the statistics are output and
+    returned instead of the run data (see EnsembleAggregate).
+    """
+
+    if params['NProcesses'] > 1:
+        return run_epidemics_parallel(params, silent=silent, iteration_start=iteration_start,
+                                      iterations=iterations)
+
+    iterations = _iteration_list(params, iteration_start, iterations)
+    return _collect_runs(params, _iter_epidemics(params, iterations, silent))
+
+
+def _iteration_list(params, iteration_start, iterations):
+    if iterations is None:
+        if iteration_start is None:
+            iteration_start = 0
+        iterations = range(iteration_start, iteration_start+params['NIterations'])
+    return iterations
+
+
+def _iter_epidemics(params, iterations, silent):
+    # Generate run data for each iteration in turn
     if params['SaveSetup']:
         run_sim = Simulator(params)
         run_sim.setup()
-        run_sim.initialise(silent=silent)
-    for iteration in range(iteration_start, iteration_start+params['NIterations']):
+    for iteration in iterations:
         if not params['SaveSetup']:
             run_sim = Simulator(params)
             run_sim.setup(silent=silent)
-            run_sim.initialise(silent=silent)
-        all_hosts, all_cells, run_params = run_sim.run_epidemic(iteration, silent=silent)
-        all_data.append(
-            run_sim.output_run_data(all_hosts, all_cells, run_params, iteration=iteration))
+        run_sim.seed_iteration(iteration)
+        yield run_iteration(run_sim, iteration, silent=silent)
+
+
+def _iter_runs(params, iterations, silent):
+    if params['NProcesses'] > 1:
+        return _iter_epidemics_parallel(params, iterations, silent, params['NProcesses'])
+    return _iter_epidemics(params, iterations, silent)
+
+
+def _aggregate_runs(params, all_runs):
+    aggregate = EnsembleAggregate(params)
+    for run_summary in all_runs:
+        aggregate.add_run(run_summary)
+    return aggregate
+
+
+def _collect_runs(params, all_runs):
+    # List of run data, or output ensemble statistics when aggregating runs
+    if params['AggregateRuns'] is True:
+        return _aggregate_runs(params, all_runs).output(params['OutputFileStub'])
+    return list(all_runs)
+
+
+def run_iteration(run_sim, iteration, silent=False):
+    """Initialise and run a single iteration, returning the output run data.
+
+    If checkpointing is enabled and a checkpoint exists for this iteration, the run continues from
+    the checkpoint.  The checkpoint is removed once the iteration is complete.
+    """
+
+    run_sim.initialise(silent=silent, iteration=iteration)
+
+    checkpoint_file = None
+    if run_sim.params['CheckpointInterval'] > 0:
+        checkpoint_file = checkpoint.checkpoint_filename(run_sim.params, iteration)
+        if os.path.exists(checkpoint_file):
+            run_sim.restore(checkpoint_file)
+            if not silent:
+                print("Resuming run {0} from checkpoint at time {1}".format(
+                    iteration+1, run_sim.time))
+
+    all_hosts, all_cells, run_params = run_sim.run_epidemic(iteration, silent=silent)
+    run_data = run_sim.output_run_data(all_hosts, all_cells, run_params, iteration=iteration)
+
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    return run_data
+
+
+def run_epidemics_parallel(params, silent=False, iteration_start=None, nprocesses=None,
+                           iterations=None):
+    """Run iterations in a pool of worker processes, sharing a single setup.
+
+    Setup is run once, and the large setup arrays are shared between workers through shared
+    memory (see SharedSetup).  Each worker attaches a single simulator, then initialises and runs
+    it for each of its share of the iterations.  Run data is returned in iteration order, or
+    aggregated as each run completes if AggregateRuns is True.
+    """
+
+    iterations = _iteration_list(params, iteration_start, iterations)
+    if nprocesses is None:
+        nprocesses = params['NProcesses']
+
+    return _collect_runs(params, _iter_epidemics_parallel(params, iterations, silent, nprocesses))
+
+
+def _iter_epidemics_parallel(params, iterations, silent, nprocesses):
+    # Generate run data for each iteration in order, as the pool completes them
+    run_sim = Simulator(params)
+    run_sim.setup(silent=silent)
+    shared_setup = SharedSetup(run_sim)
+    del run_sim
+
+    try:
+        with multiprocessing.Pool(nprocesses, initializer=_init_worker,
+                                  initargs=(shared_setup, silent)) as pool:
+            yield from pool.imap(_run_worker_iteration, iterations, chunksize=1)
+    finally:
+        shared_setup.close()
+
+
+_worker_state = {}
+
+
+def _init_worker(shared_setup, silent):
+    _worker_state['simulator'] = shared_setup.attach()
+    _worker_state['silent'] = silent
+
+
+def _run_worker_iteration(iteration):
+    silent = _worker_state['silent']
+    run_sim = _worker_state['simulator']
+    if run_sim.params['Seed'] is None:
+        # Fresh entropy, otherwise every worker would repeat the stream of the setup simulator
+        run_sim.seed(None)
+    else:
+        run_sim.seed_iteration(iteration)
+
+    return run_iteration(run_sim, iteration, silent=silent)
+
+
+def run_batch(params, batch_dir, shard_size=None, silent=False, iteration_start=None):
+    """Run iterations as one of any number of workers sharing a batch directory.
+
+    The NIterations iterations from iteration_start are split into shards of shard_size iterations
+    (default NProcesses), listed in a manifest in batch_dir.  Each worker claims shards through lock
+    files until none are left, running iterations whose outputs do not already exist under
+    OutputFileStub.  The worker completing the final shard merges the shard logs into the usual
+    log file.  If a worker fails, remove its shard lock file and run again to complete the shard.
+    If AggregateRuns is True each shard saves its ensemble statistics in batch_dir, and these are
+    merged and output with the log file.
+
+    Returns the list of iterations run by this worker.
+    """
+
+    if params['OutputFiles'] is not True:
+        raise ValueError("Batch runs require OutputFiles to be True!")
+
+    if iteration_start is None:
+        iteration_start = 0
+    if shard_size is None:
+        shard_size = params['NProcesses']
+    if 'call_params' not in params:
+        params = copy.deepcopy(params)
+        add_call_info(params)
+
+    manifest = batch.create_manifest(batch_dir, params['NIterations'], shard_size,
+                                     iteration_start=iteration_start)
+
+    output_path = os.path.split(params['OutputFileStub'])[0]
+    if output_path != "":
+        os.makedirs(output_path, exist_ok=True)
+
+    iterations_run = []
+    for shard, (start, stop) in enumerate(manifest['shards']):
+        if batch.shard_done(batch_dir, shard) or not batch.claim_shard(batch_dir, shard):
+            continue
+
+        start_time = time_mod.time()
+        if params['AggregateRuns'] is True:
+            # Statistics are saved for the whole shard, so all its iterations are run
+            iterations = list(range(start, stop))
+            shard_aggregate = _aggregate_runs(params, _iter_runs(params, iterations, silent))
+            shard_aggregate.save(batch.aggregate_filename(batch_dir, shard))
+        else:
+            iterations = [iteration for iteration in range(start, stop)
+                          if not _iteration_output_exists(params, iteration)]
+            if iterations:
+                run_epidemics(params, silent=silent, iterations=iterations)
+        iterations_run += iterations
+
+        details = "Iterations: {0} to {1}\n".format(start, stop-1)
+        details += "Iterations run: " + str(iterations) + "\n"
+        details += "Worker: " + batch.worker_id() + "\n"
+        details += "Time taken: {0:.3f} seconds".format(time_mod.time() - start_time)
+        batch.write_shard_log(batch_dir, shard, details, outputdata.log_file_text(params))
+
+        if not silent:
+            print("Shard {0} of {1} complete.".format(shard+1, len(manifest['shards'])))
+
+    if all(batch.shard_done(batch_dir, shard) for shard in range(len(manifest['shards']))):
+        batch.merge_logs(batch_dir, params['OutputFileStub'] + ".log")
+        if params['AggregateRuns'] is True:
+            aggregate = EnsembleAggregate(params)
+            for shard in range(len(manifest['shards'])):
+                aggregate.merge(EnsembleAggregate.load(batch.aggregate_filename(batch_dir, shard),
+                                                       params))
+            aggregate.output(params['OutputFileStub'])
+
+    return iterations_run
+
+
+def _iteration_output_exists(params, iteration):
+    """Whether all data files of an iteration exist, so it does not need rerunning.
+
+    Iterations with no data files, e.g. with only raster output, are always rerun, as raster files
+    are written during the run and so do not show the run completed.
+    """
+
+    filenames = outputdata.iteration_output_files(params, iteration)
+    return len(filenames) > 0 and all(os.path.exists(filename) for filename in filenames)
+
+
+def run_branches(run_sim, nbranches, final_time=None, seed=None, silent=False, nprocesses=None):
+    """Continue a run from its current state as nbranches independent branches.
+
+    Each branch continues from the current time and state of run_sim up to final_time (default
+    FinalTime), with its own random number stream spawned from seed (fresh entropy if None).  This
+    gives an ensemble of forecasts sharing the same history, without re-running that history.
+    run_sim can be part way through a run, e.g. after run_epidemic to an earlier FinalTime or after
+    restoring a checkpoint, and is left unchanged.
+
+    Where the platform supports it each branch runs in a process forked from this one, so the
+    branch only copies the memory it modifies.  Otherwise branches are run in turn on copies of
+    run_sim.  Run data is returned in branch order, with the branch number used as the iteration.
+    """
+
+    if nprocesses is None:
+        nprocesses = run_sim.params['NProcesses']
+
+    branch_seeds = np.random.SeedSequence(seed).spawn(nbranches)
+    branch_args = [(branch, branch_seed, final_time, silent)
+                   for branch, branch_seed in enumerate(branch_seeds)]
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        all_data = []
+        for args in branch_args:
+            _branch_state['simulator'] = copy.deepcopy(run_sim)
+            all_data.append(_run_branch(*args))
+        _branch_state.clear()
+        return all_data
+
+    # Forked workers inherit the simulator state; each branch runs in a fresh fork
+    _branch_state['simulator'] = run_sim
+    try:
+        with multiprocessing.get_context("fork").Pool(nprocesses, maxtasksperchild=1) as pool:
+            all_data = pool.starmap(_run_branch, branch_args, chunksize=1)
+    finally:
+        _branch_state.clear()
 
     return all_data
 
 
+_branch_state = {}
+
+
+def _run_branch(branch, branch_seed, final_time, silent):
+    run_sim = _branch_state['simulator']
+    run_sim.seed(branch_seed)
+    if final_time is not None:
+        run_sim.params['FinalTime'] = final_time
+    if run_sim.run_params['all_events'].spool_stub is not None:
+        run_sim.run_params['all_events'].move_spool(
+            outputdata.event_spool_stub(run_sim.params, branch))
+
+    all_hosts, all_cells, run_params = run_sim.run_epidemic(branch, silent=silent)
+    return run_sim.output_run_data(all_hosts, all_cells, run_params, iteration=branch)
+
+
+def add_call_info(params, config_file="", module=""):
+    """Record details of the simulator call in params, for the log file."""
+
+    params['call_params'] = copy.deepcopy(params)
+    params['call_config_file'] = config_file
+    params['call_module'] = module
+    params['call_time'] = time_mod.strftime("%a, %d %b %Y %H:%M:%S", time_mod.localtime())
+    params['call_version'] = __version__
+
+
 def main(configFile="config.ini", keyFile=False, defaultConfig=None, params_options=None,
-         silent=False):
+         silent=False, batchDir=None):
     frame = inspect.stack()[1]
     modu = inspect.getmodule(frame[0])
 
@@ -392,11 +847,12 @@ def main(configFile="config.ini", keyFile=False, defaultConfig=None, params_opti
                 params[key] = value
 
 
-        params['call_params'] = copy.deepcopy(params)
-        params['call_config_file'] = configFile
-        params['call_module'] = str(modu)
-        params['call_time'] = time_mod.strftime("%a, %d %b %Y %H:%M:%S", time_mod.localtime())
-        params['call_version'] = __version__
+        add_call_info(params, config_file=configFile, module=str(modu))
+
+        if batchDir is not None:
+            # Log file is written by the batch once all shards are complete
+            return run_batch(params, batchDir, silent=silent)
+
         all_data = run_epidemics(params, silent=silent)
 
         outputdata.output_log_file(params)
@@ -418,6 +874,9 @@ if __name__ == "__main__":
                         nargs="?", help="Flag to generate default config file."
                         "  If present file is created and program exits.  "
                         "Optionally specify filename.")
+    parser.add_argument("-b", "--batchDir", default=None,
+                        help="Shared batch directory.  If present iterations are split into "
+                        "shards, and run by any number of workers using the same directory.")
     args = parser.parse_args()
 
     main(**vars(args))
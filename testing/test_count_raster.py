@@ -0,0 +1,237 @@
+import os
+import glob
+import tempfile
+import unittest
+import numpy as np
+import raster_tools
+from IndividualSimulator import simulator
+from IndividualSimulator.code import config
+from IndividualSimulator.code import hosts
+
+
+class CountRasterTests(unittest.TestCase):
+    """Test count only raster simulations match raster simulations with individual hosts."""
+
+    @classmethod
+    def setUpClass(cls):
+        # Setup random host landscape with a few infected cells and exponential style kernel
+
+        size = (10, 10)
+        kernel_size = (5, 5)
+        kernel_centre = [int(x/2) for x in kernel_size]
+
+        # Create host file
+        host_array = np.random.randint(0, 5, size)
+        host_raster = raster_tools.RasterData(size, array=host_array)
+        host_file = os.path.join("testing", "count_raster_host_test_case.txt")
+        host_raster.to_file(host_file)
+
+        # Create initial conditions files
+        inf_array = np.zeros(size)
+        inf_array[host_array > 3] = 1
+        init_stub = os.path.join("testing", "count_raster_init_test_case")
+        raster_tools.RasterData(size, array=host_array - inf_array).to_file(init_stub + "_S.txt")
+        raster_tools.RasterData(size, array=np.zeros(size)).to_file(init_stub + "_E.txt")
+        raster_tools.RasterData(size, array=inf_array).to_file(init_stub + "_I.txt")
+        raster_tools.RasterData(size, array=np.zeros(size)).to_file(init_stub + "_R.txt")
+
+        # Create kernel file
+        kernel_raster = raster_tools.RasterData(kernel_size, array=np.full(kernel_size, 0.1))
+        kernel_raster.array[kernel_centre[0], kernel_centre[1]] = 0.5
+        kernel_raster.to_file(init_stub + "_kernel.txt")
+
+        # Setup config file
+        cls._config_filename = os.path.join("testing", "count_raster_config.ini")
+        config_str = "\n[Epidemiology]\n"
+        config_str += "Model = SEIR\nInfRate = 1.0\nEAdvRate = 0.5\nIAdvRate = 0.2\n"
+        config_str += "KernelType = RASTER\n"
+        config_str += "\n[Simulation]\n"
+        config_str += "SimulationType = RASTER\nFinalTime = 5\nNIterations = 1\nMaxHosts = 5\n"
+        config_str += "HostPosFile = " + host_file + "\nInitCondFile = " + init_stub + "\n"
+        config_str += "KernelFile = " + init_stub + "_kernel.txt" + "\n"
+        config_str += "\n[Output]\n"
+        config_str += "RasterOutputFreq = 0\nOutputFiles = False\n"
+        with open(cls._config_filename, "w") as outfile:
+            outfile.write(config_str)
+
+    def _setup_simulator(self, count_only):
+        params = config.read_config_file(filename=self._config_filename)
+        params['CountOnlyRaster'] = count_only
+        sim = simulator.Simulator(params)
+        sim.setup(silent=True)
+        sim.initialise(silent=True)
+        return sim
+
+    def test_initial_rates(self):
+        """Test count only initial rates match host based simulation."""
+
+        host_sim = self._setup_simulator(False)
+        count_sim = self._setup_simulator(True)
+
+        self.assertIsNone(count_sim.all_hosts)
+        self.assertEqual(host_sim.params['nhosts'], count_sim.params['nhosts'])
+        self.assertTrue(np.array_equal(host_sim.params['cell_counts'],
+                                       count_sim.params['cell_counts']))
+        self.assertTrue(np.allclose(host_sim.params['init_inf_rates'],
+                                    count_sim.params['init_inf_rates']))
+        self.assertAlmostEqual(host_sim.rate_handler.get_total_rate(),
+                               count_sim.rate_handler.get_total_rate())
+
+    def test_rategroup_invalid(self):
+        """Test rategroup advance rate structure is rejected for raster simulations."""
+
+        for count_only in [False, True]:
+            params = config.read_config_file(filename=self._config_filename)
+            params['CountOnlyRaster'] = count_only
+            params['RateStructure-Advance'] = "rategroup"
+            sim = simulator.Simulator(params)
+            self.assertRaises(ValueError, sim.setup, silent=True)
+
+    def test_regions_invalid(self):
+        """Test count only simulations are rejected with multiple regions."""
+
+        params = config.read_config_file(filename=self._config_filename)
+        params['CountOnlyRaster'] = True
+        params['NRegions'] = 2
+        self.assertRaises(ValueError, config.check_params_valid, params)
+
+        sim = simulator.Simulator(params)
+        self.assertRaises(ValueError, sim.setup, silent=True)
+
+        params['CountOnlyRaster'] = False
+        config.check_params_valid(params)
+
+    def test_raster_output(self):
+        """Test raster output in background and in raster cube matches raster files."""
+
+        params = config.read_config_file(filename=self._config_filename)
+        params['CountOnlyRaster'] = True
+        params['RasterOutputFreq'] = 1.0
+        params['Seed'] = 2
+        states = list(params['Model']) + ["Culled"]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            params['RasterFileStub'] = os.path.join(temp_dir, "raster")
+            simulator.run_epidemics(params, silent=True)
+
+            params['BackgroundOutput'] = True
+            params['RasterFileStub'] = os.path.join(temp_dir, "background")
+            simulator.run_epidemics(params, silent=True)
+            for filename in glob.glob(os.path.join(temp_dir, "raster_*.txt")):
+                with open(filename, "r") as infile1:
+                    with open(filename.replace("raster_", "background_"), "r") as infile2:
+                        self.assertEqual(infile1.read(), infile2.read())
+
+            params['BackgroundOutput'] = False
+            params['RasterOutputCube'] = True
+            params['RasterFileStub'] = os.path.join(temp_dir, "cube")
+            simulator.run_epidemics(params, silent=True)
+            cube = np.load(os.path.join(temp_dir, "cube_0.npy"))
+
+            self.assertEqual(cube.shape, (6, len(states), 10, 10))
+            for state_idx, state in enumerate(states):
+                filenames = glob.glob(os.path.join(temp_dir, "raster_0_" + state + "_*.txt"))
+                self.assertEqual(len(filenames), 6)
+                for filename in filenames:
+                    time = float(os.path.splitext(filename)[0].split("_")[-1])
+                    raster = raster_tools.RasterData.from_file(filename)
+                    self.assertTrue(np.array_equal(raster.array, cube[int(time), state_idx]))
+
+    def test_raster_filenames(self):
+        """Test raster output times in filenames are accumulated from the output frequency."""
+
+        params = config.read_config_file(filename=self._config_filename)
+        params['CountOnlyRaster'] = True
+        params['RasterOutputFreq'] = 0.2
+        params['Seed'] = 2
+
+        expected = []
+        time = 0
+        while time <= params['FinalTime']:
+            expected.append(str(time))
+            time += params['RasterOutputFreq']
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            params['RasterFileStub'] = os.path.join(temp_dir, "raster")
+            simulator.run_epidemics(params, silent=True)
+            filenames = glob.glob(os.path.join(temp_dir, "raster_0_S_*.txt"))
+
+        times = [os.path.splitext(filename)[0].split("_S_")[-1] for filename in filenames]
+        self.assertEqual(sorted(times, key=float), expected)
+        self.assertIn("1.2", times)
+
+    def test_batch_raster_output(self):
+        """Test batch runs with only raster output run every iteration."""
+
+        params = config.read_config_file(filename=self._config_filename)
+        params['CountOnlyRaster'] = True
+        params['RasterOutputFreq'] = 1.0
+        params['NIterations'] = 3
+        params['OutputHostData'] = False
+        params['OutputEventData'] = False
+        params['OutputFiles'] = True
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            params['OutputFileStub'] = os.path.join(temp_dir, "output")
+            params['RasterFileStub'] = os.path.join(temp_dir, "raster")
+            batch_dir = os.path.join(temp_dir, "batch")
+
+            self.assertEqual(simulator.run_batch(params, batch_dir, shard_size=2, silent=True),
+                             [0, 1, 2])
+            for iteration in range(3):
+                self.assertEqual(len(glob.glob(os.path.join(
+                    temp_dir, "raster_" + str(iteration) + "_I_*.txt"))), 6)
+            self.assertEqual(simulator.run_batch(params, batch_dir, shard_size=2, silent=True), [])
+
+    def test_advance_event(self):
+        """Test advance event in count only simulation updates counts and rates."""
+
+        count_sim = self._setup_simulator(True)
+        cell = next(cell for cell in count_sim.all_cells if cell.states["I"] > 0)
+        n_inf = cell.states["I"]
+        event_id = hosts.cell_state_id(cell.cell_id, "I")
+
+        count_sim.event_handler.do_event("Advance", event_id, count_sim.all_hosts,
+                                         count_sim.all_cells)
+
+        self.assertEqual(cell.states["I"], n_inf - 1)
+        self.assertEqual(cell.states["R"], 1)
+        self.assertEqual(count_sim.params['cell_counts'][cell.cell_id, hosts.STATE_INDEX["R"]], 1)
+        self.assertAlmostEqual(count_sim.rate_handler.get_rate(event_id, "Advance"),
+                               (n_inf - 1) * 0.2)
+
+    def test_batch_cull(self):
+        """Test batch cull gives same states and rates as culling hosts one at a time."""
+
+        for count_only in [False, True]:
+            sims = [self._setup_simulator(count_only) for _ in range(2)]
+            if count_only:
+                cells = np.flatnonzero(sims[0].params['cell_counts'][:, hosts.STATE_INDEX["I"]])
+                event_ids = [hosts.cell_state_id(cell_id, state)
+                             for cell_id in cells[:10].tolist() for state in ["S", "I"]
+                             if sims[0].all_cells[cell_id].states[state] > 0]
+            else:
+                event_ids = [host.host_id for host in sims[0].all_hosts
+                             if host.state == "I"][:10]
+                event_ids += [host.host_id for host in sims[0].all_hosts
+                              if host.state == "S"][::7]
+
+            events = [sims[0].event_handler.do_event("CULL", event_id, sims[0].all_hosts,
+                                                     sims[0].all_cells)
+                      for event_id in event_ids]
+            batch_events = sims[1].event_handler.do_event_cull_batch(
+                event_ids, sims[1].all_hosts, sims[1].all_cells)
+
+            self.assertEqual(events, batch_events)
+            self.assertTrue(np.array_equal(sims[0].params['cell_counts'],
+                                           sims[1].params['cell_counts']))
+            for rate_type in ["Infection", "Advance"]:
+                rates = [sim.rate_handler.all_rates[rate_type].rates for sim in sims]
+                self.assertTrue(np.allclose(rates[0], rates[1]))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls._config_filename)
+        os.remove(os.path.join("testing", "count_raster_host_test_case.txt"))
+        for file in glob.glob(os.path.join("testing", "count_raster_init_test_case_*")):
+            os.remove(file)
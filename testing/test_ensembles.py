@@ -0,0 +1,378 @@
+import os
+import glob
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from IndividualSimulator import simulator
+from IndividualSimulator.code import columnar
+from IndividualSimulator.code import config
+from IndividualSimulator.code.eventlog import STATE_NAMES
+from IndividualSimulator.code.sharedsetup import SharedSetup
+
+
+class EnsembleTests(unittest.TestCase):
+    """Test running ensembles of seeded simulations."""
+
+    @classmethod
+    def setUpClass(cls):
+        # Setup small individual landscape with a few initially infected hosts
+
+        cls._data_stub = os.path.join("testing", "ensemble_sim_output")
+        nhosts = 100
+        positions = np.random.rand(nhosts, 2) * 5
+
+        # Create host and initial condition files
+        host_file = os.path.join("testing", "ensemble_host_test_case.txt")
+        with open(host_file, "w") as outfile:
+            outfile.write(str(nhosts) + "\n")
+            for x, y in positions:
+                outfile.write(str(x) + " " + str(y) + "\n")
+
+        init_file = os.path.join("testing", "ensemble_init_test_case.txt")
+        with open(init_file, "w") as outfile:
+            outfile.write(str(nhosts) + "\n")
+            for i in range(nhosts):
+                outfile.write(("I" if i < 3 else "S") + "\n")
+
+        # Setup config file
+        cls._config_filename = os.path.join("testing", "ensemble_config.ini")
+        config_str = "\n[Epidemiology]\n"
+        config_str += "Model = SIR\nInfRate = 0.2\nIAdvRate = 0.5\n"
+        config_str += "KernelType = EXPONENTIAL\nKernelScale = 1.0\n"
+        config_str += "\n[Simulation]\n"
+        config_str += "SimulationType = INDIVIDUAL\nFinalTime = 5\nNIterations = 4\nSeed = 12\n"
+        config_str += "HostPosFile = " + host_file + "\nInitCondFile = " + init_file + "\n"
+        config_str += "\n[Output]\n"
+        config_str += "RasterOutputFreq = 0\nOutputFiles = False\n"
+        config_str += "OutputFileStub = " + cls._data_stub + "\n"
+        config_str += "\n[Optimisation]\n"
+        config_str += "CacheKernel = True\nSaveSetup = False\n"
+        with open(cls._config_filename, "w") as outfile:
+            outfile.write(config_str)
+
+    def _read_params(self):
+        return config.read_config_file(filename=self._config_filename)
+
+    def test_shared_setup(self):
+        """Test simulators attached to a shared setup match a directly setup simulator."""
+
+        params = self._read_params()
+        sim = simulator.Simulator(params)
+        sim.setup(silent=True)
+        shared_setup = SharedSetup(sim)
+
+        try:
+            attached_sim = shared_setup.attach()
+            self.assertTrue(np.array_equal(attached_sim.params['kernel_vals'],
+                                           sim.params['kernel_vals']))
+
+            all_events = []
+            for run_sim in [sim, attached_sim]:
+                run_sim.seed_iteration(2)
+                run_sim.initialise(silent=True)
+                all_events.append(list(run_sim.run_epidemic(silent=True)[2]['all_events']))
+        finally:
+            shared_setup.close()
+
+        self.assertEqual(all_events[0], all_events[1])
+
+    def test_parallel_runs(self):
+        """Test parallel ensemble gives same results as serial runs, in order."""
+
+        params = self._read_params()
+        serial_data = simulator.run_epidemics(params, silent=True)
+
+        params['NProcesses'] = 2
+        parallel_data = simulator.run_epidemics(params, silent=True)
+
+        self.assertEqual(len(serial_data), len(parallel_data))
+        for serial_run, parallel_run in zip(serial_data, parallel_data):
+            self.assertTrue(serial_run['event_data'].equals(parallel_run['event_data']))
+
+    def test_save_setup(self):
+        """Test re-using saved setup gives same results as re-running setup each iteration."""
+
+        params = self._read_params()
+        params['NIterations'] = 3
+        new_setup_data = simulator.run_epidemics(params, silent=True)
+
+        params['SaveSetup'] = True
+        saved_setup_data = simulator.run_epidemics(params, silent=True)
+
+        for new_run, saved_run in zip(new_setup_data, saved_setup_data):
+            self.assertTrue(new_run['event_data'].equals(saved_run['event_data']))
+            self.assertTrue(new_run['host_data'].equals(saved_run['host_data']))
+
+    def test_checkpoint(self):
+        """Test resuming from a mid-run checkpoint continues the same run."""
+
+        params = self._read_params()
+        params['CheckpointFileStub'] = os.path.join("testing", "ensemble_checkpoint")
+        checkpoint_file = simulator.checkpoint.checkpoint_filename(params, 1)
+
+        # Checkpoint every step, leaving the checkpoint from before the final event
+        params['CheckpointInterval'] = 1e-12
+        sim = simulator.Simulator(params)
+        sim.setup(silent=True)
+        sim.seed_iteration(1)
+        sim.initialise(silent=True)
+        full_events = list(sim.run_epidemic(iteration=1, silent=True)[2]['all_events'])
+
+        try:
+            params['CheckpointInterval'] = 0
+            new_sim = simulator.Simulator(params, seed=0)
+            new_sim.setup(silent=True)
+            new_sim.initialise(silent=True)
+            new_sim.restore(checkpoint_file)
+            self.assertGreater(new_sim.time, 0)
+            resumed_events = list(new_sim.run_epidemic(silent=True)[2]['all_events'])
+        finally:
+            os.remove(checkpoint_file)
+
+        self.assertEqual(full_events, resumed_events)
+
+    def test_branches(self):
+        """Test branches continue from the shared history with independent streams."""
+
+        params = self._read_params()
+        params['FinalTime'] = 2
+        sim = simulator.Simulator(params)
+        sim.setup(silent=True)
+        sim.seed_iteration(0)
+        sim.initialise(silent=True)
+        history = list(sim.run_epidemic(silent=True)[2]['all_events'])
+
+        all_data = simulator.run_branches(sim, 3, final_time=5, seed=4, silent=True,
+                                          nprocesses=2)
+        repeat_data = simulator.run_branches(sim, 3, final_time=5, seed=4, silent=True,
+                                             nprocesses=2)
+
+        # Parent simulator is unchanged by branching
+        self.assertEqual(sim.time, 2)
+        self.assertEqual(list(sim.run_params['all_events']), history)
+
+        self.assertEqual(len(all_data), 3)
+        for branch_data, repeat in zip(all_data, repeat_data):
+            events = branch_data['event_data']
+            self.assertTrue(events.equals(repeat['event_data']))
+            self.assertEqual(list(events['time'][:len(history)]),
+                             [event[0] for event in history])
+            self.assertTrue(np.all(events['time'][len(history):] > 2))
+
+        self.assertFalse(all_data[0]['event_data'].equals(all_data[1]['event_data']))
+
+    def test_batch(self):
+        """Test sharded batch runs complete each iteration once, and merge logs."""
+
+        params = self._read_params()
+        serial_data = simulator.run_epidemics(params, silent=True)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            batch_dir = os.path.join(temp_dir, "batch")
+            params['OutputFiles'] = True
+            params['OutputFileStub'] = os.path.join(temp_dir, "output", "batch")
+
+            self.assertEqual(simulator.run_batch(params, batch_dir, shard_size=3, silent=True),
+                             [0, 1, 2, 3])
+            self.assertTrue(os.path.exists(params['OutputFileStub'] + ".log"))
+            self.assertEqual(simulator.run_batch(params, batch_dir, shard_size=3, silent=True), [])
+
+            with self.assertRaises(ValueError):
+                simulator.run_batch(params, batch_dir, shard_size=2, silent=True)
+
+            # Rerun failed shard, keeping existing outputs
+            os.remove(params['OutputFileStub'] + "_events_1.csv")
+            os.remove(os.path.join(batch_dir, "shard_0.lock"))
+            os.remove(os.path.join(batch_dir, "shard_0.log"))
+            self.assertEqual(simulator.run_batch(params, batch_dir, shard_size=3, silent=True), [1])
+
+            with open(params['OutputFileStub'] + ".log", "r") as infile:
+                log_text = infile.read()
+            self.assertIn("Iterations run: [1]", log_text)
+            self.assertIn("Iterations run: [3]", log_text)
+
+            for iteration, serial_run in enumerate(serial_data):
+                event_data = pd.read_csv(
+                    params['OutputFileStub'] + "_events_" + str(iteration) + ".csv")
+                self.assertTrue(np.allclose(event_data['time'], serial_run['event_data']['time']))
+
+    def test_stream_events(self):
+        """Test streaming events to disk gives the same event output."""
+
+        params = self._read_params()
+        params['NIterations'] = 1
+        params['EventChunkSize'] = 5
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            params['OutputFiles'] = True
+            params['OutputFileStub'] = os.path.join(temp_dir, "memory")
+            memory_data = simulator.run_epidemics(params, silent=True)
+
+            params['OutputFileStub'] = os.path.join(temp_dir, "stream")
+            params['StreamEvents'] = True
+            stream_data = simulator.run_epidemics(params, silent=True)
+
+            self.assertNotIn('event_data', stream_data[0])
+            for stub in ["memory", "stream"]:
+                with open(os.path.join(temp_dir, stub + "_events_0.csv"), "r") as infile:
+                    self.assertGreater(len(infile.readlines()), 10)
+            with open(os.path.join(temp_dir, "memory_events_0.csv"), "r") as infile1:
+                with open(os.path.join(temp_dir, "stream_events_0.csv"), "r") as infile2:
+                    self.assertEqual(infile1.read(), infile2.read())
+
+            self.assertFalse(glob.glob(os.path.join(temp_dir, "*.spool")))
+
+    def test_host_data(self):
+        """Test host output matches transition history of each host."""
+
+        params = self._read_params()
+        sim = simulator.Simulator(params)
+        sim.setup(silent=True)
+        sim.initialise(silent=True)
+        all_hosts, all_cells, run_params = sim.run_epidemic(silent=True)
+        host_data = sim.output_run_data(all_hosts, all_cells, run_params)['host_data']
+
+        for host, (_, row) in zip(all_hosts, host_data.iterrows()):
+            self.assertEqual(row['initial_state'], host.init_state)
+            for state in "SIR":
+                self.assertEqual(row['timeEnter' + state],
+                                 [time for time, _, new in host.trans_times if new == state])
+
+    def test_summary_data(self):
+        """Test region DPCs recorded during the run match host transition histories."""
+
+        params = self._read_params()
+        params['OutputEventData'] = False
+        params['SummaryOutputFreq'] = 0.5
+        params['NRegions'] = 2
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            params['RegionFile'] = os.path.join(temp_dir, "regions.txt")
+            with open(params['RegionFile'], "w") as outfile:
+                outfile.write("100\n" + "".join(str(i % 2) + "\n" for i in range(100)))
+
+            sim = simulator.Simulator(params)
+            sim.setup(silent=True)
+            sim.initialise(silent=True)
+            all_hosts, all_cells, run_params = sim.run_epidemic(silent=True)
+            summary_data = sim.output_run_data(all_hosts, all_cells, run_params)['summary_data']
+
+        self.assertEqual(len(run_params['all_events']), 0)
+
+        for region in range(2):
+            region_data = summary_data['Region' + str(region)]
+            self.assertTrue(np.allclose(region_data['time'], np.arange(11) * 0.5))
+            for time, row in zip(region_data['time'], region_data.to_dict('records')):
+                for state in "SIR":
+                    expected = sum(
+                        1 for host in all_hosts[region::2]
+                        if [new for t, _, new in host.trans_times if t <= time][-1] == state)
+                    self.assertEqual(row[state], expected)
+
+    def test_aggregate_runs(self):
+        """Test ensemble statistics match statistics of the full run data."""
+
+        params = self._read_params()
+        params['SummaryOutputFreq'] = 1.0
+        all_data = simulator.run_epidemics(params, silent=True)
+        final_counts = np.array([[run['summary_data']['Region0'][state].iloc[-1] for state in "SIR"]
+                                 for run in all_data])
+
+        params['AggregateRuns'] = True
+        params['AggregateBins'] = 101
+        aggregate_data = simulator.run_epidemics(params, silent=True)
+
+        params['NProcesses'] = 2
+        parallel_data = simulator.run_epidemics(params, silent=True)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            params['OutputFiles'] = True
+            params['OutputFileStub'] = os.path.join(temp_dir, "output", "batch")
+            simulator.run_batch(params, os.path.join(temp_dir, "batch"), shard_size=3, silent=True)
+            batch_data = pd.read_csv(params['OutputFileStub'] + "_final_aggregate.csv")
+
+        self.assertEqual(aggregate_data['niterations'], 4)
+        self.assertNotIn('event_data', aggregate_data)
+        for data in [aggregate_data['final_data'], parallel_data['final_data'], batch_data]:
+            for i, state in enumerate("SIR"):
+                self.assertAlmostEqual(data[state + "_mean"][0], np.mean(final_counts[:, i]))
+                self.assertAlmostEqual(data[state + "_var"][0], np.var(final_counts[:, i], ddof=1))
+                self.assertEqual(data[state + "_q0.5"][0],
+                                 np.quantile(final_counts[:, i], 0.5, method="inverted_cdf"))
+
+        dpc_data = aggregate_data['summary_data']['Region0']
+        self.assertEqual(len(dpc_data), 6)
+        self.assertTrue(np.allclose(dpc_data['I_mean'], np.mean(
+            [run['summary_data']['Region0']['I'] for run in all_data], axis=0)))
+
+    def test_aggregate_final_only(self):
+        """Test final ensemble statistics without summary output match final host states."""
+
+        params = self._read_params()
+        all_data = simulator.run_epidemics(params, silent=True)
+        final_counts = []
+        for run in all_data:
+            final_states = [
+                max((times[-1], state) for state in "SIR"
+                    for times in [host['timeEnter' + state]] if times)[1]
+                for host in run['host_data'].to_dict('records')]
+            final_counts.append([final_states.count(state) for state in "SIR"])
+        final_counts = np.array(final_counts)
+        self.assertTrue(np.all(final_counts[:, 2] > 0))
+
+        params['AggregateRuns'] = True
+        aggregate_data = simulator.run_epidemics(params, silent=True)
+
+        self.assertNotIn('summary_data', aggregate_data)
+        for i, state in enumerate("SIR"):
+            self.assertAlmostEqual(aggregate_data['final_data'][state + "_mean"][0],
+                                   np.mean(final_counts[:, i]))
+
+    def test_binary_output(self):
+        """Test binary column output matches returned run data, including streamed events."""
+
+        params = self._read_params()
+        params['NIterations'] = 1
+
+        for stream_events in [False, True]:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                params['OutputFiles'] = True
+                params['OutputFileStub'] = os.path.join(temp_dir, "output")
+                params['OutputFormat'] = "npy"
+                params['StreamEvents'] = stream_events
+                params['EventChunkSize'] = 5
+                run_data = simulator.run_epidemics(params, silent=True)[0]
+
+                event_columns = columnar.read_columns(
+                    os.path.join(temp_dir, "output_events_0"), "npy")
+                host_columns = columnar.read_columns(
+                    os.path.join(temp_dir, "output_hosts_0"), "npy")
+                transitions = columnar.read_columns(
+                    os.path.join(temp_dir, "output_transitions_0"), "npy")
+
+            self.assertIsInstance(event_columns['time'], np.memmap)
+            self.assertEqual(event_columns['hostID'].dtype, np.int64)
+
+            host_data = run_data['host_data']
+            self.assertTrue(np.array_equal(host_columns['posX'], host_data['posX']))
+            self.assertEqual(
+                list(STATE_NAMES[host_columns['initial_state']]), list(host_data['initial_state']))
+
+            # One transition into each state entered by each host
+            for host_id, time, new_state in zip(transitions['hostID'], transitions['time'],
+                                                STATE_NAMES[transitions['newState']]):
+                self.assertIn(time, host_data['timeEnter' + new_state][host_id])
+
+            if not stream_events:
+                event_data = run_data['event_data']
+                self.assertTrue(np.array_equal(event_columns['time'], event_data['time']))
+                self.assertEqual(list(STATE_NAMES[event_columns['newState']]),
+                                 list(event_data['newState']))
+            self.assertEqual(len(event_columns['time']), np.sum(transitions['time'] > 0))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls._config_filename)
+        for file in glob.glob(os.path.join("testing", "ensemble_*_test_case.txt")):
+            os.remove(file)
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from IndividualSimulator.code.eventlog import EventLog
+
+
+class EventLogTests(unittest.TestCase):
+    """Test columnar event storage, in memory and spooled to disk."""
+
+    def setUp(self):
+        self.chunk_size = 10
+        states = ["S", "E", "I", "R", "Culled"]
+        self.events = [(0.1*i, i % 7, states[i % 5], states[(i+1) % 5]) for i in range(35)]
+
+    def test_in_memory(self):
+        """Test events are stored and returned in order, across chunks."""
+
+        events = EventLog(self.chunk_size)
+        for event in self.events:
+            events.append(*event)
+
+        self.assertEqual(len(events), len(self.events))
+        self.assertEqual(list(events), self.events)
+
+        columns = events.columns()
+        self.assertEqual(columns["hostID"].dtype, np.int64)
+        self.assertTrue(np.array_equal(columns["time"], [event[0] for event in self.events]))
+
+    def test_spooled(self):
+        """Test spooled events keep at most one chunk in memory, and restore from saved state."""
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            events = EventLog(self.chunk_size, os.path.join(temp_dir, "events"))
+            for event in self.events[:22]:
+                events.append(*event)
+                self.assertLess(len(events._times), self.chunk_size)
+            self.assertEqual(events.nflushed, 20)
+
+            state = events.get_state()
+            for event in self.events[22:]:
+                events.append(*event)
+            self.assertEqual(list(events), self.events)
+
+            # Restoring discards events spooled after state was saved
+            restored = EventLog()
+            restored.set_state(state)
+            self.assertEqual(list(restored), self.events[:22])
+            for event in self.events[22:]:
+                restored.append(*event)
+            self.assertEqual(list(restored), self.events)
+
+            restored.remove_spool()
+            self.assertEqual(os.listdir(temp_dir), [])
@@ -2,6 +2,9 @@ import unittest
 import os
 import pdb
 import glob
+import copy
+import importlib
+import tempfile
 from scipy.stats import expon, kstest
 import numpy as np
 import matplotlib.pyplot as plt
@@ -10,6 +13,64 @@ import IndividualSimulator
 
 full_lambda = 0.2
 
+def _make_simulator(nhosts, init_fn, extra_config=None, scripts=None, region_fn=None):
+    """Set up and initialise an SIR simulator, with hosts placed at random on a 3x3 square.
+
+    Arguments:
+        nhosts:         Number of hosts.
+        init_fn:        Function giving the initial state of each host index.
+        extra_config:   Dictionary of config options, as strings, replacing the defaults here.
+        scripts:        List of intervention classes to use.
+        region_fn:      Function giving the region of each host index.  All hosts are in region 0
+                        if not specified.
+    """
+
+    config_options = {
+        'Model': "SIR", 'InfRate': "0.5", 'IAdvRate': "0.5", 'KernelType': "EXPONENTIAL",
+        'SimulationType': "INDIVIDUAL", 'FinalTime': "5", 'RasterOutputFreq': "0",
+        'OutputFiles': "False", 'CacheKernel': "True"}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        files = {name: os.path.join(temp_dir, name + ".txt")
+                 for name in ["hosts", "init", "regions"]}
+        with open(files["hosts"], "w") as outfile:
+            outfile.write(str(nhosts) + "\n" + "".join(
+                "{0} {1}\n".format(*pos) for pos in np.random.rand(nhosts, 2) * 3))
+        with open(files["init"], "w") as outfile:
+            outfile.write(str(nhosts) + "\n" + "".join(
+                init_fn(i) + "\n" for i in range(nhosts)))
+        config_options['HostPosFile'] = files["hosts"]
+        config_options['InitCondFile'] = files["init"]
+
+        if region_fn is not None:
+            regions = [region_fn(i) for i in range(nhosts)]
+            with open(files["regions"], "w") as outfile:
+                outfile.write(str(nhosts) + "\n" + "".join(
+                    str(region) + "\n" for region in regions))
+            config_options['RegionFile'] = files["regions"]
+            config_options['NRegions'] = str(max(regions) + 1)
+
+        if extra_config is not None:
+            config_options.update(extra_config)
+
+        config_str = ""
+        for section, options in IndividualSimulator.code.config.default_config.items():
+            config_str += "[" + section + "]\n" + "".join(
+                key + " = " + config_options[key] + "\n" for key in options
+                if key in config_options)
+
+        params = IndividualSimulator.code.config.read_config_string(config_str)
+        if scripts is not None:
+            params['InterventionScripts'] = scripts
+            params['InterventionOptions'] = [None]*len(scripts)
+
+        simulator = IndividualSimulator.Simulator(params=params)
+        simulator.setup(silent=True)
+        simulator.initialise(silent=True)
+
+    return simulator
+
+
 class ContinuousIntervention():
     """Test intervention implementing continuous removal of infected hosts."""
 
@@ -145,3 +206,308 @@ class TestContinuousInterventions(unittest.TestCase):
         os.remove(os.path.join("testing", "cont_intervention_host_test_case.txt"))
         for file in glob.glob(os.path.join("testing", "cont_intervention_init_test_case_*")):
             os.remove(file)
+
+
+class RecordingIntervention():
+    """Test intervention recording the events it is updated after."""
+
+    subscriptions = {'transitions': [("S", None)], 'regions': [1]}
+
+    def __init__(self, update_freq, all_hosts, all_cells=None, options=None):
+        self.update_freq = update_freq
+        self.type = "RECORD"
+        self.events = []
+
+    def update(self, all_hosts, time, all_cells=None, after_event=None, get_rate_fn=None,
+               initial=False):
+        if after_event is not None:
+            self.events.append((time,) + after_event)
+        return []
+
+
+class TestInterventionSubscriptions(unittest.TestCase):
+    """Test interventions are only updated after events they subscribe to."""
+
+    def test_subscriptions(self):
+        simulator = _make_simulator(
+            50, lambda i: "I" if i < 3 else "S", {'UpdateOnAllEvents': "True"},
+            [RecordingIntervention], region_fn=lambda i: i % 2)
+        all_hosts, all_cells, run_params = simulator.run_epidemic(silent=True)
+
+        expected = [(time, host_id, None, old, new)
+                    for time, host_id, old, new in run_params['all_events']
+                    if old == "S" and host_id % 2 == 1]
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(simulator.intervention_handler.interventions[0].events, expected)
+
+
+class TestHostStateSets(unittest.TestCase):
+    """Test sets of hosts in each state in each region."""
+
+    def test_move_and_select(self):
+        host_regions = np.array([0, 1, 0, 1, 0, 0])
+        host_states = np.array([0, 0, 4, 0, 0, 4])
+        host_sets = IndividualSimulator.code.hosts.HostStateSets(host_regions, 2, host_states)
+
+        self.assertEqual(sorted(host_sets.hosts(0, "S")), [0, 4])
+        self.assertEqual(sorted(host_sets.hosts(0, "I")), [2, 5])
+        self.assertEqual(host_sets.count(1, "S"), 2)
+
+        host_sets.move(0, "S", "I")
+        host_sets.move(2, "I", "Culled")
+        host_sets.move(3, "S", "I")
+        self.assertEqual(sorted(host_sets.hosts(0, "S")), [4])
+        self.assertEqual(sorted(host_sets.hosts(0, "I")), [0, 5])
+        self.assertEqual(host_sets.hosts(0, "Culled"), [2])
+        self.assertEqual(host_sets.hosts(1, "I"), [3])
+        for members in host_sets.members:
+            for state_members in members:
+                for position, host_id in enumerate(state_members):
+                    self.assertEqual(host_sets.positions[host_id], position)
+
+        restored = IndividualSimulator.code.hosts.HostStateSets(host_regions, 2)
+        restored.reset(np.array([4, 0, 6, 4, 0, 4]), order=host_sets.flat_members())
+        self.assertEqual(restored.members, host_sets.members)
+        self.assertEqual(restored.positions, host_sets.positions)
+
+        selected = {host_sets.select(0, "I", u) for u in np.linspace(0, 1, 10, endpoint=False)}
+        self.assertEqual(selected, {0, 5})
+        self.assertRaises(ValueError, host_sets.select, 1, "R", 0.5)
+
+
+class TestContRegionRemoval(unittest.TestCase):
+    """Test continuous removal of infected hosts from regions."""
+
+    def test_region_removal(self):
+        removal = importlib.import_module(
+            "IndividualSimulator.code.interventions.ContRegionRemoval")
+
+        old_config = dict(removal.config_params)
+        removal.config_params['budget'] = 4
+        try:
+            simulator = _make_simulator(
+                60, lambda i: "I" if i < 6 else "S",
+                {'Model': "SI", 'IAdvRate': "0", 'UpdateOnAllEvents': "True"},
+                [removal.Intervention], region_fn=lambda i: i % 3)
+            all_hosts, all_cells, run_params = simulator.run_epidemic(silent=True)
+        finally:
+            removal.config_params.update(old_config)
+
+        culls = [old for host in all_hosts for _, old, new in host.trans_times if new == "Culled"]
+        self.assertGreater(len(culls), 0)
+        self.assertTrue(all(old == "I" for old in culls))
+
+        host_sets = run_params['host_sets']
+        for region in range(3):
+            for state in ["S", "I", "Culled"]:
+                self.assertEqual(
+                    sorted(host_sets.hosts(region, state)),
+                    [host.host_id for host in all_hosts
+                     if host.state == state and host.reg == region])
+
+
+class BulkRateIntervention():
+    """Test continuous intervention returning rate changes as arrays."""
+
+    def __init__(self, update_freq, all_hosts, all_cells=None, options=None):
+        self.update_freq = update_freq
+        self.type = "CONTINUOUS"
+        self.rate_size = len(all_hosts)
+
+    def action(self, all_hosts, time, event_id, all_cells=None):
+        return []
+
+    def update(self, all_hosts, time, all_cells=None, after_event=None, get_rate_fn=None,
+               initial=False):
+        return np.zeros(self.rate_size)
+
+
+class TestBulkRateUpdates(unittest.TestCase):
+    """Test all forms of continuous intervention rate updates are inserted correctly."""
+
+    def test_rate_update_forms(self):
+        nhosts = 20
+        simulator = _make_simulator(nhosts, lambda i: "I" if i < 3 else "S",
+                                    scripts=[BulkRateIntervention])
+
+        handler = simulator.intervention_handler
+        rate_struct = simulator.rate_handler.all_rates["Intervention_0"]
+        expected = np.random.rand(nhosts)
+
+        handler.apply_rate_updates(0, expected)
+        np.testing.assert_array_equal(rate_struct.rates, expected)
+
+        rate_ids = np.array([1, 5, 7])
+        expected[rate_ids] = [2.0, 0.0, 3.0]
+        handler.apply_rate_updates(0, (rate_ids, expected[rate_ids]))
+        np.testing.assert_array_equal(rate_struct.rates, expected)
+
+        expected[4] = 1.5
+        handler.apply_rate_updates(0, [(4, 1.5)])
+        np.testing.assert_array_equal(rate_struct.rates, expected)
+        self.assertAlmostEqual(rate_struct.get_total_rate(), np.sum(expected))
+
+        self.assertRaises(ValueError, handler.apply_rate_updates, 0,
+                          (rate_ids, np.ones(2)))
+
+
+class TimedIntervention():
+    """Test intervention recording the times it is updated at."""
+
+    def __init__(self, update_freq, all_hosts, all_cells=None, options=None):
+        self.update_freq = update_freq
+        self.type = "TIMED"
+        self.times = []
+
+    def update(self, all_hosts, time, all_cells=None, after_event=None, get_rate_fn=None,
+               initial=False):
+        self.times.append(time)
+        return []
+
+
+class TestInterventionTimes(unittest.TestCase):
+    """Test interventions are updated at every multiple of their update frequency."""
+
+    def test_update_times(self):
+        simulator = _make_simulator(
+            20, lambda i: "I" if i < 3 else "S",
+            {'FinalTime': "2", 'InterventionUpdateFrequencies': "0.1,0.25"},
+            [TimedIntervention, TimedIntervention])
+        simulator.run_epidemic(silent=True)
+
+        interventions = simulator.intervention_handler.interventions
+        np.testing.assert_allclose(interventions[0].times, np.arange(1, 21) * 0.1)
+        np.testing.assert_allclose(interventions[1].times, np.arange(1, 9) * 0.25)
+
+
+class CullIntervention():
+    """Test intervention culling all infected hosts and some susceptibles at each update."""
+
+    def __init__(self, update_freq, all_hosts, all_cells=None, options=None):
+        self.update_freq = update_freq
+        self.type = "CULL"
+
+    def update(self, all_hosts, time, all_cells=None, after_event=None, get_rate_fn=None,
+               initial=False):
+        return [(host.host_id, "CULL") for host in all_hosts
+                if host.state == "I" or (host.state == "S" and host.host_id % 5 == 0)]
+
+
+class TestBatchCull(unittest.TestCase):
+    """Test culls from intervention updates are carried out together."""
+
+    def test_batch_cull(self):
+        simulator = _make_simulator(
+            40, lambda i: "I" if i % 4 == 1 else "S",
+            {'FinalTime': "1", 'InterventionUpdateFrequencies': "0.5"}, [CullIntervention])
+
+        # Cull the same hosts one at a time on a copy
+        sequential = copy.deepcopy(simulator)
+        events = CullIntervention(None, sequential.all_hosts).update(sequential.all_hosts, 0)
+        for host_id, event_type in events:
+            sequential.event_handler.do_event(event_type, host_id, sequential.all_hosts,
+                                              sequential.all_cells)
+
+        simulator.time = 0.5
+        simulator.intervention_handler.update(simulator.all_hosts, 0.5, simulator.all_cells)
+
+        self.assertEqual(simulator.intervention_handler.next_interventions, [1.0])
+        self.assertEqual([host.state for host in simulator.all_hosts],
+                         [host.state for host in sequential.all_hosts])
+        self.assertEqual(sum(host.state == "I" for host in simulator.all_hosts), 0)
+        for rate_type in ["Infection", "Advance"]:
+            self.assertTrue(np.allclose(
+                simulator.rate_handler.all_rates[rate_type].rates,
+                sequential.rate_handler.all_rates[rate_type].rates))
+        self.assertTrue(np.allclose(simulator.rate_handler.all_rates["Infection"].rates, 0))
+
+
+class ActionCullIntervention():
+    """Test continuous intervention culling infected hosts in its action."""
+
+    subscriptions = {'transitions': [(None, "I"), ("I", None)]}
+
+    def __init__(self, update_freq, all_hosts, all_cells=None, options=None):
+        self.update_freq = update_freq
+        self.type = "CONTINUOUS"
+        self.rate_size = 1
+
+    def action(self, all_hosts, time, event_id, all_cells=None):
+        for host in all_hosts:
+            if host.state == "I":
+                return [(host.host_id, "CULL")]
+
+    def update(self, all_hosts, time, all_cells=None, after_event=None, get_rate_fn=None,
+               initial=False):
+        return [(0, sum(host.state == "I" for host in all_hosts))]
+
+
+class InfectionRecordingIntervention(RecordingIntervention):
+    """Test intervention recording the infection events it is updated after."""
+
+    subscriptions = {'event_types': ["Infection"]}
+
+
+class CullRecordingIntervention(RecordingIntervention):
+    """Test intervention recording the cull events it is updated after."""
+
+    subscriptions = {'event_types': ["CULL"]}
+
+
+class TestActionEventTypes(unittest.TestCase):
+    """Test events from continuous intervention actions are dispatched on their own type."""
+
+    def test_action_subscriptions(self):
+        simulator = _make_simulator(
+            50, lambda i: "I" if i < 5 else "S", {'UpdateOnAllEvents': "True"},
+            [ActionCullIntervention, InfectionRecordingIntervention, CullRecordingIntervention])
+        all_hosts, all_cells, run_params = simulator.run_epidemic(silent=True)
+
+        interventions = simulator.intervention_handler.interventions
+        expected_culls = sorted((time, host.host_id, None, old, new) for host in all_hosts
+                                for time, old, new in host.trans_times if new == "Culled")
+        self.assertGreater(len(expected_culls), 0)
+        self.assertEqual(interventions[2].events, expected_culls)
+
+        expected_infections = [(time, host_id, None, old, new)
+                               for time, host_id, old, new in run_params['all_events']
+                               if old == "S"]
+        self.assertGreater(len(expected_infections), 0)
+        self.assertEqual(interventions[1].events, expected_infections)
+
+
+class TestInterventionCheckpoint(unittest.TestCase):
+    """Test runs with interventions continue the same run when restored from a checkpoint."""
+
+    def test_checkpoint(self):
+        removal = importlib.import_module(
+            "IndividualSimulator.code.interventions.ContRegionRemoval")
+
+        old_config = dict(removal.config_params)
+        removal.config_params['budget'] = 4
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                # Checkpoint every step, leaving the checkpoint from before the final event
+                checkpoint_stub = os.path.join(temp_dir, "checkpoint")
+                simulator = _make_simulator(
+                    60, lambda i: "I" if i < 6 else "S",
+                    {'UpdateOnAllEvents': "True", 'CheckpointInterval': "1e-12",
+                     'CheckpointFileStub': checkpoint_stub},
+                    [removal.Intervention], region_fn=lambda i: i % 3)
+                all_hosts, all_cells, run_params = simulator.run_epidemic(silent=True)
+                full_events = list(run_params['all_events'])
+                full_states = [host.state for host in all_hosts]
+                full_log = simulator.intervention_handler.interventions[0].output()
+
+                simulator.params['CheckpointInterval'] = 0
+                simulator.initialise(silent=True)
+                simulator.restore(checkpoint_stub + "_0.chk")
+                self.assertGreater(simulator.time, 0)
+                all_hosts, all_cells, run_params = simulator.run_epidemic(silent=True)
+        finally:
+            removal.config_params.update(old_config)
+
+        self.assertGreater(sum(state == "Culled" for state in full_states), 0)
+        self.assertEqual(list(run_params['all_events']), full_events)
+        self.assertEqual([host.state for host in all_hosts], full_states)
+        self.assertTrue(simulator.intervention_handler.interventions[0].output().equals(full_log))
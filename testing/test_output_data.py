@@ -0,0 +1,320 @@
+import os
+import tempfile
+import unittest
+import unittest.mock
+import numpy as np
+import pandas as pd
+import raster_tools
+from IndividualSimulator.utilities import output_data
+
+# 3x4 raster with 2x2 cells, covering 10 <= x <= 18 and 20 <= y <= 26
+HEADER = {'nrows': 3, 'ncols': 4, 'xllcorner': 10.0, 'yllcorner': 20.0, 'cellsize': 2.0,
+          'NODATA_value': -9999}
+
+# Hosts inside the raster, including on edges between cells
+INSIDE_HOSTS = [(0, 11.0, 25.0, "S"), (1, 11.5, 24.5, "I"), (2, 12.0, 23.0, "S"),
+                (3, 15.0, 22.0, "S"), (4, 14.0, 24.0, "S"), (5, 17.0, 21.0, "I"),
+                (6, 13.0, 21.0, "S"), (7, 13.5, 21.5, "S")]
+# Hosts on the boundary of the raster
+BOUNDARY_HOSTS = [(8, 10.0, 23.0, "S"), (9, 16.0, 20.0, "S"), (10, 18.0, 23.0, "S"),
+                  (11, 13.0, 26.0, "S")]
+# Hosts outside the raster
+OUTSIDE_HOSTS = [(12, 5.0, 23.0, "S"), (13, 9.5, 23.0, "S"), (14, 13.0, 30.0, "I")]
+
+# Events at time zero, on and between multiples of the timestep, and several in the same cell at
+# the same time
+EVENTS = [(0.0, 0, "S", "I"), (0.0, 12, "S", "I"), (0.25, 2, "S", "I"), (0.3, 3, "S", "I"),
+          (0.3, 9, "S", "I"), (0.7, 6, "S", "I"), (0.7, 7, "S", "I"), (0.7, 13, "S", "I"),
+          (1.2, 1, "I", "R"), (1.2, 5, "I", "R"), (1.5, 4, "S", "I"), (1.75, 10, "S", "I"),
+          (1.75, 11, "S", "I"), (1.75, 14, "I", "R"), (2.0, 8, "S", "I"), (2.0, 6, "I", "R")]
+
+TIMESTEP = 0.1
+
+
+def _write_output_set(output_stub, host_rows, niterations=1):
+    """Write log, host and event files for SIR runs, with events for the given hosts.
+
+    Iteration i has the events up to time 2 - 0.25*i.
+    """
+
+    config_str = (
+        "[Epidemiology]\nModel = SIR\nInfRate = 0.5\nIAdvRate = 0.5\nKernelType = EXPONENTIAL\n"
+        "[Simulation]\nSimulationType = INDIVIDUAL\nFinalTime = 2\nHostPosFile = hosts.txt\n"
+        "InitCondFile = hosts_init.txt\nNIterations = {0}\n[Output]\nRasterOutputFreq = 0\n"
+        "OutputFiles = True\n".format(niterations))
+    with open(output_stub + ".log", "w") as outfile:
+        outfile.write("Configuration File Used\n" + "#"*35 + "\n\n" + config_str)
+
+    host_ids = [host[0] for host in host_rows]
+    for iteration in range(niterations):
+        pd.DataFrame(host_rows, columns=["hostID", "posX", "posY", "initial_state"]).to_csv(
+            output_stub + "_hosts_" + str(iteration) + ".csv", index=False)
+        pd.DataFrame([event for event in EVENTS
+                      if event[1] in host_ids and event[0] <= 2 - 0.25*iteration],
+                     columns=["time", "hostID", "oldState", "newState"]).to_csv(
+                         output_stub + "_events_" + str(iteration) + ".csv", index=False)
+
+
+def _loop_cell_data(run, header, states, ignore_outside_raster):
+    """Cell data for one run, built host by host and event by event."""
+
+    host_map = {}
+    state_map = {state: i for i, state in enumerate(states)}
+    cell_data = {
+        i: np.array([[0.0] + [0]*len(states)]) for i in range(header['nrows']*header['ncols'])
+    }
+
+    values = zip(run['host_data']['hostID'].values, run['host_data']['posX'].values,
+                 run['host_data']['posY'].values, run['host_data']['initial_state'].values)
+    for hostID, posX, posY, initState in values:
+        cell = raster_tools.find_position_in_raster((posX, posY), raster_header=header,
+                                                    index=True)
+        if cell == -1:
+            if ignore_outside_raster:
+                continue
+            else:
+                raise ValueError("Host not in raster!")
+        host_map[hostID] = cell
+        cell_data[cell][0, state_map[initState]+1] += 1
+
+    values = zip(run['event_data']['time'].values, run['event_data']['hostID'].values,
+                 run['event_data']['oldState'].values, run['event_data']['newState'].values)
+    for time, hostID, old, new in values:
+        if hostID in host_map:
+            cell = host_map[hostID]
+            new_row = np.copy(cell_data[cell][-1])
+            new_row[0] = time
+            new_row[state_map[old]+1] -= 1
+            new_row[state_map[new]+1] += 1
+            cell_data[cell] = np.vstack([cell_data[cell], new_row])
+
+    return cell_data
+
+
+class CellDataTests(unittest.TestCase):
+    """Test cell time series match those built host by host and event by event."""
+
+    def _check_cell_data(self, host_rows, ignore_outside_raster):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_stub = os.path.join(temp_dir, "output")
+            _write_output_set(output_stub, host_rows)
+            run = output_data.extract_output_data(output_stub)[0]
+
+            expected = _loop_cell_data(run, HEADER, ["S", "I", "R", "Culled"],
+                                       ignore_outside_raster)
+            cell_data = output_data.create_cell_data(
+                output_stub, target_header=HEADER, ignore_outside_raster=ignore_outside_raster)
+
+        self.assertEqual(len(cell_data), 1)
+        self.assertEqual(sorted(cell_data[0]), sorted(expected))
+        for cell, data in expected.items():
+            self.assertTrue(np.array_equal(cell_data[0][cell], data))
+
+        return expected
+
+    def test_inside_hosts(self):
+        """Test hosts within the raster, including on cell edges."""
+
+        expected = self._check_cell_data(INSIDE_HOSTS, False)
+
+        # Two hosts infected at the same time in the same cell
+        self.assertTrue(np.array_equal(expected[9][1:3, :3], [[0.7, 1, 1], [0.7, 0, 2]]))
+
+    def test_outside_hosts(self):
+        """Test hosts outside the raster are ignored or raise an error."""
+
+        self._check_cell_data(INSIDE_HOSTS + BOUNDARY_HOSTS + OUTSIDE_HOSTS, True)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_stub = os.path.join(temp_dir, "output")
+            _write_output_set(output_stub, INSIDE_HOSTS + OUTSIDE_HOSTS)
+            with self.assertRaises(ValueError):
+                output_data.create_cell_data(output_stub, target_header=HEADER)
+
+    def test_host_cells(self):
+        """Test host cells match raster_tools for hosts on and near edges."""
+
+        host_rows = INSIDE_HOSTS + BOUNDARY_HOSTS + OUTSIDE_HOSTS
+        pos_x = np.array([host[1] for host in host_rows])
+        pos_y = np.array([host[2] for host in host_rows])
+
+        expected = [raster_tools.find_position_in_raster((x, y), raster_header=HEADER, index=True)
+                    for x, y in zip(pos_x, pos_y)]
+        cells = output_data._host_cells(pos_x, pos_y, HEADER, ignore_outside_raster=True)
+
+        self.assertEqual(cells.tolist(), expected)
+        self.assertEqual(cells[[0, 1, 5, 6, 7]].tolist(), [0, 0, 11, 9, 9])
+        self.assertRaises(ValueError, output_data._host_cells, pos_x, pos_y, HEADER)
+
+
+def _loop_raster_frames(run, header, timestep, ignore_outside_raster):
+    """S and I data frames for one run, saving the state at each timestep between events."""
+
+    ncells = header['nrows']*header['ncols']
+    host_map = {}
+    state = np.zeros((ncells, 2))
+    s_dict = {"Cell"+str(i): [] for i in range(ncells)}
+    i_dict = {"Cell"+str(i): [] for i in range(ncells)}
+    times = []
+
+    def save_state(time):
+        times.append(time)
+        for i in range(ncells):
+            s_dict["Cell"+str(i)].append(state[i, 0])
+            i_dict["Cell"+str(i)].append(state[i, 1])
+
+    for index, host in run['host_data'].iterrows():
+        cell = raster_tools.find_position_in_raster((host['posX'], host['posY']),
+                                                    raster_header=header, index=True)
+        if cell == -1:
+            if ignore_outside_raster:
+                continue
+            else:
+                raise ValueError("Host not in raster!")
+        host_map[host['hostID']] = cell
+        state[cell, 0 if host['initial_state'] == "S" else 1] += 1
+
+    save_state(0.0)
+    next_time = timestep
+
+    for index, event in run['event_data'].iterrows():
+        while event['time'] > next_time:
+            save_state(next_time)
+            next_time += timestep
+        if event['hostID'] in host_map:
+            cell = host_map[event['hostID']]
+            state[cell, 0] -= 1
+            state[cell, 1] += 1
+
+    save_state(next_time)
+
+    s_dict['time'] = times
+    i_dict['time'] = times
+
+    return pd.DataFrame(s_dict), pd.DataFrame(i_dict)
+
+
+class RasterRunTests(unittest.TestCase):
+    """Test raster run frames match those built by stepping through events."""
+
+    def test_raster_frames(self):
+        """Test S and I frames, with events at zero, on timesteps and between timesteps."""
+
+        host_rows = [host for host in INSIDE_HOSTS + BOUNDARY_HOSTS + OUTSIDE_HOSTS
+                     if host[3] == "S"]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_stub = os.path.join(temp_dir, "output")
+            _write_output_set(output_stub, host_rows)
+            run = output_data.extract_output_data(output_stub)[0]
+
+        expected_s, expected_i = _loop_raster_frames(run, HEADER, TIMESTEP, True)
+        results_s, results_i, results_f = output_data._raster_frames(run, HEADER, TIMESTEP, True)
+
+        pd.testing.assert_frame_equal(results_s, expected_s, check_dtype=False)
+        pd.testing.assert_frame_equal(results_i, expected_i, check_dtype=False)
+        self.assertEqual(len(results_f), len(expected_s))
+
+        # Event at time zero is counted from the first timestep, not in the initial state
+        self.assertEqual(results_s["Cell0"].values[:2].tolist(), [1, 0])
+
+        self.assertRaises(ValueError, output_data._raster_frames, run, HEADER, TIMESTEP)
+
+
+class OutputDataSetTests(unittest.TestCase):
+    """Test lazily loaded output data sets."""
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.output_stub = os.path.join(self._temp_dir.name, "output")
+        self.niterations = 5
+        _write_output_set(self.output_stub, INSIDE_HOSTS, self.niterations)
+
+        # Count reads of each iteration
+        self.reads = unittest.mock.patch.object(output_data, "extract_run_data",
+                                                wraps=output_data.extract_run_data)
+        self.read_mock = self.reads.start()
+
+    def tearDown(self):
+        self.reads.stop()
+        self._temp_dir.cleanup()
+
+    def _read_counts(self):
+        counts = [0]*self.niterations
+        for call in self.read_mock.call_args_list:
+            counts[call[0][1]] += 1
+        return counts
+
+    def _assert_run_equal(self, run_data, expected):
+        self.assertEqual(sorted(run_data), sorted(expected))
+        for key, data in expected.items():
+            pd.testing.assert_frame_equal(run_data[key], data)
+
+    def test_lazy_read(self):
+        """Test iterations are only read when indexed."""
+
+        dataset = output_data.OutputDataSet(self.output_stub)
+        self.assertEqual(self._read_counts(), [0]*self.niterations)
+
+        dataset[3]
+        self.assertEqual(self._read_counts(), [0, 0, 0, 1, 0])
+
+        # Other iterations are not touched
+        os.remove(self.output_stub + "_events_1.csv")
+        dataset[-1]
+        dataset[3]
+        self.assertEqual(self._read_counts(), [0, 0, 0, 1, 1])
+        self.assertRaises(FileNotFoundError, dataset.__getitem__, 1)
+        self.assertRaises(IndexError, dataset.__getitem__, self.niterations)
+
+    def test_cache_eviction(self):
+        """Test least recently used iteration is evicted when cache is full."""
+
+        dataset = output_data.OutputDataSet(self.output_stub, cache_size=2)
+
+        dataset[0]
+        dataset[1]
+        dataset[0]
+        dataset[2]
+        self.assertEqual(list(dataset._cache), [0, 2])
+
+        dataset[0]
+        self.assertEqual(self._read_counts(), [1, 1, 1, 0, 0])
+
+        dataset[1]
+        self.assertEqual(list(dataset._cache), [0, 1])
+        self.assertEqual(self._read_counts(), [1, 2, 1, 0, 0])
+
+    def test_prefetch(self):
+        """Test prefetch fills the cache, reading each file once."""
+
+        with output_data.OutputDataSet(self.output_stub, cache_size=self.niterations,
+                                       nthreads=2) as dataset:
+            dataset[1]
+            dataset.prefetch(range(self.niterations))
+            dataset.prefetch([0, 2, 4])
+            dataset[2]
+        self.assertEqual(sorted(dataset._cache), list(range(self.niterations)))
+        self.assertEqual(self._read_counts(), [1]*self.niterations)
+
+        expected = output_data.extract_output_data(self.output_stub)
+        self.read_mock.reset_mock()
+        for iteration in range(self.niterations):
+            self._assert_run_equal(dataset[iteration], expected[iteration])
+        self.assertEqual(self._read_counts(), [0]*self.niterations)
+
+    def test_matches_extract(self):
+        """Test length, indexing and slicing match extract_output_data."""
+
+        expected = output_data.extract_output_data(self.output_stub)
+        dataset = output_data.OutputDataSet(self.output_stub, cache_size=2)
+
+        self.assertEqual(len(dataset), len(expected))
+        for iteration in range(self.niterations):
+            self._assert_run_equal(dataset[iteration], expected[iteration])
+
+        for data_slice in [slice(None), slice(1, 4), slice(None, None, -2), slice(-2, None)]:
+            runs = dataset[data_slice]
+            self.assertEqual(len(runs), len(expected[data_slice]))
+            for run_data, expected_data in zip(runs, expected[data_slice]):
+                self._assert_run_equal(run_data, expected_data)
@@ -0,0 +1,63 @@
+import pickle
+import threading
+import time
+import unittest
+from IndividualSimulator.code.outputwriter import BackgroundWriter
+
+
+class BackgroundWriterTests(unittest.TestCase):
+    """Test background output writing."""
+
+    def test_order(self):
+        """Test tasks are run in order, and all complete on flush."""
+
+        results = []
+        writer = BackgroundWriter(max_queue=2)
+        for i in range(20):
+            writer.submit(results.append, i)
+        writer.flush()
+
+        self.assertEqual(results, list(range(20)))
+        writer.close()
+
+    def test_backpressure(self):
+        """Test submit waits when the queue is full."""
+
+        release = threading.Event()
+        writer = BackgroundWriter(max_queue=1)
+        writer.submit(release.wait)
+        writer.submit(time.sleep, 0)
+
+        # Queue is full, so next submit blocks until the first task is released
+        submitted = threading.Event()
+        thread = threading.Thread(target=lambda: (writer.submit(time.sleep, 0), submitted.set()))
+        thread.start()
+        self.assertFalse(submitted.wait(0.2))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+        writer.close()
+
+    def test_errors(self):
+        """Test task errors are raised on flush, and later tasks are skipped."""
+
+        results = []
+        writer = BackgroundWriter()
+        writer.submit(results.append, 1)
+        writer.submit(int, "not a number")
+        writer.submit(results.append, 2)
+
+        with self.assertRaises(ValueError):
+            writer.flush()
+        self.assertEqual(results, [1])
+
+        # Writer can be used again once error is reported
+        writer.submit(results.append, 3)
+        writer.flush()
+        self.assertEqual(results, [1, 3])
+
+        copied = pickle.loads(pickle.dumps(writer))
+        copied.submit(results.append, 4)
+        copied.close()
+        self.assertEqual(results, [1, 3, 4])
+        writer.close()
@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+import scipy.stats
+from IndividualSimulator.code.randomnumbers import RandomNumbers, iteration_seed
+
+
+class RandomNumbersTests(unittest.TestCase):
+    """Test buffered random number generation."""
+
+    def setUp(self):
+        self.block_size = 100
+        self.niters = 1050
+
+    def test_reproducible(self):
+        """Test same seed gives same numbers, across block refills."""
+
+        rand1 = RandomNumbers(seed=10, block_size=self.block_size)
+        rand2 = RandomNumbers(seed=10, block_size=self.block_size)
+
+        vals1 = [(rand1.uniform(), rand1.exponential()) for _ in range(self.niters)]
+        vals2 = [(rand2.uniform(), rand2.exponential()) for _ in range(self.niters)]
+
+        self.assertEqual(vals1, vals2)
+
+        rand1.seed(11)
+        self.assertNotEqual(vals1[0][0], rand1.uniform())
+
+    def test_state(self):
+        """Test restoring saved state continues the same stream, part way through blocks."""
+
+        rand1 = RandomNumbers(seed=3, block_size=self.block_size)
+        for _ in range(150):
+            rand1.uniform()
+            rand1.exponential()
+        state = rand1.get_state()
+        vals1 = [(rand1.uniform(), rand1.exponential()) for _ in range(self.niters)]
+
+        rand2 = RandomNumbers(seed=4, block_size=self.block_size)
+        rand2.set_state(state)
+        vals2 = [(rand2.uniform(), rand2.exponential()) for _ in range(self.niters)]
+
+        self.assertEqual(vals1, vals2)
+
+    def test_distributions(self):
+        """Test uniform and exponential numbers have correct distributions."""
+
+        rand = RandomNumbers(seed=1, block_size=self.block_size)
+
+        uniforms = [rand.uniform() for _ in range(self.niters)]
+        exponentials = [rand.exponential() for _ in range(self.niters)]
+        integers = [rand.randint(5) for _ in range(self.niters)]
+
+        self.assertGreater(scipy.stats.kstest(uniforms, "uniform").pvalue, 0.001)
+        self.assertGreater(scipy.stats.kstest(exponentials, "expon").pvalue, 0.001)
+        self.assertEqual(set(integers), set(range(5)))
+
+    def test_iteration_seed(self):
+        """Test iteration streams are independent of which other iterations are run."""
+
+        children = np.random.SeedSequence(20).spawn(5)
+
+        for iteration in [0, 3]:
+            rand1 = RandomNumbers(seed=iteration_seed(20, iteration))
+            rand2 = RandomNumbers(seed=children[iteration])
+            self.assertEqual([rand1.uniform() for _ in range(10)],
+                             [rand2.uniform() for _ in range(10)])
+
+        self.assertIsNone(iteration_seed(None, 3))
@@ -8,6 +8,7 @@ from IndividualSimulator.code.ratestructures.ratesum import RateSum
 from IndividualSimulator.code.ratestructures.ratetree import RateTree
 from IndividualSimulator.code.ratestructures.rateinterval import RateInterval
 from IndividualSimulator.code.ratestructures.rateCR import RateCR
+from IndividualSimulator.code.ratestructures.rategroup import RateGroup
 
 def initialise_rates(rate_struct, size, rates=None):
     """Initialise rate structure rates, by default random numbers."""
@@ -35,6 +36,29 @@ def run_selections(rate_struct, size, niters):
 
     return all_n_selected
 
+def check_bulk_update(test_case, rate_struct, size, rates=None):
+    """Check bulk insertion and update of rates matches inserting rates individually."""
+
+    if rates is None:
+        rates = np.random.rand(size)
+    rate_struct.bulk_insert(rates)
+
+    positions = np.random.choice(size, int(size/3), replace=False)
+    new_rates = np.random.permutation(rates)[:len(positions)]
+    rate_struct.bulk_update(positions, new_rates)
+    rates = np.copy(rates)
+    rates[positions] = new_rates
+
+    for i, rate in enumerate(rates):
+        test_case.assertEqual(rate_struct.get_rate(i), rate)
+    test_case.assertAlmostEqual(rate_struct.get_total_rate(), np.sum(rates))
+
+    # Selection must be consistent with the updated rates
+    cumulative = np.cumsum(rates)
+    for select_rate in np.random.rand(100) * cumulative[-1]:
+        selected = rate_struct.select_event(select_rate)
+        test_case.assertGreater(rates[selected], 0)
+
 class RateSumTests(unittest.TestCase):
     """Test that rate sum structure performs correctly."""
 
@@ -57,6 +81,11 @@ class RateSumTests(unittest.TestCase):
 
         self.assertAlmostEqual(self.rate_struct.get_total_rate(), np.sum(new_rates))
 
+    def test_bulk_update(self):
+        "Test RateSum structure bulk insert/update functions."""
+
+        check_bulk_update(self, self.rate_struct, self.size)
+
     def test_zero_rates(self):
         "Test RateSum structure zero rates functions."""
 
@@ -135,6 +164,11 @@ class RateTreeTests(unittest.TestCase):
 
         self.assertAlmostEqual(self.rate_struct.get_total_rate(), np.sum(new_rates))
 
+    def test_bulk_update(self):
+        "Test RateTree structure bulk insert/update functions."""
+
+        check_bulk_update(self, self.rate_struct, self.size)
+
     def test_zero_rates(self):
         "Test RateTree structure zero rates functions."""
 
@@ -213,6 +247,11 @@ class RateIntervalTests(unittest.TestCase):
 
         self.assertAlmostEqual(self.rate_struct.get_total_rate(), np.sum(new_rates))
 
+    def test_bulk_update(self):
+        "Test RateInterval structure bulk insert/update functions."""
+
+        check_bulk_update(self, self.rate_struct, self.size)
+
     def test_zero_rates(self):
         "Test RateInterval structure zero rates functions."""
 
@@ -291,6 +330,11 @@ class RateCRTests(unittest.TestCase):
 
         self.assertAlmostEqual(self.rate_struct.get_total_rate(), np.sum(new_rates))
 
+    def test_bulk_update(self):
+        "Test RateCR structure bulk insert/update functions."""
+
+        check_bulk_update(self, self.rate_struct, self.size)
+
     def test_zero_rates(self):
         "Test RateCR structure zero rates functions."""
 
@@ -345,3 +389,115 @@ class RateCRTests(unittest.TestCase):
         chi, pval = scipy.stats.chisquare(f_obs, f_exp)
 
         self.assertTrue(pval > 0.1)
+
+
+class RateGroupTests(unittest.TestCase):
+    """Test that rate group structure performs correctly."""
+
+    def setUp(self):
+        self.size = 1000
+        self.rate_struct = RateGroup(self.size)
+        # Rate group is designed for few distinct rates, e.g. one per state
+        self.group_rates = np.random.choice([0.0, 0.5, 1.0, 2.0], self.size)
+
+    def test_get_insert(self):
+        "Test RateGroup structure get/insert rate functions."""
+
+        new_rates = initialise_rates(self.rate_struct, self.size, self.group_rates)
+
+        for i, rate in enumerate(new_rates):
+            self.assertEqual(self.rate_struct.get_rate(i), rate)
+
+        # Move events between groups
+        for i in range(0, self.size, 3):
+            self.rate_struct.insert_rate(i, 1.5)
+
+        for i in range(self.size):
+            expected = 1.5 if i % 3 == 0 else new_rates[i]
+            self.assertEqual(self.rate_struct.get_rate(i), expected)
+
+    def test_total_rate(self):
+        "Test RateGroup structure get total rate functions."""
+
+        new_rates = initialise_rates(self.rate_struct, self.size, self.group_rates)
+
+        self.assertAlmostEqual(self.rate_struct.get_total_rate(), np.sum(new_rates))
+
+        self.rate_struct.bulk_insert(new_rates[::-1])
+
+        self.assertAlmostEqual(self.rate_struct.get_total_rate(), np.sum(new_rates))
+
+    def test_bulk_update(self):
+        "Test RateGroup structure bulk insert/update functions."""
+
+        check_bulk_update(self, self.rate_struct, self.size, self.group_rates)
+
+    def test_empty_groups(self):
+        "Test RateGroup structure removes groups once empty."""
+
+        distinct_rates = np.arange(1, self.size + 1) / self.size
+        initialise_rates(self.rate_struct, self.size, distinct_rates)
+
+        self.assertEqual(len(self.rate_struct.group_rates), self.size)
+        self.assertAlmostEqual(self.rate_struct.get_total_rate(), np.sum(distinct_rates))
+
+        for i in range(0, self.size, 2):
+            self.rate_struct.insert_rate(i, 0.0)
+
+        self.assertEqual(len(self.rate_struct.group_rates), self.size // 2)
+        self.assertEqual(len(self.rate_struct.group_map), self.size // 2)
+        self.assertAlmostEqual(self.rate_struct.get_total_rate(), np.sum(distinct_rates[1::2]))
+        all_n_selected = run_selections(self.rate_struct, self.size, 10000)
+        self.assertEqual(sum(all_n_selected[i] for i in range(0, self.size, 2)), 0)
+
+        for i in range(1, self.size, 2):
+            self.rate_struct.insert_rate(i, 0.0)
+
+        self.assertEqual(len(self.rate_struct.group_rates), 0)
+        self.assertEqual(len(self.rate_struct.group_members), 0)
+        self.assertEqual(self.rate_struct.get_total_rate(), 0.0)
+
+    def test_zero_rates(self):
+        "Test RateGroup structure zero rates functions."""
+
+        new_rates = initialise_rates(self.rate_struct, self.size, self.group_rates)
+
+        self.rate_struct.zero_rates()
+
+        for i in range(self.size):
+            self.assertEqual(self.rate_struct.get_rate(i), 0.0)
+
+        self.assertEqual(self.rate_struct.get_total_rate(), 0.0)
+
+    def test_select_rate(self):
+        "Test RateGroup structure select rate functions."""
+
+        # Check uniform rates
+        new_rates = initialise_rates(self.rate_struct, self.size, np.ones(self.size))
+        niters = int(1e5)
+        all_n_selected = run_selections(self.rate_struct, self.size, niters)
+
+        f_obs = [all_n_selected[i]/niters for i in range(self.size)]
+        f_exp = [self.rate_struct.get_rate(i)/self.rate_struct.get_total_rate()
+                 for i in range(self.size)]
+
+        chi, pval = scipy.stats.chisquare(f_obs, f_exp)
+
+        self.assertTrue(pval > 0.1)
+
+        # Check grouped rates, after moving events between groups
+        new_rates = initialise_rates(self.rate_struct, self.size, self.group_rates)
+
+        all_n_selected = run_selections(self.rate_struct, self.size, niters)
+
+        f_obs = [all_n_selected[i]/niters for i in range(self.size)]
+        f_exp = [self.rate_struct.get_rate(i)/self.rate_struct.get_total_rate()
+                 for i in range(self.size)]
+
+        self.assertEqual(sum(all_n_selected[i] for i in range(self.size) if new_rates[i] == 0), 0)
+
+        chi, pval = scipy.stats.chisquare(
+            [f_obs[i] for i in range(self.size) if new_rates[i] > 0],
+            [f_exp[i] for i in range(self.size) if new_rates[i] > 0])
+
+        self.assertTrue(pval > 0.1)
@@ -0,0 +1,42 @@
+import unittest
+import numpy as np
+from IndividualSimulator.code.scheduler import Scheduler, INTERVENTION, EVENT, OUTPUT
+
+
+class SchedulerTests(unittest.TestCase):
+    """Test ordering and rescheduling of timed actions."""
+
+    def test_order(self):
+        """Test actions run in time order, with interventions before output at the same time."""
+
+        calls = []
+
+        def repeating(name, freq, until):
+            def action(time):
+                calls.append((time, name))
+                next_time = time + freq
+                return next_time if next_time <= until else None
+            return action
+
+        scheduler = Scheduler()
+        scheduler.schedule(1.0, OUTPUT, repeating("output", 1.0, 3.0))
+        scheduler.schedule(0.5, INTERVENTION, repeating("intervention", 0.5, 2.0),
+                           changes_rates=True)
+        scheduler.schedule(None, OUTPUT, repeating("never", 1.0, 3.0))
+        scheduler.schedule(np.inf, OUTPUT, repeating("never", 1.0, 3.0))
+        self.assertEqual(len(scheduler), 2)
+        self.assertEqual(scheduler.head, (0.5, INTERVENTION))
+
+        # Actions due before an event at time 1.0 exclude output at the same time
+        changed = []
+        while scheduler.head < (1.0, EVENT):
+            changed.append(scheduler.run_next())
+        self.assertEqual(calls, [(0.5, "intervention"), (1.0, "intervention")])
+        self.assertEqual(changed, [True, True])
+
+        while scheduler.head < (np.inf, EVENT):
+            scheduler.run_next()
+        self.assertEqual(calls[2:], [(1.0, "output"), (1.5, "intervention"),
+                                     (2.0, "intervention"), (2.0, "output"), (3.0, "output")])
+        self.assertEqual(scheduler.head, (np.inf, OUTPUT))
+        self.assertEqual(len(scheduler), 0)
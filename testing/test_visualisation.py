@@ -0,0 +1,92 @@
+import ast
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import IndividualSimulator
+from IndividualSimulator.code import hosts
+from IndividualSimulator.utilities import visualisation
+
+
+class AnimationFramesTests(unittest.TestCase):
+    """Test precomputed animation frames match host transition times."""
+
+    @classmethod
+    def setUpClass(cls):
+        nhosts = 100
+        with tempfile.TemporaryDirectory() as temp_dir:
+            files = {name: os.path.join(temp_dir, name + ".txt") for name in ["hosts", "init"]}
+            files["output"] = os.path.join(temp_dir, "output")
+            with open(files["hosts"], "w") as outfile:
+                outfile.write(str(nhosts) + "\n" + "".join(
+                    "{0} {1}\n".format(*pos) for pos in 10*np.random.rand(nhosts, 2)))
+            with open(files["init"], "w") as outfile:
+                outfile.write(str(nhosts) + "\n" + "".join(
+                    ("I" if i < 5 else "S") + "\n" for i in range(nhosts)))
+
+            params = IndividualSimulator.code.config.read_config_string(
+                "[Epidemiology]\nModel = SEIR\nInfRate = 2.0\nEAdvRate = 1.0\nIAdvRate = 0.5\n"
+                "KernelType = EXPONENTIAL\n[Simulation]\nSimulationType = INDIVIDUAL\n"
+                "FinalTime = 5\nHostPosFile = {hosts}\nInitCondFile = {init}\nSeed = 1\n"
+                "[Output]\nRasterOutputFreq = 0\nOutputFileStub = {output}\n"
+                "[Optimisation]\nCacheKernel = True\n".format(**files))
+            IndividualSimulator.run_epidemics(params, silent=True)
+
+            cls.hosts_df = pd.read_csv(files["output"] + "_hosts_0.csv")
+            cls.events_df = pd.read_csv(files["output"] + "_events_0.csv")
+
+        cls.nframes = 31
+
+    def _expected_states(self, frames):
+        """Host state indices in each frame, from the timeEnter columns of the host data."""
+
+        transitions = [(time, hosts.STATE_INDEX[column[len("timeEnter"):]], host)
+                       for column in self.hosts_df.columns if column.startswith("timeEnter")
+                       for host, times in enumerate(self.hosts_df[column].values)
+                       for time in ast.literal_eval(times)]
+        transitions.sort()
+
+        all_states = []
+        for frame, frame_time in enumerate(frames.frame_times):
+            if frame == self.nframes - 1:
+                frame_time = np.inf
+            states = self.hosts_df['initial_state'].map(hosts.STATE_INDEX).values.astype(np.int64)
+            for time, state, host in transitions:
+                if time <= frame_time:
+                    states[host] = state
+            all_states.append(states)
+
+        return all_states
+
+    def test_host_states(self):
+        """Test host state in each frame matches state from host transition times."""
+
+        frames = visualisation.AnimationFrames(self.hosts_df, self.events_df, self.nframes)
+        self.assertGreater(len(self.events_df), 0)
+
+        expected = self._expected_states(frames)
+        for frame, states in enumerate(frames.states()):
+            self.assertTrue(np.array_equal(states, expected[frame]))
+        self.assertEqual(frame, self.nframes - 1)
+
+    def test_downsample(self):
+        """Test downsampled cells contain the right hosts, and count their states in each frame."""
+
+        downsample = 4
+        frames = visualisation.AnimationFrames(self.hosts_df, self.events_df, self.nframes,
+                                               downsample=downsample)
+
+        self.assertLessEqual(max(frames.nrows, frames.ncols), downsample)
+        rows, cols = np.divmod(frames.host_cells, frames.ncols)
+        positions = self.hosts_df[['posX', 'posY']].values
+        self.assertTrue(np.all(frames.mins[0] + cols*frames.cellsize <= positions[:, 0]))
+        self.assertTrue(np.all(frames.mins[1] + rows*frames.cellsize <= positions[:, 1]))
+        self.assertTrue(np.all(frames.mins[0] + (cols+1)*frames.cellsize >= positions[:, 0]))
+        self.assertTrue(np.all(frames.mins[1] + (rows+1)*frames.cellsize >= positions[:, 1]))
+
+        expected = self._expected_states(frames)
+        for frame, cell_counts in enumerate(frames.states()):
+            expected_counts = np.zeros((frames.nrows*frames.ncols, len(hosts.ALL_STATES)))
+            np.add.at(expected_counts, (frames.host_cells, expected[frame]), 1)
+            self.assertTrue(np.array_equal(cell_counts, expected_counts))
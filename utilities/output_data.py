@@ -1,6 +1,12 @@
 """Tools for handling output data files."""
 
+import collections
+import collections.abc
+import concurrent.futures
+import threading
+from ..code import columnar
 from ..code import config
+from ..code.eventlog import STATE_NAMES
 from RasterModel import raster_model
 import raster_tools
 import pandas as pd
@@ -10,43 +16,190 @@ import pdb
 
 
 def extract_output_data(output_file_stub):
-    """From an output_file_stub, extract all data as pandas dataframes."""
+    """From an output_file_stub, extract all data as pandas dataframes.
+
+    All iterations are read immediately.  See OutputDataSet for reading iterations as needed.
+    """
 
     params = extract_params(log_file=output_file_stub+".log")
 
     if params['OutputFiles'] is False:
         raise FileNotFoundError("No Output Files!")
 
-    return_data = []
-    niters = params['NIterations']
-    nregions = params['NRegions']
+    return [extract_run_data(output_file_stub, run, params) for run in range(params['NIterations'])]
+
+
+def extract_run_data(output_file_stub, iteration, params=None):
+    """Extract data for a single iteration as pandas dataframes."""
 
-    for run in range(niters):
+    if params is None:
+        params = extract_params(log_file=output_file_stub+".log")
+
+    if params['OutputFormat'] != "csv":
+        run_data = {key: _data_frame(columns) for key, columns in extract_output_columns(
+            output_file_stub, iteration, params=params).items()}
+    else:
         run_data = {}
 
-        if params['OutputHostData'] is True:
-            # extract host data
-            filename = output_file_stub + "_hosts_" + str(run) + ".csv"
-            host_data = pd.read_csv(filename)
-            run_data['host_data'] = host_data
+    if params['OutputHostData'] is True and params['OutputFormat'] == "csv":
+        # extract host data
+        filename = output_file_stub + "_hosts_" + str(iteration) + ".csv"
+        host_data = pd.read_csv(filename)
+        run_data['host_data'] = host_data
+
+    if params['OutputEventData'] is True and params['OutputFormat'] == "csv":
+        # extract event data
+        filename = output_file_stub + "_events_" + str(iteration) + ".csv"
+        event_data = pd.read_csv(filename)
+        run_data['event_data'] = event_data
+
+    if params['SummaryOutputFreq'] > 0:
+        # extract summary data
+        summary_data = {}
+        for region in range(params['NRegions']):
+            filename = (output_file_stub + "_DPC_region" + str(region) + "_" + str(iteration) +
+                        ".csv")
+            summary_data['Region' + str(region)] = pd.read_csv(filename)
+        run_data['summary_data'] = summary_data
+
+    return run_data
+
+
+class OutputDataSet(collections.abc.Sequence):
+    """Run data for each iteration of an output set, read from file only when accessed.
+
+    Indexing gives the same run data dictionaries as extract_output_data.  The cache_size most
+    recently used iterations are kept in memory.  Iterations can be read in advance by a pool of
+    nthreads threads using prefetch; prefetched iterations are added to the cache as they are
+    read.  Use as a context manager, or call close, to stop the thread pool.
+
+    Arguments:
+        output_file_stub:   Stub for simulator output files to extract data from.
+        cache_size:         Maximum number of iterations to keep in memory.
+        nthreads:           Number of threads used to prefetch iterations.
+    """
+
+    def __init__(self, output_file_stub, cache_size=8, nthreads=4):
+        self.output_file_stub = output_file_stub
+        self.params = extract_params(log_file=output_file_stub+".log")
+        if self.params['OutputFiles'] is False:
+            raise FileNotFoundError("No Output Files!")
+
+        self.cache_size = cache_size
+        self.nthreads = nthreads
+        self._cache = collections.OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __len__(self):
+        return self.params['NIterations']
+
+    def __getitem__(self, iteration):
+        if isinstance(iteration, slice):
+            return [self[i] for i in range(*iteration.indices(len(self)))]
+
+        iteration = self._check_index(iteration)
+
+        with self._lock:
+            if iteration in self._cache:
+                self._cache.move_to_end(iteration)
+                return self._cache[iteration]
+            future = self._pending.get(iteration)
+
+        if future is not None:
+            return future.result()
+
+        run_data = extract_run_data(self.output_file_stub, iteration, self.params)
+        self._add_to_cache(iteration, run_data)
+        return run_data
+
+    def prefetch(self, iterations):
+        """Start reading the given iterations in the background, if not already read."""
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.nthreads)
+
+        for iteration in iterations:
+            iteration = self._check_index(iteration)
+            with self._lock:
+                if iteration in self._cache or iteration in self._pending:
+                    continue
+                self._pending[iteration] = self._executor.submit(self._read_iteration, iteration)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check_index(self, iteration):
+        if iteration < 0:
+            iteration += len(self)
+        if not 0 <= iteration < len(self):
+            raise IndexError("Iteration out of range!")
+        return iteration
+
+    def _read_iteration(self, iteration):
+        try:
+            run_data = extract_run_data(self.output_file_stub, iteration, self.params)
+            self._add_to_cache(iteration, run_data)
+            return run_data
+        finally:
+            with self._lock:
+                self._pending.pop(iteration, None)
+
+    def _add_to_cache(self, iteration, run_data):
+        with self._lock:
+            self._cache[iteration] = run_data
+            self._cache.move_to_end(iteration)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def extract_output_columns(output_file_stub, iteration, params=None, mmap=True):
+    """Extract binary format output data for one run, as typed column arrays.
+
+    Returns dictionary with host_data, transition_data and event_data entries, each a dictionary of
+    column arrays, memory-mapped if mmap is True.  States are stored as indices into
+    hosts.ALL_STATES, with -1 for no state.  Host transitions are flat (hostID, time, oldState,
+    newState) arrays, rather than the timeEnter lists of csv output.
+    """
+
+    if params is None:
+        params = extract_params(log_file=output_file_stub+".log")
+
+    output_format = params['OutputFormat']
+    if output_format == "csv":
+        raise ValueError("Output data is in csv format!")
+    extension = columnar.FILE_EXTENSIONS[output_format]
 
-        if params['OutputEventData'] is True:
-            # extract event data
-            filename = output_file_stub + "_events_" + str(run) + ".csv"
-            event_data = pd.read_csv(filename)
-            run_data['event_data'] = event_data
+    file_types = []
+    if params['OutputHostData'] is True and not (
+            params['SimulationType'] == "RASTER" and params['CountOnlyRaster'] is True):
+        file_types += [("host_data", "_hosts_"), ("transition_data", "_transitions_")]
+    if params['OutputEventData'] is True:
+        file_types.append(("event_data", "_events_"))
 
-        if params['SummaryOutputFreq'] > 0:
-            # extract summary data
-            summary_data = {}
-            for region in range(nregions):
-                filename = output_file_stub + "_DPC_region" + str(region) + "_" + str(run) + ".csv"
-                summary_data['Region' + str(region)] = pd.read_csv(filename)
-            run_data['summary_data'] = summary_data
+    return {key: columnar.read_columns(output_file_stub + file_type + str(iteration) + extension,
+                                       output_format, mmap=mmap)
+            for key, file_type in file_types}
 
-        return_data.append(run_data)
 
-    return return_data
+def _data_frame(columns):
+    """Data frame from typed columns, converting state indices to names."""
+
+    data_dict = dict(columns)
+    for key in ["initial_state", "oldState", "newState"]:
+        if key in data_dict:
+            data_dict[key] = STATE_NAMES[data_dict[key]]
+
+    return pd.DataFrame(data_dict, columns=list(columns))
 
 
 def extract_params(config_file=None, log_file=None):
@@ -93,83 +246,67 @@ def create_raster_runs(output_file_stub, timestep=0.01, target_raster=None,
     all_raster_runs = []
 
     for run_number, run in enumerate(all_data):
-        host_map = {}
-        state = np.zeros((nrows*ncols, 2))
-
-        s_dict = {"Cell"+str(i): [] for i in range(nrows*ncols)}
-        i_dict = {"Cell"+str(i): [] for i in range(nrows*ncols)}
-        f_dict = {"Cell"+str(i): [] for i in range(nrows*ncols)}
-        times = []
-
-        # Construct initial state
-        for i, x in enumerate(run['host_data'].columns):
-            if "timeEnter" in x:
-                host_start_idx = i
-                break
-
-        for index, host in run['host_data'].iterrows():
-            # find cell index
-            cell = raster_tools.find_position_in_raster((host['posX'], host['posY']),
-                                                        raster_header=host_raster.header_vals,
-                                                        index=True)
-            if cell == -1:
-                if ignore_outside_raster:
-                    continue
-                else:
-                    raise ValueError("Host not in raster!")
-            host_map[host['hostID']] = cell
-            init_state = host['initial_state']
-            if init_state == "S":
-                state[cell, 0] += 1
-            elif init_state == "I":
-                state[cell, 1] += 1
-            else:
-                raise ValueError("Not S or I!")
-
-        save_state(times, s_dict, i_dict, f_dict, 0.0, state, nrows*ncols)
-
-        print("initial state complete")
-
-        next_time = timestep
-
-        for index, event in run['event_data'].iterrows():
-            while event['time'] > next_time:
-                save_state(times, s_dict, i_dict, f_dict, next_time, state, nrows*ncols)
-                next_time += timestep
-            if event['hostID'] in host_map:
-                cell = host_map[event['hostID']]
-                state[cell, 0] -= 1
-                state[cell, 1] += 1
-
-        save_state(times, s_dict, i_dict, f_dict, next_time, state, nrows*ncols)
-
-        s_dict['time'] = times
-        i_dict['time'] = times
-        f_dict['time'] = times
-
-        results_s = pd.DataFrame(s_dict)
-        results_i = pd.DataFrame(i_dict)
-        results_f = pd.DataFrame(f_dict)
+        results = _raster_frames(run, host_raster.header_vals, timestep, ignore_outside_raster)
 
         model_params = {
             'dimensions': (nrows, ncols),
             'max_hosts': max_hosts
         }
 
-        all_raster_runs.append(
-            raster_model.RasterRun(model_params, (results_s, results_i, results_f)))
+        all_raster_runs.append(raster_model.RasterRun(model_params, results))
 
         print("Run {0} of {1} complete".format(run_number+1, len(all_data)))
 
     return all_raster_runs
 
 
-def save_state(times, s_dict, i_dict, f_dict, time, state, ncells):
-    for i in range(ncells):
-        s_dict["Cell"+str(i)].append(state[i, 0])
-        i_dict["Cell"+str(i)].append(state[i, 1])
-        f_dict["Cell"+str(i)].append(0.0)
-    times.append(time)
+def _raster_frames(run, header, timestep, ignore_outside_raster=False):
+    """S, I and F data frames of cell states at each timestep for one run, as for RasterRun."""
+
+    ncells = header['nrows']*header['ncols']
+    cell_names = ["Cell"+str(i) for i in range(ncells)]
+
+    host_data = run['host_data']
+    host_cells = _host_cells(host_data['posX'].values, host_data['posY'].values, header,
+                             ignore_outside_raster)
+    inside = host_cells >= 0
+
+    # Construct initial state
+    init_states = host_data['initial_state'].values[inside]
+    if not np.all((init_states == "S") | (init_states == "I")):
+        raise ValueError("Not S or I!")
+    init_s = np.bincount(host_cells[inside][init_states == "S"], minlength=ncells)
+    init_i = np.bincount(host_cells[inside][init_states == "I"], minlength=ncells)
+
+    print("initial state complete")
+
+    # Timesteps up to the first at or after the final event, accumulated as repeated sums of
+    # timestep.  Each event is counted from the first timestep not before the event, and
+    # events at time zero from the first timestep after zero, so row 0 is the initial state.
+    event_times = run['event_data']['time'].values
+    final_time = np.max(event_times, initial=0.0)
+    times = np.cumsum(np.full(int(np.ceil(final_time / timestep)) + 2, timestep))
+    times = np.append(0.0, times[:np.searchsorted(times, final_time, side="left") + 1])
+    nsteps = len(times) - 1
+    event_steps = np.maximum(np.searchsorted(times, event_times, side="left"), 1)
+
+    cell_map = np.full(np.max(host_data['hostID'].values, initial=-1) + 1, -1, dtype=np.int64)
+    cell_map[host_data['hostID'].values[inside]] = host_cells[inside]
+    event_cells = cell_map[run['event_data']['hostID'].values.astype(np.int64)]
+    events = event_cells >= 0
+
+    # Number of hosts infected in each cell by each timestep
+    infected = np.zeros((nsteps+1, ncells))
+    np.add.at(infected, (event_steps[events], event_cells[events]), 1)
+    infected = np.cumsum(infected, axis=0)
+
+    results_s = pd.DataFrame(init_s - infected, columns=cell_names)
+    results_i = pd.DataFrame(init_i + infected, columns=cell_names)
+    results_f = pd.DataFrame(np.zeros((nsteps+1, ncells)), columns=cell_names)
+    for results in [results_s, results_i, results_f]:
+        results['time'] = times
+
+    return results_s, results_i, results_f
 
 
 def create_cell_data(output_file_stub, target_header=None, ignore_outside_raster=False):
@@ -204,51 +341,96 @@ def create_cell_data(output_file_stub, target_header=None, ignore_outside_raster
 
     print("Extracting cell data...")
 
-    for run_number, run in enumerate(all_data):
-        host_map = {}
-        states = list(params['Model'])
-        states.append("Culled")
-        state_map = {state: i for i, state in enumerate(states)}
-
-        cell_data = {
-            i: np.array([[0.0] + [0]*len(states)]) for i in range(nrows*ncols)
-        }
+    states = list(params['Model'])
+    states.append("Culled")
+    ncells = nrows*ncols
 
-        values = zip(run['host_data']['hostID'].values,
-                     run['host_data']['posX'].values,
-                     run['host_data']['posY'].values,
-                     run['host_data']['initial_state'].values)
-
-        for hostID, posX, posY, initState in values:
-            # find cell index
-            cell = raster_tools.find_position_in_raster(
-                (posX, posY), raster_header=target_header, index=True)
-            if cell == -1:
-                if ignore_outside_raster:
-                    continue
-                else:
-                    raise ValueError("Host not in raster!")
-            host_map[hostID] = cell
-            cell_data[cell][0, state_map[initState]+1] += 1
-
-        values = zip(run['event_data']['time'].values,
-                     run['event_data']['hostID'].values,
-                     run['event_data']['oldState'].values,
-                     run['event_data']['newState'].values)
-
-        for time, hostID, old, new in values:
-            if hostID in host_map:
-                cell = host_map[hostID]
-                new_row = np.copy(cell_data[cell][-1])
-                new_row[0] = time
-                new_row[state_map[old]+1] -= 1
-                new_row[state_map[new]+1] += 1
-                cell_data[cell] = np.vstack([cell_data[cell], new_row])
-
-        all_cell_data.append(cell_data)
+    for run_number, run in enumerate(all_data):
+        host_data = run['host_data']
+        host_cells = _host_cells(host_data['posX'].values, host_data['posY'].values, target_header,
+                                 ignore_outside_raster)
+        inside = host_cells >= 0
+
+        init_counts = np.zeros((ncells, len(states)), dtype=np.int64)
+        np.add.at(init_counts, (host_cells[inside], _state_indices(
+            host_data['initial_state'].values[inside], states)), 1)
+
+        # Cell of each event, dropping events for hosts outside the raster
+        cell_map = np.full(np.max(host_data['hostID'].values, initial=-1) + 1, -1, dtype=np.int64)
+        cell_map[host_data['hostID'].values[inside]] = host_cells[inside]
+        event_data = run['event_data']
+        event_cells = cell_map[event_data['hostID'].values.astype(np.int64)]
+        events = event_cells >= 0
+        event_cells = event_cells[events]
+        nevents = len(event_cells)
+
+        # Initial row for every cell followed by events, as changes in state counts.  A stable sort
+        # by cell keeps the initial row first and events in time order, and cumulative sums within
+        # each cell then give the state counts after each event.
+        row_cells = np.concatenate([np.arange(ncells), event_cells])
+        row_times = np.concatenate([np.zeros(ncells), event_data['time'].values[events]])
+        deltas = np.zeros((ncells + nevents, len(states)), dtype=np.int64)
+        deltas[:ncells] = init_counts
+        event_rows = np.arange(ncells, ncells + nevents)
+        np.subtract.at(deltas, (event_rows, _state_indices(
+            event_data['oldState'].values[events], states)), 1)
+        np.add.at(deltas, (event_rows, _state_indices(
+            event_data['newState'].values[events], states)), 1)
+
+        order = np.argsort(row_cells, kind="stable")
+        cell_starts = np.searchsorted(row_cells[order], np.arange(ncells))
+        counts = np.cumsum(deltas[order], axis=0)
+        counts -= np.repeat(np.vstack([np.zeros((1, len(states)), dtype=np.int64),
+                                       counts])[cell_starts],
+                            np.diff(np.append(cell_starts, len(order))), axis=0)
+
+        rows = np.column_stack([row_times[order], counts])
+        all_cell_data.append(dict(enumerate(np.split(rows, cell_starts[1:]))))
 
         print("Run {0} of {1} complete".format(run_number+1, len(all_data)))
 
     print("Extraction complete.")
 
     return all_cell_data
+
+
+def _host_cells(pos_x, pos_y, header, ignore_outside_raster=False):
+    """Index of the raster cell containing each host position, or -1 if outside the raster.
+
+    Raises ValueError for hosts outside the raster, unless ignore_outside_raster is True.  Hosts on
+    cell edges or just outside the raster are placed using raster_tools.find_position_in_raster.
+    """
+
+    pos_x = np.asarray(pos_x, dtype=float)
+    pos_y = np.asarray(pos_y, dtype=float)
+    cellsize = header['cellsize']
+    col_pos = (pos_x - header['xllcorner']) / cellsize
+    row_pos = (header['yllcorner'] + header['nrows'] * cellsize - pos_y) / cellsize
+    cols = np.floor(col_pos).astype(np.int64)
+    rows = np.floor(row_pos).astype(np.int64)
+
+    inside = (rows >= 0) & (rows < header['nrows']) & (cols >= 0) & (cols < header['ncols'])
+    cells = np.where(inside, rows * header['ncols'] + cols, -1)
+
+    # Cell is ambiguous on edges, and within a cell of the raster boundary
+    edges = (np.isclose(col_pos, np.round(col_pos)) | np.isclose(row_pos, np.round(row_pos)) |
+             ((rows >= -1) & (rows <= header['nrows']) & (cols >= -1) &
+              (cols <= header['ncols']) & ~inside))
+    for idx in np.flatnonzero(edges):
+        cells[idx] = raster_tools.find_position_in_raster(
+            (pos_x[idx], pos_y[idx]), raster_header=header, index=True)
+
+    if not ignore_outside_raster and np.any(cells < 0):
+        raise ValueError("Host not in raster!")
+
+    return cells
+
+
+def _state_indices(state_names, states):
+    """Index of each state name in the list states."""
+
+    indices = pd.Categorical(state_names, categories=states).codes.astype(np.int64)
+    if np.any(indices < 0):
+        raise ValueError("Unrecognised state!")
+
+    return indices
@@ -66,8 +66,117 @@ def plot_host_landscape(host_file, region_file=None, save_file=None):
     plt.show()
 
 
-def plot_results(hosts_filename="output_hosts_0.csv", event_filename="output_events_0.csv"):
-    """Animate a particular epidemic simulation."""
+class AnimationFrames:
+    """States shown in each frame of an animation of a simulation run.
+
+    The changes in host state between frames are found from the event data in advance, so stepping
+    through frames only updates the hosts that change.  States are host state indices into
+    hosts.ALL_STATES, or if downsample is given, the number of hosts in each state in each cell of a
+    grid with downsample cells across the landscape.
+
+    Arguments:
+        hosts_df:   Host output data.
+        events_df:  Event output data.
+        nframes:    Number of frames, equally spaced from zero to the time of the last event.
+        downsample: If specified, number of grid cells across the landscape to bin hosts into.
+
+    Attributes:
+        frame_times:    Time shown in each frame.  Events are shown from the first frame at or after
+                        the event time.
+        positions:      (x, y) position of each host.
+        host_cells:     Grid cell of each host, numbered row by row from the lower left corner.  Only
+                        set if downsample is given, as are the grid dimensions nrows, ncols, the
+                        lower left corner mins and cellsize.
+    """
+
+    def __init__(self, hosts_df, events_df, nframes, downsample=None):
+        self.nframes = nframes
+        self.downsample = downsample
+
+        self.positions = hosts_df[['posX', 'posY']].values
+        self.init_states = hosts_df['initial_state'].map(hosts.STATE_INDEX).values.astype(np.int64)
+
+        host_index = np.zeros(np.max(hosts_df['hostID'].values) + 1, dtype=np.int64)
+        host_index[hosts_df['hostID'].values] = np.arange(len(hosts_df))
+        self.event_hosts = host_index[events_df['hostID'].values.astype(np.int64)]
+        self.old_states = events_df['oldState'].map(hosts.STATE_INDEX).values.astype(np.int64)
+        self.new_states = events_df['newState'].map(hosts.STATE_INDEX).values.astype(np.int64)
+
+        frame_interval = np.max(events_df['time'].values, initial=0.0) / (nframes - 1)
+        self.frame_times = np.arange(nframes) * frame_interval
+
+        event_frames = np.minimum(np.searchsorted(
+            self.frame_times, events_df['time'].values, side="left"), nframes-1)
+        self.frame_bounds = np.searchsorted(event_frames, np.arange(nframes+1), side="left")
+
+        if downsample is None:
+            # Final state of each host changing within each frame
+            self.frame_changes = []
+            for frame in range(nframes):
+                start, stop = self.frame_bounds[frame], self.frame_bounds[frame+1]
+                changed, last = np.unique(self.event_hosts[start:stop][::-1], return_index=True)
+                self.frame_changes.append((changed, self.new_states[start:stop][::-1][last]))
+        else:
+            # Bin hosts into grid cells, tracking number of hosts in each state in each cell
+            self.mins = np.min(self.positions, axis=0)
+            self.cellsize = np.max(np.max(self.positions, axis=0) - self.mins) / downsample
+            if self.cellsize == 0:
+                self.cellsize = 1.0
+            self.ncols, self.nrows = np.maximum(np.ceil(
+                (np.max(self.positions, axis=0) - self.mins) / self.cellsize).astype(int), 1)
+            cols = np.minimum(((self.positions[:, 0] - self.mins[0]) / self.cellsize).astype(int),
+                              self.ncols-1)
+            rows = np.minimum(((self.positions[:, 1] - self.mins[1]) / self.cellsize).astype(int),
+                              self.nrows-1)
+            self.host_cells = rows * self.ncols + cols
+            self.event_cells = self.host_cells[self.event_hosts]
+
+            self.init_counts = np.zeros((self.nrows*self.ncols, len(hosts.ALL_STATES)))
+            np.add.at(self.init_counts, (self.host_cells, self.init_states), 1)
+
+    def initial_state(self):
+        """State before any frame is applied."""
+
+        if self.downsample is None:
+            return np.copy(self.init_states)
+        return np.copy(self.init_counts)
+
+    def apply_frame(self, state, frame):
+        """Update state in place with the changes shown in frame."""
+
+        if self.downsample is None:
+            changed, states = self.frame_changes[frame]
+            state[changed] = states
+        else:
+            start, stop = self.frame_bounds[frame], self.frame_bounds[frame+1]
+            np.subtract.at(state, (self.event_cells[start:stop], self.old_states[start:stop]), 1)
+            np.add.at(state, (self.event_cells[start:stop], self.new_states[start:stop]), 1)
+
+    def states(self):
+        """Generate the state shown in each frame in turn."""
+
+        state = self.initial_state()
+        for frame in range(self.nframes):
+            self.apply_frame(state, frame)
+            yield state
+
+
+def plot_results(hosts_filename="output_hosts_0.csv", event_filename="output_events_0.csv",
+                 downsample=None, animation_length=5, frame_rate=30):
+    """Animate a particular epidemic simulation.
+
+    The changes in host state between frames are found from the event data before animating, so
+    each frame only updates the hosts that change.  See AnimationFrames.
+
+    Arguments:
+        hosts_filename:     Host data output file.
+        event_filename:     Event data output file.
+        downsample:         If specified, hosts are binned into a grid with this many cells across
+                            the landscape, and each cell is drawn with the average colour of its
+                            hosts' states.  Use for large numbers of hosts.
+        animation_length:   Length of the animation in seconds.
+        frame_rate:         Frames per second.
+    """
 
     state_colours = {
         "S": colors.to_rgba("green"),
@@ -78,77 +187,63 @@ def plot_results(hosts_filename="output_hosts_0.csv", event_filename="output_eve
         "R": colors.to_rgba("grey"),
         "Culled": colors.to_rgba("black"),
     }
+    colour_table = np.array([state_colours[state] for state in hosts.ALL_STATES])
 
-    hosts_df = pd.read_csv(hosts_filename)
-    events_df = pd.read_csv(event_filename)
-
-    for i, x in enumerate(hosts_df.columns):
-        if "timeEnter" in x:
-            host_start_idx = i
-            break
-
-    host_points = np.zeros(len(hosts_df), dtype=[('position', float, 2),
-                                                 ('colour', float, 4)])
-
-    for index, host in hosts_df.iterrows():
-        host_points['position'][index] = (host['posX'], host['posY'])
-        for name, timeEnter in host[host_start_idx:].iteritems():
-            if 0 in eval(timeEnter):
-                state = name[9:]
-        host_points['colour'][index] = state_colours[state]
-
-    initial_colours = host_points['colour'][:]
-
-    frame_rate = 30
-    animation_length = 5
-    frame_interval = max(events_df['time']) / (animation_length * frame_rate)
     nframes = animation_length * frame_rate + 1
+    frames = AnimationFrames(pd.read_csv(hosts_filename), pd.read_csv(event_filename), nframes,
+                             downsample=downsample)
+    positions = frames.positions
 
     fig = plt.figure(figsize=(7, 7))
     ax = fig.add_axes([0, 0, 1, 1], frameon=False)
-    ax.set_xlim(min(host_points['position'][:, 0]), max(host_points['position'][:, 0]))
+    ax.set_xlim(min(positions[:, 0]), max(positions[:, 0]))
     ax.set_xticks([])
-    ax.set_ylim(min(host_points['position'][:, 1]), max(host_points['position'][:, 1]))
+    ax.set_ylim(min(positions[:, 1]), max(positions[:, 1]))
     ax.set_yticks([])
 
-    scat = ax.scatter(host_points['position'][:, 0], host_points['position'][:, 1],
-                      c=host_points['colour'])
+    if downsample is None:
+        artist = ax.scatter(positions[:, 0], positions[:, 1],
+                            c=colour_table[frames.initial_state()])
+
+        def draw(host_states):
+            artist.set_color(colour_table[host_states])
+
+    else:
+        nrows, ncols, mins, cellsize = frames.nrows, frames.ncols, frames.mins, frames.cellsize
+        artist = ax.imshow(np.zeros((nrows, ncols, 4)), origin="lower", interpolation="nearest",
+                           extent=(mins[0], mins[0] + ncols*cellsize,
+                                   mins[1], mins[1] + nrows*cellsize))
+
+        def draw(cell_counts):
+            # Average colour of hosts in each cell, transparent if the cell has no hosts
+            totals = np.maximum(np.sum(cell_counts, axis=1, keepdims=True), 1)
+            artist.set_data((cell_counts @ colour_table / totals).reshape((nrows, ncols, 4)))
 
     time_text = ax.text(0.02, 0.95, '', transform=ax.transAxes, weight="bold", fontsize=12,
                         bbox=dict(facecolor='white', alpha=0.6))
 
-    global start_from_idx
-    start_from_idx = 0
+    current = {'frame': 0, 'state': frames.initial_state()}
 
     def init():
-        global start_from_idx
-        start_from_idx = 0
-        host_points['colour'] = initial_colours
-        new_time = 0
-        scat.set_color(host_points['colour'])
-        time_text.set_text('time = %.3f' % new_time)
+        current['frame'] = 0
+        current['state'] = frames.initial_state()
+        frames.apply_frame(current['state'], 0)
+        draw(current['state'])
+        time_text.set_text('time = %.3f' % 0)
 
-        return scat, time_text
+        return artist, time_text
 
     def update(frame_number):
-        new_time = frame_number * frame_interval
-        global start_from_idx
-
-        row = events_df.iloc[start_from_idx]
-
-        while row['time'] <= new_time:
-            hostID = row['hostID']
-            new_state = row['newState']
-            host_points['colour'][hostID] = state_colours[new_state]
-            start_from_idx += 1
-            if start_from_idx >= len(events_df):
-                break
-            row = events_df.iloc[start_from_idx]
+        if frame_number < current['frame']:
+            init()
+        for frame in range(current['frame']+1, frame_number+1):
+            frames.apply_frame(current['state'], frame)
+        current['frame'] = frame_number
 
-        scat.set_color(host_points['colour'])
-        time_text.set_text('time = %.3f' % new_time)
+        draw(current['state'])
+        time_text.set_text('time = %.3f' % frames.frame_times[frame_number])
 
-        return scat, time_text
+        return artist, time_text
 
     animation = FuncAnimation(fig, update, interval=1000/frame_rate, frames=nframes, blit=True,
                               repeat=False, init_func=init)